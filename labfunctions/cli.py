@@ -23,6 +23,7 @@ def load_client_cli(cli):
 
 def load_server_cli(cli):
     from labfunctions.cmd.agent import agentcli
+    from labfunctions.cmd.bench import benchcli
     from labfunctions.cmd.cluster import clustercli
     from labfunctions.cmd.history import logcli
     from labfunctions.cmd.manager import managercli
@@ -35,6 +36,7 @@ def load_server_cli(cli):
     cli.add_command(agentcli)
     cli.add_command(clustercli)
     cli.add_command(runtimescli)
+    cli.add_command(benchcli)
 
 
 def init_cli():
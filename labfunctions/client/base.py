@@ -296,14 +296,16 @@ class BaseClient:
                     yield evt
                     buffer_ = ""
 
-    def events_publish(self, execid, data, event=None):
+    def events_publish(self, execid, data, event=None, projectid=None):
+        """:param projectid: by default the project of the client"""
         final = data
         if isinstance(data, dict):
             final = json.dumps(data)
         if final:
             evt = types.events.EventSSE(data=final, event=event)
             self._http.post(
-                f"/events/{self.projectid}/{execid}/_publish", json=evt.dict()
+                f"/events/{projectid or self.projectid}/{execid}/_publish",
+                json=evt.dict(),
             )
         else:
             self.logger.warning(f"execid: {execid} empty message")
@@ -5,6 +5,7 @@ from pathlib import Path
 from typing import Any, Dict, Generator, List, Optional, Union
 
 from labfunctions import defaults, errors, secrets, types
+from labfunctions.io.streams import encode_file
 from labfunctions.log import client_logger
 from labfunctions.utils import parse_var_line
 
@@ -25,6 +26,14 @@ class HistoryClient(BaseClient):
             return True
         return False
 
+    def history_resources(self, exec_result: types.ExecutionResult) -> bool:
+        """It adds the usage of the container to a registered execution"""
+        rsp = self._http.post(
+            f"/history/{exec_result.projectid}/_resources/{exec_result.execid}",
+            json=exec_result.resources.dict(),
+        )
+        return rsp.status_code == 204
+
     def history_get_last(
         self, wfid: Optional[str] = None, last=1
     ) -> List[types.HistoryResult]:
@@ -49,6 +58,38 @@ class HistoryClient(BaseClient):
             return types.HistoryResult(**rsp.json())
         return None
 
+    def history_profile(
+        self, wfid: str, last=10, top=10
+    ) -> Union[types.CellProfileResponse, None]:
+        """Slowest cells of the last runs of a workflow"""
+        query = f"/history/{self.projectid}/_profile/{wfid}?lt={last}&top={top}"
+        rsp = self._http.get(query)
+        if rsp.status_code == 200:
+            return types.CellProfileResponse(**rsp.json())
+        return None
+
+    def history_timeline(
+        self, wfid: Optional[str] = None, last=100
+    ) -> Union[types.TimelineResponse, None]:
+        """Percentiles by phase of the timelines of the last executions"""
+        query = f"/history/{self.projectid}/_timeline?lt={last}"
+        if wfid:
+            query = f"{query}&wfid={wfid}"
+        rsp = self._http.get(query)
+        if rsp.status_code == 200:
+            return types.TimelineResponse(**rsp.json())
+        return None
+
+    def history_compare(
+        self, execid: str, other: str
+    ) -> Union[types.CellCompareResponse, None]:
+        """Durations of the cells of `other` against `execid`"""
+        query = f"/history/{self.projectid}/_compare/{execid}/{other}"
+        rsp = self._http.get(query)
+        if rsp.status_code == 200:
+            return types.CellCompareResponse(**rsp.json())
+        return None
+
     def history_get_output(self, uri) -> Generator[bytes, None, None]:
         """uri if ok:
         uri = f"{row.result.output_dir}/{row.result.output_name}"
@@ -63,21 +104,40 @@ class HistoryClient(BaseClient):
             else:
                 raise errors.HistoryNotebookError(self._addr, uri)
 
-    def history_nb_output(self, exec_result: types.ExecutionResult) -> bool:
-        """Upload the notebook from the execution result
-        TODO: zip or compress notebook before upload.
+    def history_nb_output(
+        self,
+        exec_result: types.ExecutionResult,
+        encoding: str = defaults.OUTPUT_ENCODING,
+    ) -> bool:
+        """Upload the notebook from the execution result, compressed and
+        by chunks. Servers without the streamed upload get it as a form.
+
+        :param encoding: one of `io.streams.ENCODINGS`
         :return: True if ok, False if something fails.
         """
-        form_data = dict(output_name=exec_result.output_name)
-
         file_dir = f"{exec_result.output_dir}/{exec_result.output_name}"
+        status = "ok"
+        if exec_result.error:
+            file_dir = f"{exec_result.error_dir}/{exec_result.output_name}"
+            status = "errors"
+
+        rsp = self._http.post(
+            f"/history/{exec_result.projectid}/_put_output",
+            params=dict(output_name=exec_result.output_name, status=status),
+            headers={"Content-Encoding": encoding},
+            content=encode_file(file_dir, encoding),
+        )
+        if rsp.status_code == 201:
+            return True
+        if rsp.status_code != 404:
+            return False
 
+        form_data = dict(output_name=exec_result.output_name)
         _addr = f"/history/{exec_result.projectid}/_output_ok"
         if exec_result.error:
             _addr = f"/history/{exec_result.projectid}/_output_fail"
-            file_dir = f"{exec_result.error_dir}/{exec_result.output_name}"
 
-        files = {"file": open(file_dir)}
+        files = {"file": open(file_dir, "rb")}
         rsp = self._http.post(
             _addr,
             files=files,
@@ -92,3 +152,33 @@ class HistoryClient(BaseClient):
         if rsp.status_code == 200:
             return types.TaskStatus(**rsp.json())
         return None
+
+    def dag_history(self, dagid: str) -> Union[types.HistoryLastResponse, None]:
+        """Executions of the workflows of a DAG run"""
+        rsp = self._http.get(f"/history/{self.projectid}/dag/{dagid}")
+        if rsp.status_code == 200:
+            return types.HistoryLastResponse(**rsp.json())
+        return None
+
+    def task_status_batch(
+        self,
+        execids: List[str],
+        statuses: Optional[Dict[str, str]] = None,
+        timeout: int = 0,
+    ) -> types.TaskBatchResponse:
+        """
+        Status of many tasks in one call.
+
+        :param statuses: last status known of each task, used with timeout
+        :param timeout: secs to wait in the server until some status changes
+        """
+        req = types.TaskBatchRequest(
+            execids=execids, statuses=statuses or {}, timeout=timeout
+        )
+        rsp = self._http.post(
+            "/history/task/_batch",
+            json=req.dict(),
+            timeout=self._timeout + timeout,
+        )
+        rsp.raise_for_status()
+        return types.TaskBatchResponse(**rsp.json())
@@ -13,6 +13,8 @@ from labfunctions.types import (
     ExecutionResult,
     HistoryRequest,
     HistoryResult,
+    MapRun,
+    MapSpec,
     NBTask,
     ProjectData,
     ProjectReq,
@@ -27,6 +29,22 @@ from labfunctions.utils import parse_var_line
 from .base import BaseClient
 
 
+def dag_order(workflows: Dict[str, WorkflowDataWeb]) -> List[str]:
+    """Aliases sorted so upstreams are registered before their downstreams"""
+    ordered: List[str] = []
+
+    def _visit(alias: str, seen: List[str]):
+        if alias in ordered or alias in seen or alias not in workflows:
+            return
+        for up in workflows[alias].depends_on:
+            _visit(up, seen + [alias])
+        ordered.append(alias)
+
+    for alias in workflows:
+        _visit(alias, [])
+    return ordered
+
+
 class WorkflowsClient(BaseClient):
     """Related to workflows"""
 
@@ -70,7 +88,8 @@ class WorkflowsClient(BaseClient):
         _workflows = self.state.snapshot()
         errors = []
         created = []
-        for _, wd in _workflows.workflows.items():
+        for alias in dag_order(_workflows.workflows):
+            wd = _workflows.workflows[alias]
             try:
                 if update:
                     wr = self.workflows_update(wd)
@@ -125,10 +144,16 @@ class WorkflowsClient(BaseClient):
             pass
         return r.status_code
 
+    def _raise_queue_full(self, rsp, qname: str):
+        if rsp.status_code == 429:
+            retry_after = int(rsp.headers.get("Retry-After", 0))
+            raise errors.QueueFull(qname, rsp.json()["reason"], retry_after)
+
     def workflows_enqueue(self, wfid) -> str:
         r = self._http.post(f"/workflows/{self.projectid}/_run/{wfid}")
         if r.status_code == 202:
             return r.json()["execid"]
+        self._raise_queue_full(r, wfid)
         return ""
 
     def notebook_run(
@@ -140,7 +165,13 @@ class WorkflowsClient(BaseClient):
         runtime=None,
         version=None,
         gpu_support=False,
+        mode="notebook",
+        map: Optional[MapSpec] = None,
     ) -> ExecutionNBTask:
+        """
+        :param map: the notebook runs once by partition, the execid of the
+        ctx returned is the mapid (see `map_run`).
+        """
 
         task = NBTask(
             nb_name=nb_name,
@@ -150,15 +181,25 @@ class WorkflowsClient(BaseClient):
             runtime=runtime,
             version=version,
             gpu_support=gpu_support,
+            mode=mode,
+            map=map,
         )
         rsp = self._http.post(
             f"/workflows/{self.projectid}/notebooks/_run", json=task.dict()
         )
+        self._raise_queue_full(rsp, f"{task.cluster}.{task.machine}")
         if rsp.status_code != 202:
             raise AttributeError(rsp.text)
 
         return ExecutionNBTask(**rsp.json())
 
+    def map_run(self, mapid: str) -> Union[MapRun, None]:
+        """State of the partitions of a map"""
+        rsp = self._http.get(f"/workflows/{self.projectid}/_map/{mapid}")
+        if rsp.status_code == 200:
+            return MapRun(**rsp.json())
+        return None
+
     def build_context(
         self,
         wfid: str,
@@ -58,6 +58,40 @@ class CreateRequest(BaseModel):
     max_retry: int = 1
 
 
+class ScalePolicy(BaseModel):
+    """
+    Autoscaling policy of a cluster, machines are created following the
+    demand of its queues and idle machines are destroyed.
+
+    :param min_nodes: machines to keep always
+    :param max_nodes: limit of machines for the cluster
+    :param qnames: queues of the cluster which drive the demand, they will be
+    prefixed with the name of the cluster, like the agent does.
+    :param items_per_node: jobs waiting that justify a new machine
+    :param max_wait: if the oldest job waits more than this secs, one machine
+    is added even if items_per_node is not reached. 0 disables it.
+    :param idle_secs: secs without jobs before a machine is destroyed
+    :param cooldown_secs: secs to wait between two scaling actions
+    :param agent: agent to deploy into the new machines
+    """
+
+    min_nodes: int = 0
+    max_nodes: int = 1
+    qnames: List[str] = ["cpu"]
+    items_per_node: int = 10
+    max_wait: int = 0
+    idle_secs: int = 60 * 10
+    cooldown_secs: int = 60 * 3
+    agent: Optional[DeployAgentRequest] = None
+
+
+class ScaleDecision(BaseModel):
+    cluster_name: str
+    create: int = 0
+    destroy: List[str] = []
+    reason: Optional[str] = None
+
+
 class ClusterSpec(BaseModel):
     """Cluster Specification
     used to group similar machines
@@ -67,6 +101,7 @@ class ClusterSpec(BaseModel):
     :param provider: which provider should be used: gce, aws, local...
     :param location: location where the machine should be created
     :param network: network to be used
+    :param autoscale: scale the cluster by queue demand
     """
 
     name: str
@@ -74,6 +109,7 @@ class ClusterSpec(BaseModel):
     provider: str = "local"
     location: Optional[str] = None
     network: Optional[str] = None
+    autoscale: Optional[ScalePolicy] = None
 
 
 class SSHKey(BaseModel):
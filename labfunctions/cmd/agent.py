@@ -9,7 +9,7 @@ from labfunctions.conf.server_settings import settings
 
 # from labfunctions.control_plane import rqscheduler
 from labfunctions.types.agent import AgentConfig
-from labfunctions.utils import get_external_ip, get_hostname
+from labfunctions.utils import get_external_ip, get_hostname, run_sync
 
 hostname = get_hostname()
 
@@ -57,11 +57,32 @@ def agentcli():
     help="Debug log",
 )
 @click.option("--machine-id", "-m", default=f"localhost/ba/{hostname}")
-def runcli(redis, workers, qnames, cluster, ip_address, agent_name, machine_id, debug):
+@click.option(
+    "--cpus", default=None, type=float, help="CPUs for the tasks, all by default"
+)
+@click.option(
+    "--memory-mb", default=None, type=int, help="Memory for the tasks, all by default"
+)
+def runcli(
+    redis,
+    workers,
+    qnames,
+    cluster,
+    ip_address,
+    agent_name,
+    machine_id,
+    debug,
+    cpus,
+    memory_mb,
+):
     """Run the agent"""
     # pylint: disable=import-outside-toplevel
     # from labfunctions.control_plane import agent
     from labfunctions.control import agent
+    from labfunctions.control.scheduler import JobManager
+    from labfunctions.executors.pool import create_container_pool
+    from labfunctions.executors.pull_cache import create_pull_cache
+    from labfunctions.redis_conn import create_pool
 
     level = "INFO"
     if debug:
@@ -75,8 +96,17 @@ def runcli(redis, workers, qnames, cluster, ip_address, agent_name, machine_id,
     )
 
     agent.set_env(settings)
-    ip_address = ip_address or get_external_ip(settings.DNS_IP_ADDRESS)
     queues = qnames.split(",")
+    jm = JobManager(create_pool(redis))
+    runtimes = run_sync(jm.runtimes_for, [f"{cluster}.{q}" for q in queues])
+    pulled = create_pull_cache(settings).prepull(runtimes)
+    if pulled:
+        logging.info(f"Runtimes pulled: {pulled}")
+    pool = create_container_pool(settings)
+    if pool:
+        for image in settings.DOCKER_POOL_PREWARM:
+            pool.prewarm(image)
+    ip_address = ip_address or get_external_ip(settings.DNS_IP_ADDRESS)
 
     conf = AgentConfig(
         redis_dsn=redis,
@@ -88,6 +118,10 @@ def runcli(redis, workers, qnames, cluster, ip_address, agent_name, machine_id,
         heartbeat_check_every=settings.AGENT_HEARTBEAT_CHECK,
         agent_name=agent_name,
         workers_n=workers,
+        cpus=cpus,
+        memory_mb=memory_mb,
+        batch_size=settings.AGENT_BATCH_SIZE,
+        batch_wait=settings.AGENT_BATCH_WAIT,
     )
 
     agent.run(conf)
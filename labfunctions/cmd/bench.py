@@ -0,0 +1,138 @@
+import tempfile
+
+import click
+from rich import print_json
+from rich.table import Table
+
+from labfunctions.conf import load_server
+from labfunctions.db.nosync import AsyncSQL
+from labfunctions.utils import run_sync
+
+from .utils import console
+
+settings = load_server()
+
+
+@click.group(name="bench")
+def benchcli():
+    """
+    Benchmarks of the control plane
+    """
+    pass
+
+
+def _bench_app(redis: str, sql: str):
+    """The webserver app, with its queue and db replaced by the bench ones"""
+    from labfunctions.server import create_app
+
+    bench_settings = settings.copy(
+        update=dict(
+            QUEUE_REDIS=redis,
+            ASQL=sql,
+            SCHEDULER_RECONCILE_ON_START=False,
+            CLUSTER_FILEPATH=None,
+        )
+    )
+    return create_app(bench_settings, ["workflows", "history"], with_auth_bp=False)
+
+
+async def _create_db(sql: str):
+    db = AsyncSQL(sql)
+    await db.init()
+    await db.create_all()
+    await db.engine.dispose()
+
+
+@benchcli.command(name="dispatch")
+@click.option(
+    "--redis",
+    "-r",
+    required=True,
+    help="Redis used as queue, don't use production",
+)
+@click.option(
+    "--sql", "-s", default=None, help="Async SQL dsn of the history, sqlite by default"
+)
+@click.option("--queue", "-q", default="bench.cpu", help="Queue as cluster.machine")
+@click.option("--number", "-n", default=100, help="Notebooks to enqueue")
+@click.option("--concurrency", "-c", default=10, help="Enqueues in flight")
+@click.option("--workers", "-w", default=1, help="Workers listening the queue")
+@click.option("--max-jobs", "-m", default=5, help="Concurrent jobs by worker")
+@click.option("--work", default=0.0, help="Secs that each fake notebook takes")
+@click.option("--timeout", "-t", default=300, help="Secs to wait for the results")
+@click.option("--json", "as_json", is_flag=True, default=False, help="Print json")
+def dispatchcli(
+    redis, sql, queue, number, concurrency, workers, max_jobs, work, timeout, as_json
+):
+    """Latency from the request of a notebook to the registration of its result"""
+    from labfunctions.control.bench import DispatchBench
+    from labfunctions.security import auth_from_settings
+
+    sql = sql or f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench.db"
+    run_sync(_create_db, sql)
+    auth = auth_from_settings(settings.SECURITY)
+    bench = DispatchBench(
+        _bench_app(redis, sql),
+        redis,
+        settings=settings,
+        token=auth.encode({"usr": "bench", "scopes": ["user:r:w"]}),
+        qname=queue,
+        workers=workers,
+        max_jobs=max_jobs,
+        work_secs=work,
+    )
+    result = run_sync(bench.run, number, concurrency=concurrency, timeout=timeout)
+    if as_json:
+        print_json(data=result.dict())
+        return
+
+    table = Table(title=f"Dispatch of {result.submissions} notebooks")
+    for col in ["phase", "count", "p50", "p95", "p99", "max"]:
+        table.add_column(col, justify="right")
+    for p in result.phases:
+        table.add_row(
+            p.phase, str(p.count), str(p.p50), str(p.p95), str(p.p99), str(p.max)
+        )
+    console.print(table)
+    console.print(
+        f"completed: {result.completed} failed: {result.failed} "
+        f"elapsed: {result.elapsed} secs"
+    )
+
+
+@benchcli.command(name="codec")
+@click.option(
+    "--redis",
+    "-r",
+    required=True,
+    help="Redis used to measure memory, don't use production",
+)
+@click.option("--depth", "-d", default=100_000, help="Jobs queued by codec")
+@click.option("--samples", "-n", default=1000, help="Contexts encoded by codec")
+@click.option(
+    "--codec", "-c", "codecs", multiple=True, help="Codecs to compare, all by default"
+)
+@click.option("--json", "as_json", is_flag=True, default=False, help="Print json")
+def codeccli(redis, depth, samples, codecs, as_json):
+    """Size, speed and redis memory of the payload codecs of notebook jobs"""
+    from labfunctions.control.bench import CodecBench
+
+    bench = CodecBench(redis, depth=depth, samples=samples, codecs=list(codecs))
+    results = run_sync(bench.run)
+    if as_json:
+        print_json(data=[r.dict() for r in results])
+        return
+
+    base = results[0]
+    table = Table(title=f"Payload codecs, {depth} jobs queued")
+    for col in ["codec", "bytes", "encode us", "decode us", "redis MB", "saved"]:
+        table.add_column(col, justify="right")
+    for r in results:
+        mb, saved = "-", "-"
+        if r.redis_bytes is not None:
+            mb = str(round(r.redis_bytes / 2**20, 1))
+            saved = f"{round((1 - r.redis_bytes / max(base.redis_bytes, 1)) * 100)}%"
+        table.add_row(
+            r.codec, str(r.payload_bytes), str(r.encode_us), str(r.decode_us), mb, saved
+        )
+    console.print(table)
@@ -10,10 +10,12 @@ from labfunctions.client.diskclient import DiskClient
 from labfunctions.conf import load_client
 from labfunctions.context import create_dummy_ctx
 from labfunctions.executors import jupyter_exec
+from labfunctions.executors.batch import run_batch
 from labfunctions.executors.docker_exec import docker_exec
+from labfunctions.executors.handoff import load_handoff, task_context
 from labfunctions.executors.local_exec import local_exec_env
 from labfunctions.hashes import generate_random
-from labfunctions.types import NBTask
+from labfunctions.types import ExecutionNBTask, NBTask
 
 from .utils import ConfigCli, console, watcher
 
@@ -56,20 +58,21 @@ def local(from_file, url_service, local, wfid):
     """Used by the agent to run workloads or for development purposes"""
     rsp = None
 
-    if os.environ.get(defaults.EXECUTIONTASK_VAR):
+    load_handoff()
+    ctx = task_context()
+    if ctx:
 
         nbclient = client.from_env()
         console.print(f"=> Starting work inside container")
         console.print(f"=> Current dir: {os.getcwd()}")
         console.print(f"=> Base PATH: {nbclient.base_path}")
         console.print(f"=> Service url: {nbclient._addr}")
-        rsp = local_exec_env()
+        rsp = local_exec_env(ExecutionNBTask(**ctx))
 
     elif wfid:
         c = client.from_file(from_file, url_service=url_service)
         exec_task = c.build_context(wfid)
-        os.environ[defaults.EXECUTIONTASK_VAR] = exec_task.json()
-        rsp = local_exec_env()
+        rsp = local_exec_env(exec_task)
     else:
         console.print(
             f"[red]Neither [bold magenta]wfid[/bold magenta] param or "
@@ -86,6 +89,13 @@ def local(from_file, url_service, local, wfid):
         console.print(f"=>[bold green] WFID: {rsp.wfid} locally executed[/]")
 
 
+@executorscli.command()
+def batch():
+    """Used by the agent to run a batch of tasks in one container"""
+    failed = run_batch()
+    console.print(f"=> Batch finished, {failed} tasks failed")
+
+
 # @executorscli.command()
 # @click.option(
 #     "--from-file",
@@ -183,6 +193,29 @@ def local(from_file, url_service, local, wfid):
     default=False,
     help="Get events & logs from the executions",
 )
+@click.option(
+    "--stats",
+    is_flag=True,
+    default=False,
+    help="Show the memory and cpu used while watching",
+)
+@click.option(
+    "--cell-cache",
+    "-C",
+    default=None,
+    type=click.Choice(["local", "fileserver"]),
+    help="Resume a local run from its checkpoint cells",
+)
+@click.option(
+    "--cell-cache-min", default=24 * 60, help="Minutes while a checkpoint is valid"
+)
+@click.option(
+    "--script",
+    "-S",
+    is_flag=True,
+    default=False,
+    help="Run the notebook as a python module, without kernel",
+)
 @click.argument("notebook")
 def notebook(
     url_service,
@@ -196,12 +229,17 @@ def notebook(
     notebook,
     gpu,
     watch,
+    stats,
+    cell_cache,
+    cell_cache_min,
+    script,
 ):
     """On demand execution of a notebook file, with custom parameters"""
     # from labfunctions.executors.development import local_nb_dev_exec
 
     c = client.from_file(from_file, url_service=url_service)
     params_dict = _parse_params_args(param)
+    mode = "script" if script else "notebook"
 
     if not local:
         rsp = c.notebook_run(
@@ -212,20 +250,50 @@ def notebook(
             runtime=runtime,
             version=version,
             gpu_support=gpu,
+            mode=mode,
         )
         # print_json(rsp.json())
         if watch:
-            watcher(c, rsp.execid, stats=False)
+            watcher(c, rsp.execid, stats=stats)
         print_json(data=rsp.dict())
     else:
-        ctx = create_dummy_ctx(c.projectid, notebook, params_dict, gpu_support=gpu)
-        os.environ[defaults.EXECUTIONTASK_VAR] = ctx.json()
+        ctx = create_dummy_ctx(
+            c.projectid, notebook, params_dict, gpu_support=gpu, mode=mode
+        )
         os.environ["LF_LOCAL"] = "yes"
-        result = local_exec_env()
+        if cell_cache:
+            os.environ[defaults.CELL_CACHE_VAR] = json.dumps(
+                dict(strategy=cell_cache, valid_for_min=cell_cache_min)
+            )
+        result = local_exec_env(ctx)
         # rsp = local_nb_dev_exec(task)
         print_json(data=result.dict())
 
 
+@executorscli.command()
+@click.option("--addr", "-a", default="0.0.0.0", help="Address to listen")
+@click.option("--port", "-p", default=defaults.WARM_PORT, help="Port to listen")
+@click.option("--kernels", "-k", default=False, is_flag=True, help="Keep a warm kernel")
+@click.option("--preload", default="", help="Modules imported in the kernel")
+@click.option("--kernel-max-runs", default=20, help="Runs before a new kernel")
+@click.option("--kernel-max-mem", default=1024, help="Kernel memory limit in MB")
+def warm(addr, port, kernels, preload, kernel_max_runs, kernel_max_mem):
+    """Used inside the warm containers of the agent to run tasks"""
+    from labfunctions.executors.warm import warm_serve
+
+    pool = None
+    if kernels:
+        from labfunctions.executors.kernels import KernelPool
+
+        pool = KernelPool(
+            preload=[m for m in preload.split(",") if m],
+            max_runs=kernel_max_runs,
+            max_mem_mb=kernel_max_mem,
+        )
+    console.print(f"=> Warm executor listening on {addr}:{port}")
+    warm_serve(addr, port, kernels=pool)
+
+
 @executorscli.command()
 # @click.option("--runtime", "-r", default=None, help="Runtime to use")
 # @click.option("--version", "-v", default=None, help="Runtime version to run")
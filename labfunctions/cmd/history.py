@@ -151,14 +151,30 @@ def getcli(url_service, from_file, execid, nice):
     default=URL,
     help="URL of the Lab Function service",
 )
+@click.option(
+    "--wait",
+    "-w",
+    default=0,
+    help="Secs to wait until the status of some task changes",
+)
 # @click.option("--nice", "-n", is_flag=True, default=True, help="Print nice output")
-@click.argument("execid")
-def taskcli(url_service, from_file, execid):
-    """log detail of a execution"""
+@click.argument("execids", nargs=-1, required=True)
+def taskcli(url_service, from_file, wait, execids):
+    """log detail of one or many executions"""
     c = client.from_file(from_file, url_service=url_service)
-    rsp = c.task_status(execid)
-    if not rsp:
-        console.print(f"[red bold](x) Execution id {execid} not found[/]")
-        sys.exit(-1)
-
-    print_json(data=rsp.dict())
+    if len(execids) == 1 and not wait:
+        rsp = c.task_status(execids[0])
+        if not rsp:
+            console.print(f"[red bold](x) Execution id {execids[0]} not found[/]")
+            sys.exit(-1)
+        print_json(data=rsp.dict())
+        return
+
+    batch = c.task_status_batch(list(execids))
+    if wait:
+        statuses = {
+            execid: task.status if task else "not_found"
+            for execid, task in batch.tasks.items()
+        }
+        batch = c.task_status_batch(list(execids), statuses=statuses, timeout=wait)
+    print_json(data=batch.dict())
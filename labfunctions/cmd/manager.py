@@ -202,6 +202,71 @@ def agent(sql, scopes, username, action, admin, exp, refresh):
             console.print(f"=> [magenta]{ag}[/]")
 
 
+@managercli.command()
+@click.option(
+    "--every", "-e", default=settings.AUTOSCALE_EVERY_SECS, help="Secs between checks"
+)
+@click.option("--once", is_flag=True, default=False, help="Check only once")
+def autoscaler(every, once):
+    """Scale clusters with an autoscale policy following their queues"""
+    from labfunctions.control.autoscaler import create_autoscaler
+
+    scaler = create_autoscaler(settings)
+    if once:
+        decisions = run_sync(scaler.run_once)
+        print_json(data=[d.dict() for d in decisions])
+    else:
+        console.print(f"[bold magenta]Autoscaler checking every {every} secs[/]")
+        run_sync(scaler.run, every)
+
+
+@managercli.command()
+@click.option(
+    "--interval",
+    "-i",
+    default=settings.SCHEDULER_INTERVAL_SECS,
+    help="Secs between checks",
+)
+def scheduler(interval):
+    """Run a scheduler process, many of them share the periodic workflows"""
+    from labfunctions.control.shards import create_sharded_scheduler
+
+    sched = create_sharded_scheduler(settings, interval=interval)
+    console.print(
+        f"[bold magenta]Scheduler {sched.id} for {sched.shards} shards "
+        f"checking every {interval} secs[/]"
+    )
+    run_sync(sched.run)
+
+
+@managercli.command()
+@click.option("--page-size", "-p", default=500, help="Workflows by page")
+@click.option("--dry-run", is_flag=True, default=False, help="Only report the drift")
+def reconcile(page_size, dry_run):
+    """Rebuild the schedule of the workflows from the database"""
+    from labfunctions.control import JobManager
+    from labfunctions.control.reconcile import Reconciler
+    from labfunctions.redis_conn import create_pool
+
+    async def _reconcile():
+        db = AsyncSQL(settings.ASQL)
+        await db.init()
+        jm = JobManager(
+            create_pool(settings.QUEUE_REDIS), shards=settings.SCHEDULER_SHARDS
+        )
+        session = db.sessionmaker()
+        async with session.begin():
+            report = await Reconciler(jm, page_size=page_size, dry_run=dry_run).run(
+                session
+            )
+        await session.close()
+        await db.engine.dispose()
+        return report
+
+    report = run_sync(_reconcile)
+    print_json(data=report.dict())
+
+
 @managercli.command()
 def shell():
     """starts a IPython REPL console with db objects and models"""
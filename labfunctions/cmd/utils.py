@@ -68,6 +68,8 @@ def watcher(c: DiskClient, execid, stats=False):
             _mem = _stats["mem"]["mem_usage"]
             mem = format_bytes(_mem)
             msg = f"[orange]Memory used {mem}[/]"
+            if "cpu" in _stats:
+                msg = f"{msg} [orange]CPU {_stats['cpu']['cpu_pct']}%[/]"
             console.print(msg)
         elif evt.event == "result":
             keep = False
@@ -21,6 +21,11 @@ from labfunctions.types.docker import (
 )
 from labfunctions.utils import mkdir_p
 
+# a container with the name of the task in these states is left over
+STOPPED_STATES = ["created", "exited", "dead"]
+# status of a run skipped because its container is still running
+RUNNING_STATUS = -4
+
 
 def shell(
     command: str, check=True, input=None, cwd=None, silent=False, env=None
@@ -122,6 +127,33 @@ class DockerCommand:
             pass
         return result
 
+    def _kill(self, container):
+        try:
+            container.kill()
+        except docker.errors.APIError as e:
+            # it exited after the wait
+            log.error_logger.warning(f"Kill of {container.id}: {e}")
+
+    def _remove(self, container):
+        try:
+            container.remove(force=True)
+        except docker.errors.APIError as e:
+            log.error_logger.error(f"Remove of {container.id}: {e}")
+
+    def _remove_named(self, name: str) -> bool:
+        """It returns False if the container is still running"""
+        try:
+            container = self.docker.containers.get(name)
+        except docker.errors.NotFound:
+            return True
+        except docker.errors.APIError as e:
+            log.error_logger.error(f"Lookup of container {name}: {e}")
+            return True
+        if container.status not in STOPPED_STATES:
+            return False
+        self._remove(container)
+        return True
+
     def run(
         self,
         cmd: str,
@@ -136,7 +168,16 @@ class DockerCommand:
         ports=None,
         resources=DockerResources(),
         volumes: List[DockerVolume] = [],
+        name: Optional[str] = None,
+        sampler=None,
     ) -> DockerRunResult:
+        """
+        :param name: a container with the same name, left by a previous
+        attempt, is removed before the run. If it is still running, the
+        task was delivered twice: the run is skipped with `RUNNING_STATUS`.
+        :param sampler: it reads the stats of the container while it runs,
+        see `executors.stats.StatsSampler`.
+        """
 
         # runtime = None
         device_requests = []
@@ -146,8 +187,16 @@ class DockerCommand:
                 docker.types.DeviceRequest(count=gpu_count, capabilities=[["gpu"]])
             ]
 
+        binds = {v.orig_mount: {"bind": v.dst_mount, **v.extra} for v in volumes}
+
+        if name and not self._remove_named(name):
+            msg = f"Container {name} is already running"
+            log.error_logger.warning(msg)
+            return DockerRunResult(msg=msg, status=RUNNING_STATUS)
+
         logs = ""
         status_code = -1
+        container = None
         try:
             log.server_logger.debug(f"image: {image}, cmd: {cmd}, gpu: {require_gpu}")
             container = self.docker.containers.run(
@@ -159,16 +208,18 @@ class DockerCommand:
                 network_mode=network_mode,
                 device_requests=device_requests,
                 ports=ports,
+                name=name,
+                volumes=binds or None,
                 **resources.dict(),
             )
+            if sampler:
+                sampler.start(container)
             result = self._wait_result(container, timeout)
             if not result:
-                container.kill()
+                self._kill(container)
             else:
                 status_code = result["StatusCode"]
             logs = container.logs().decode("utf-8")
-            if remove:
-                container.remove()
         except docker.errors.ContainerError as e:
             log.error_logger.error(str(e))
             logs = str(e)
@@ -177,6 +228,11 @@ class DockerCommand:
             logs = str(e)
             log.error_logger.error(str(e))
             status_code = -3
+        finally:
+            if sampler:
+                sampler.stop()
+            if container is not None and remove:
+                self._remove(container)
 
         for line in logs:
             log.server_logger.debug(line)
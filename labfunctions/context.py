@@ -23,9 +23,10 @@ def create_dummy_ctx(
     params: Dict[str, Any] = {},
     execid=None,
     gpu_support=False,
+    mode="notebook",
 ) -> ExecutionNBTask:
     dummy_id = execid or _dummy_wfid()
-    task = NBTask(nb_name=nb_name, params=params, gpu_support=gpu_support)
+    task = NBTask(nb_name=nb_name, params=params, gpu_support=gpu_support, mode=mode)
 
     ctx = create_notebook_ctx(projectid, task, execid=dummy_id)
     return ctx
@@ -92,4 +93,5 @@ def create_notebook_ctx(
         created_at=_now,
         notifications_ok=task.notifications_ok,
         notifications_fail=task.notifications_fail,
+        mode=task.mode,
     )
@@ -1 +1,3 @@
+from .fairq import FairQueue
 from .scheduler import JobManager, SchedulerExec
+from .worker import FairWorker
@@ -0,0 +1,21 @@
+from labfunctions import errors, types
+
+
+def check_admission(stats: types.QueueStats, limits: types.QueueLimits):
+    """
+    It raises QueueFull if a new task for the queue exceeds its limits.
+    The retry time suggested grows with the age of the oldest job,
+    so clients back off more when the queue is not draining.
+    """
+    retry_after = limits.retry_after
+    if limits.require_workers and stats.workers == 0:
+        raise errors.QueueFull(stats.qname, "no workers listening", retry_after)
+    if limits.max_depth and stats.depth >= limits.max_depth:
+        raise errors.QueueFull(stats.qname, f"{stats.depth} tasks waiting", retry_after)
+    if limits.max_age and (stats.oldest_age or 0) > limits.max_age:
+        retry_after = max(retry_after, int(stats.oldest_age - limits.max_age))
+        raise errors.QueueFull(
+            stats.qname,
+            f"oldest task waiting for {int(stats.oldest_age)} secs",
+            retry_after,
+        )
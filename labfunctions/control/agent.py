@@ -1,7 +1,7 @@
 import os
 import sys
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 from libq.job_store import RedisJobStore
 from libq.scheduler import Scheduler
@@ -9,13 +9,16 @@ from libq.scheduler import Scheduler
 # from .heartbeat import HeartbeatThread
 # from .register import AgentRegister
 # from .worker import start_worker
-from libq.worker import AsyncWorker
-
 from labfunctions.hashes import generate_random
 from labfunctions.redis_conn import create_pool
 from labfunctions.types import ServerSettings
 from labfunctions.types.agent import AgentConfig, AgentNode
 
+from .batch import Batcher
+from .capacity import Capacity, host_capacity
+from .scheduler import SchedulerExec
+from .worker import FairWorker
+
 
 def set_env(settings: ServerSettings):
     sys.path.append(settings.BASE_PATH)
@@ -24,6 +27,20 @@ def set_env(settings: ServerSettings):
     os.environ["LF_WORKFLOW_SERVICE"] = settings.WORKFLOW_SERVICE
 
 
+def create_batcher(
+    conf: AgentConfig, capacity: Optional[Capacity] = None
+) -> Optional[Batcher]:
+    if conf.batch_size < 2:
+        return None
+    return Batcher(
+        SchedulerExec.tasks["notebook"],
+        SchedulerExec.tasks["notebook_batch"],
+        max_size=conf.batch_size,
+        max_wait=conf.batch_wait,
+        capacity=capacity,
+    )
+
+
 def run(conf: AgentConfig):
     """
     This is the main function which start workers by agent by machine.
@@ -46,6 +63,8 @@ def run(conf: AgentConfig):
     conn = create_pool(conf.redis_dsn)
     _now = int(datetime.utcnow().timestamp())
     pid = os.getpid()
+    cpus, memory_mb = host_capacity()
+    capacity = Capacity(conf.cpus or cpus, conf.memory_mb or memory_mb)
     node = AgentNode(
         ip_address=conf.ip_address,
         name=name,
@@ -55,16 +74,19 @@ def run(conf: AgentConfig):
         qnames=conf.qnames,
         workers=[],
         birthday=_now,
+        resources=capacity.stats(),
     )
     store = RedisJobStore()
     scheduler = Scheduler(store, conn=conn)
-    worker = AsyncWorker(
+    worker = FairWorker(
         queues=",".join(cluster_queues),
         conn=conn,
         id=name,
         heartbeat_secs=conf.heartbeat_check_every,
         metadata=node.dict(),
         max_jobs=conf.workers_n,
+        capacity=capacity,
+        batcher=create_batcher(conf, capacity),
     )
 
     worker.run()
@@ -0,0 +1,205 @@
+import asyncio
+import math
+from typing import Dict, List, Optional
+
+from libq.types import JobStatus
+from libq.utils import elapsed_from, now_secs
+from libq.worker import Workers
+
+from labfunctions import cluster, log, types
+from labfunctions.cluster.types import ScaleDecision, ScalePolicy
+from labfunctions.redis_conn import create_pool
+
+from .scheduler import SchedulerExec
+
+AUTOSCALE_PREFIX = "lf.as::"
+# tasks of a libq worker which are not jobs
+WORKER_TASKS = {"heartbeat", "commands", "scheduler"}
+_DONE = {
+    JobStatus.complete.name,
+    JobStatus.failed.name,
+    JobStatus.canceled.name,
+}
+
+
+def scale_decision(
+    cluster_name: str,
+    policy: ScalePolicy,
+    *,
+    nodes: int,
+    inflight: int,
+    depth: int,
+    oldest_age: Optional[float],
+    idle: List[str],
+    since_last: Optional[float] = None,
+) -> ScaleDecision:
+    """
+    Decides how many machines to create or which machines to destroy.
+
+    :param nodes: machines registered in the cluster
+    :param inflight: creations enqueued but not finished yet
+    :param depth: jobs waiting in the queues of the cluster
+    :param oldest_age: secs waiting of the oldest job
+    :param idle: names of the machines idle for more than the policy allows
+    :param since_last: secs since the last scaling action
+    """
+    decision = ScaleDecision(cluster_name=cluster_name)
+    total = nodes + inflight
+    if total < policy.min_nodes:
+        decision.create = policy.min_nodes - total
+        decision.reason = "min_nodes"
+        return decision
+
+    if since_last is not None and since_last < policy.cooldown_secs:
+        return decision
+
+    desired = math.ceil(depth / max(policy.items_per_node, 1))
+    reason = "depth"
+    if policy.max_wait and (oldest_age or 0) > policy.max_wait and desired <= total:
+        desired = total + 1
+        reason = "max_wait"
+    desired = min(max(desired, policy.min_nodes), policy.max_nodes)
+
+    if desired > total:
+        decision.create = desired - total
+        decision.reason = reason
+    elif depth == 0 and inflight == 0:
+        removable = max(nodes - policy.min_nodes, 0)
+        decision.destroy = idle[:removable]
+        if decision.destroy:
+            decision.reason = "idle"
+    return decision
+
+
+class Autoscaler:
+    """
+    It watches the queues and the agents of each cluster with an autoscale
+    policy and enqueues the creation or destruction of machines.
+
+    Machines are matched with their agents by the `machine_id` that the agent
+    registers as metadata of its worker.
+
+    :param cc: ClusterControl used to get the specs and the machines
+    :param scheduler: used to enqueue the tasks and to read the queues
+    """
+
+    def __init__(self, cc: cluster.ClusterControl, scheduler: SchedulerExec):
+        self.cc = cc
+        self.scheduler = scheduler
+        self.conn = scheduler.conn
+
+    def _key(self, kind: str, cluster_name: str) -> str:
+        return f"{AUTOSCALE_PREFIX}{kind}:{cluster_name}"
+
+    def qnames(self, cluster_name: str, policy: ScalePolicy) -> List[str]:
+        return [f"{cluster_name}.{q}" for q in policy.qnames]
+
+    async def inflight(self, cluster_name: str) -> int:
+        """Creations still running, finished ones are removed"""
+        key = self._key("inflight", cluster_name)
+        execids = await self.conn.smembers(key)
+        for execid in execids:
+            task = await self.scheduler.get_task(execid)
+            if not task or task.status in _DONE:
+                await self.conn.srem(key, execid)
+        return await self.conn.scard(key)
+
+    async def since_last(self, cluster_name: str) -> Optional[float]:
+        last = await self.conn.get(self._key("last", cluster_name))
+        if not last:
+            return None
+        return now_secs() - float(last)
+
+    async def idle_machines(self, cluster_name: str, policy: ScalePolicy) -> List[str]:
+        """Machines whose agents didn't run jobs for `idle_secs`"""
+        busy: Dict[str, bool] = {}
+        workers = Workers(self.conn)
+        for qname in self.qnames(cluster_name, policy):
+            for wid in await workers.list(qname):
+                info = await workers.get_info(wid)
+                if not info or not info.metadata:
+                    continue
+                machine_id = info.metadata.get("machine_id")
+                jobs = [t for t in info.tasks_names if t not in WORKER_TASKS]
+                is_busy = bool(jobs) or elapsed_from(info.last_job) < policy.idle_secs
+                busy[machine_id] = busy.get(machine_id, False) or is_busy
+
+        idle = []
+        for name in sorted(await self.cc.list_instances(cluster_name)):
+            instance = await self.cc.get_instance(name)
+            if instance and busy.get(instance.machine_id) is False:
+                idle.append(name)
+        return idle
+
+    async def evaluate(self, cluster_name: str, policy: ScalePolicy) -> ScaleDecision:
+        depth = 0
+        ages = []
+        for qname in self.qnames(cluster_name, policy):
+            Q = self.scheduler.fair_queue(qname)
+            depth += await Q.depth()
+            age = await Q.oldest_age()
+            if age is not None:
+                ages.append(age)
+        nodes = len(await self.cc.list_instances(cluster_name))
+        return scale_decision(
+            cluster_name,
+            policy,
+            nodes=nodes,
+            inflight=await self.inflight(cluster_name),
+            depth=depth,
+            oldest_age=max(ages) if ages else None,
+            idle=await self.idle_machines(cluster_name, policy),
+            since_last=await self.since_last(cluster_name),
+        )
+
+    async def apply(self, decision: ScaleDecision, policy: ScalePolicy):
+        name = decision.cluster_name
+        if not decision.create and not decision.destroy:
+            return
+        log.server_logger.info(
+            f"Autoscaling {name} by {decision.reason}: "
+            f"create {decision.create}, destroy {decision.destroy}"
+        )
+        for _ in range(decision.create):
+            req = cluster.CreateRequest(cluster_name=name, agent=policy.agent)
+            job = await self.scheduler.enqueue_instance_creation(req)
+            await self.conn.sadd(self._key("inflight", name), job._id)
+        for machine in decision.destroy:
+            req = cluster.DestroyRequest(cluster_name=name, machine_name=machine)
+            await self.scheduler.enqueue_instance_destruction(req)
+        await self.conn.set(self._key("last", name), now_secs())
+
+    async def run_once(self) -> List[ScaleDecision]:
+        decisions = []
+        for name in self.cc.cluster.list_clusters():
+            policy = self.cc.get_cluster(name).autoscale
+            if not policy:
+                continue
+            decision = await self.evaluate(name, policy)
+            await self.apply(decision, policy)
+            decisions.append(decision)
+        return decisions
+
+    async def run(self, every_secs: int = 30):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                log.server_logger.error(f"Autoscaler failed: {e}")
+            await asyncio.sleep(every_secs)
+
+
+def create_autoscaler(settings: types.ServerSettings) -> Autoscaler:
+    cc = cluster.ClusterControl(
+        settings.CLUSTER_FILEPATH,
+        ssh_user=settings.CLUSTER_SSH_KEY_USER,
+        ssh_key_public_path=settings.CLUSTER_SSH_PUBLIC_KEY,
+        conn=create_pool(settings.WEB_REDIS),
+    )
+    scheduler = SchedulerExec(
+        create_pool(settings.QUEUE_REDIS),
+        control_queue=settings.CONTROL_QUEUE,
+        build_queue=settings.BUILD_QUEUE,
+        settings=settings,
+    )
+    return Autoscaler(cc, scheduler)
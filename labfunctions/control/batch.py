@@ -0,0 +1,141 @@
+"""
+Short notebooks of a project which opt in with `NBTask.batch` are grouped
+by the agent and run in one container session (see `executors.batch`).
+
+The scheduler keeps a batch key in the metadata of their jobs: tasks
+with the same project, runtime and gpu support can share a container.
+The worker still takes, reserves and finishes each job by itself, only
+the call of the function is grouped: the jobs are kept by the `Batcher`
+until `max_size` have the same key or `max_wait` secs passed since the
+first one, then one call of the batch function runs all of them, in a
+process pool kept by the batcher until the worker stops. With a
+`Capacity`, a group reserves the largest requests of its jobs, as its
+container is limited (see `executors.nbtask_base.batch_resources`).
+"""
+import asyncio
+import concurrent.futures
+import traceback
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from libq import types
+from libq.logs import logger
+from libq.utils import get_function
+
+from .capacity import Capacity, job_requests
+
+BATCH_META = "batch"
+
+
+def batch_meta(projectid: str, runtime: str, gpu: bool = False) -> Dict[str, Any]:
+    """Batch key as kept in the metadata of a job"""
+    return {BATCH_META: f"{projectid}|{runtime}|{int(gpu)}"}
+
+
+class Batcher:
+    """
+    :param func_name: jobs of this function are grouped
+    :param batch_func: it runs a group, it receives the list of the `data`
+    params of the jobs and returns a result by job in the same order.
+    :param max_size: a group runs when it has this number of jobs, 1
+    disables the grouping.
+    :param max_wait: secs which the first job of a group waits for others
+    :param capacity: resources of the agent reserved by each group
+    """
+
+    def __init__(
+        self,
+        func_name: str,
+        batch_func: str,
+        *,
+        max_size: int = 1,
+        max_wait: float = 2.0,
+        capacity: Optional[Capacity] = None,
+    ):
+        self.func_name = func_name
+        self.batch_func = batch_func
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.capacity = capacity
+        self._pending: Dict[str, List[Tuple[Any, asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._running: Set[asyncio.Task] = set()
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+    def batchable(self, meta: Optional[Dict[str, Any]]) -> bool:
+        return self.max_size > 1 and bool((meta or {}).get(BATCH_META))
+
+    def accepts(self, payload) -> bool:
+        return payload.func_name == self.func_name and self.batchable(payload.meta)
+
+    async def submit(self, payload) -> types.FunctionResult:
+        """It waits until the group of the job ran"""
+        loop = asyncio.get_running_loop()
+        key = payload.meta[BATCH_META]
+        fut = loop.create_future()
+        group = self._pending.setdefault(key, [])
+        group.append((payload, fut))
+        if len(group) >= self.max_size:
+            self.flush(key)
+        elif len(group) == 1:
+            self._timers[key] = loop.call_later(self.max_wait, self.flush, key)
+        return await fut
+
+    def _executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor()
+        return self._pool
+
+    def shutdown(self):
+        """It stops the process pool, groups which didn't run are dropped"""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._pending.clear()
+        if self._pool:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def flush(self, key: str):
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        group = self._pending.pop(key, [])
+        if group:
+            task = asyncio.create_task(self._run(group))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, group: List[Tuple[Any, asyncio.Future]]):
+        loop = asyncio.get_running_loop()
+        data = [payload.params["data"] for payload, _ in group]
+        timeout = sum(payload.timeout for payload, _ in group)
+        requests = [job_requests(payload.meta) for payload, _ in group]
+        key = f"batch-{group[0][0].execid}"
+        if self.capacity:
+            await self.capacity.reserve(
+                key, max(c for c, _ in requests), max(m for _, m in requests)
+            )
+        logger.info(f"Batch: running {len(group)} jobs")
+        try:
+            func = get_function(self.batch_func)
+            results = await asyncio.wait_for(
+                loop.run_in_executor(self._executor(), partial(func, data)), timeout
+            )
+        except (Exception, asyncio.CancelledError) as e:
+            if isinstance(e, BrokenProcessPool):
+                # a process died, the next group starts a new pool
+                self._pool = None
+            err = traceback.format_exc()
+            logger.exception(err)
+            for _, fut in group:
+                if not fut.done():
+                    fut.set_result(types.FunctionResult(error=True, error_msg=err))
+            return
+        finally:
+            if self.capacity:
+                self.capacity.release(key)
+        for (_, fut), result in zip(group, results):
+            if not fut.done():
+                fut.set_result(types.FunctionResult(error=False, func_result=result))
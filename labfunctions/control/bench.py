@@ -0,0 +1,398 @@
+"""
+Benchmark of the dispatch path of notebooks, from the request made to the
+webserver to the registration of the result made by the executor.
+
+The real path is used: the `notebooks/_run` route of the given app, with
+its `SchedulerExec`, the fair queues and `FairWorker` running the task in a
+process pool, and the `history` route to register the result. Only the
+notebook dispatcher is replaced by `stub_notebook`, which doesn't start a
+container.
+
+`CodecBench` measures the payload codecs of notebook jobs.
+"""
+import asyncio
+import os
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from libq import serializers
+from libq.types import JobPayload, JobStatus
+from sanic import Sanic
+
+from labfunctions import types
+from labfunctions.defaults import API_VERSION
+from labfunctions.executors import ExecID
+from labfunctions.notebooks import create_notebook_ctx
+from labfunctions.redis_conn import create_pool
+from labfunctions.timeline import phase_latency
+
+from .codec import CODECS, pack_ctx, unpack_ctx
+from .scheduler import SchedulerExec
+from .worker import FairWorker
+
+STUB_FUNC = "labfunctions.control.bench.stub_notebook"
+# the stub runs in a process pool, its config is inherited by env
+WORK_ENV = "LF_BENCH_WORK_SECS"
+PHASES = ["enqueue", "queue_wait", "dequeue_to_start", "registration", "total"]
+_DONE = {"complete", "failed", "canceled"}
+CODEC_BENCH_PREFIX = "lf.bench::codec:"
+
+
+def stub_notebook(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Used in place of `notebook_dispatcher`. It waits `LF_BENCH_WORK_SECS`
+    and returns the result to be registered, as the executor does.
+    """
+    started = time.time()
+    ctx = unpack_ctx(data)
+    time.sleep(float(os.environ.get(WORK_ENV, 0)))
+    finished = time.time()
+    result = types.ExecutionResult(
+        projectid=ctx.projectid,
+        execid=ctx.execid,
+        wfid=ctx.wfid or "bench",
+        name=ctx.nb_name,
+        params=ctx.params,
+        input_=ctx.nb_name,
+        error=False,
+        elapsed_secs=round(finished - started, 3),
+        created_at=ctx.created_at,
+    )
+    return {"started": started, "finished": finished, "result": result.dict()}
+
+
+class BenchWorker(FairWorker):
+    """
+    FairWorker which keeps the time when each job was taken, and registers
+    the result of the stub through the webserver when the job ends.
+    """
+
+    def __init__(
+        self,
+        queues: str,
+        *,
+        popped: Dict[str, float],
+        register: Callable[[Dict[str, Any]], Awaitable[None]],
+        **kwargs,
+    ):
+        super().__init__(queues, **kwargs)
+        self.popped = popped
+        self.register_result = register
+
+    async def start_job(self, execid: str, qname: str):
+        self.popped[execid] = time.time()
+        await super().start_job(execid, qname)
+
+    async def call_func_bg(self, payload):
+        result = await super().call_func_bg(payload)
+        if not result.error:
+            await self.register_result(result.func_result)
+        return result
+
+
+class DispatchBench:
+    """
+    It submits notebooks concurrently to the webserver and measures for
+    each one:
+
+    - enqueue: the request to `notebooks/_run`, what a client waits
+    - queue_wait: from the response until a worker takes the job
+    - dequeue_to_start: from that until the stub starts in the process pool
+    - registration: the request to `history` with the result
+    - total: from the submission to the registration of the result
+
+    :param app: sanic app with the `workflows` and `history` blueprints,
+    requests are sent to it through ASGI, without a network between.
+    Its scheduler is replaced by one which enqueues in `redis_url`.
+    :param redis_url: redis to use as queue, jobs and workers are left there
+    to be inspected, so don't use a production redis.
+    :param token: access token for the routes of the app
+    :param projectid: project where notebooks are run and registered
+    :param workers: how many workers listen to the queue
+    :param max_jobs: concurrent jobs by worker
+    :param work_secs: time that the stub takes to run
+    """
+
+    def __init__(
+        self,
+        app: Sanic,
+        redis_url: str,
+        *,
+        settings: types.ServerSettings,
+        token: str,
+        projectid: str = "bench",
+        qname: str = "bench.cpu",
+        workers: int = 1,
+        max_jobs: int = 5,
+        work_secs: float = 0.0,
+    ):
+        self.app = app
+        self.redis_url = redis_url
+        self.settings = settings
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.projectid = projectid
+        self.cluster, self.machine = qname.split(".", maxsplit=1)
+        self.qname = qname
+        self.workers_n = workers
+        self.max_jobs = max_jobs
+        self.work_secs = work_secs
+        self.popped: Dict[str, float] = {}
+        self.registered: Dict[str, Dict[str, float]] = {}
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def _start_app(self, scheduler: SchedulerExec):
+        """
+        The app is started once, as a server does. The sanic test client
+        starts it again in each request, which would be timed as dispatch.
+        """
+        # pylint: disable=protected-access
+        self.app.asgi = True
+        self.app.router.reset()
+        self.app.signal_router.reset()
+        await self.app._startup()
+        await self.app._server_event("init", "before")
+        await self.app._server_event("init", "after")
+        self.app.ctx.scheduler = scheduler
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=self.app), base_url="http://bench"
+        )
+
+    async def _stop_app(self):
+        # pylint: disable=protected-access
+        await self.client.aclose()
+        await self.app._server_event("shutdown", "before")
+        await self.app._server_event("shutdown", "after")
+
+    async def _register(self, data: Dict[str, Any]):
+        started = time.time()
+        res = await self.client.post(
+            f"/{API_VERSION}/history/", json=data["result"], headers=self.headers
+        )
+        res.raise_for_status()
+        self.registered[data["result"]["execid"]] = {
+            "registration": time.time() - started,
+            "registered": time.time(),
+        }
+
+    async def _start_workers(self) -> List[BenchWorker]:
+        workers = []
+        for _ in range(self.workers_n):
+            w = BenchWorker(
+                self.qname,
+                popped=self.popped,
+                register=self._register,
+                conn=create_pool(self.redis_url),
+                max_jobs=self.max_jobs,
+                poll_delay_secs=1,
+                handle_signals=False,
+            )
+            w.main_task = asyncio.create_task(w.main())
+            workers.append(w)
+        return workers
+
+    async def _stop_workers(self, workers: List[BenchWorker]):
+        for w in workers:
+            w.handle_sig(signal.SIGINT)
+            await asyncio.gather(w.main_task, return_exceptions=True)
+            await w.close()
+
+    async def _submit(self, sem: asyncio.Semaphore) -> Dict[str, Any]:
+        task = types.NBTask(
+            nb_name="bench",
+            params={},
+            machine=self.machine,
+            cluster=self.cluster,
+            timeout=60,
+        )
+        async with sem:
+            submitted = time.time()
+            res = await self.client.post(
+                f"/{API_VERSION}/workflows/{self.projectid}/notebooks/_run",
+                json=task.dict(),
+                headers=self.headers,
+            )
+            res.raise_for_status()
+            return {
+                "execid": res.json()["execid"],
+                "submitted": submitted,
+                "enqueued": time.time(),
+            }
+
+    async def _wait(
+        self, scheduler: SchedulerExec, execids: List[str], timeout: float
+    ) -> Dict[str, Optional[types.TaskStatus]]:
+        started = time.time()
+        while True:
+            tasks = await scheduler.get_tasks(execids)
+            done = all(t and t.status in _DONE for t in tasks.values())
+            if done or time.time() - started > timeout:
+                return tasks
+            await asyncio.sleep(0.1)
+
+    async def run(
+        self, n: int = 100, *, concurrency: int = 10, timeout: float = 300
+    ) -> types.DispatchBenchResult:
+        """
+        :param n: notebooks to submit
+        :param concurrency: requests in flight at the same time
+        :param timeout: secs to wait for the results
+        """
+        os.environ[WORK_ENV] = str(self.work_secs)
+
+        conn = create_pool(self.redis_url)
+        scheduler = SchedulerExec(conn, settings=self.settings)
+        scheduler.tasks = {**scheduler.tasks, "notebook": STUB_FUNC}
+        await self._start_app(scheduler)
+        workers = await self._start_workers()
+
+        sem = asyncio.Semaphore(concurrency)
+        try:
+            subs = await asyncio.gather(*[self._submit(sem) for _ in range(n)])
+            tasks = await self._wait(scheduler, [s["execid"] for s in subs], timeout)
+        finally:
+            await self._stop_workers(workers)
+            await self._stop_app()
+        await conn.close()
+
+        return self._report(subs, tasks, n, concurrency)
+
+    def _report(self, subs, tasks, n: int, concurrency: int):
+        samples: Dict[str, List[float]] = {p: [] for p in PHASES}
+        completed = failed = 0
+        finished = []
+        for sub in subs:
+            task = tasks.get(sub["execid"])
+            samples["enqueue"].append(sub["enqueued"] - sub["submitted"])
+            reg = self.registered.get(sub["execid"])
+            if not task or task.status != "complete" or not reg:
+                failed += 1 if task and task.status in _DONE else 0
+                continue
+            completed += 1
+            r = task.result
+            popped = self.popped.get(sub["execid"], r["started"])
+            samples["queue_wait"].append(popped - sub["enqueued"])
+            samples["dequeue_to_start"].append(r["started"] - popped)
+            samples["registration"].append(reg["registration"])
+            samples["total"].append(reg["registered"] - sub["submitted"])
+            finished.append(reg["registered"])
+
+        elapsed = 0.0
+        if finished:
+            elapsed = max(finished) - min(s["submitted"] for s in subs)
+        return types.DispatchBenchResult(
+            qname=self.qname,
+            submissions=n,
+            concurrency=concurrency,
+            completed=completed,
+            failed=failed,
+            elapsed=round(elapsed, 3),
+            phases=[phase_latency(p, samples[p]) for p in PHASES],
+        )
+
+
+class CodecBench:
+    """
+    For each codec it measures the time to pack and unpack the context of
+    a notebook job, and the memory that redis uses to keep `depth` queued
+    payloads, as the fair queues store them. Keys are removed at the end.
+
+    :param redis_url: redis to use, don't use a production redis.
+    :param depth: jobs written to redis by codec, 0 skips the measure
+    :param samples: contexts packed and unpacked by codec
+    """
+
+    def __init__(
+        self,
+        redis_url: str,
+        *,
+        depth: int = 100_000,
+        samples: int = 1000,
+        codecs: Optional[List[str]] = None,
+    ):
+        self.redis_url = redis_url
+        self.depth = depth
+        self.samples = samples
+        self.codecs = codecs or CODECS
+
+    def _contexts(self) -> List[types.ExecutionNBTask]:
+        contexts = []
+        for ix in range(self.samples):
+            task = types.NBTask(
+                nb_name=f"bench_{ix % 10}",
+                params={"ALPHA": ix * 0.1, "DATASET": f"s3://data/bench/{ix}.csv"},
+                machine="cpu",
+                cluster="bench",
+                timeout=600,
+                notifications_fail=["slack"],
+            )
+            contexts.append(
+                create_notebook_ctx(
+                    "bench",
+                    task,
+                    execid=str(ExecID()),
+                    wfid=f"wf{ix % 100}",
+                    runtime=None,
+                )
+            )
+        return contexts
+
+    def _payload(self, data: Dict[str, Any], execid: str) -> str:
+        payload = JobPayload(
+            func_name="labfunctions.control.tasks.notebook_dispatcher",
+            execid=execid,
+            timeout=600,
+            params={"data": data},
+            status=JobStatus.queued.value,
+            created_ts=int(time.time()),
+            queue="bench.cpu",
+        )
+        return serializers.job_serializer(payload)
+
+    async def _redis_bytes(self, conn, codec: str, payloads: List[str]) -> int:
+        prefix = f"{CODEC_BENCH_PREFIX}{codec}:"
+        before = (await conn.info("memory"))["used_memory"]
+        for start in range(0, self.depth, 1000):
+            async with conn.pipeline(transaction=False) as pipe:
+                for ix in range(start, min(start + 1000, self.depth)):
+                    pipe.set(f"{prefix}{ix}", payloads[ix % len(payloads)])
+                await pipe.execute()
+        after = (await conn.info("memory"))["used_memory"]
+        for start in range(0, self.depth, 1000):
+            keys = [
+                f"{prefix}{ix}" for ix in range(start, min(start + 1000, self.depth))
+            ]
+            await conn.delete(*keys)
+        return after - before
+
+    async def run(self) -> List[types.CodecBenchResult]:
+        contexts = self._contexts()
+        conn = create_pool(self.redis_url) if self.depth else None
+        results = []
+        for codec in self.codecs:
+            started = time.perf_counter()
+            packed = [pack_ctx(ctx, codec) for ctx in contexts]
+            encode = time.perf_counter() - started
+            started = time.perf_counter()
+            for data in packed:
+                unpack_ctx(data)
+            decode = time.perf_counter() - started
+
+            payloads = [self._payload(d, c.execid) for d, c in zip(packed, contexts)]
+            redis_bytes = None
+            if conn:
+                redis_bytes = await self._redis_bytes(conn, codec, payloads)
+            results.append(
+                types.CodecBenchResult(
+                    codec=codec,
+                    payload_bytes=sum(len(p) for p in payloads) // len(payloads),
+                    encode_us=round(encode / len(contexts) * 1e6, 1),
+                    decode_us=round(decode / len(contexts) * 1e6, 1),
+                    depth=self.depth,
+                    redis_bytes=redis_bytes,
+                )
+            )
+        if conn:
+            await conn.close()
+        return results
@@ -0,0 +1,100 @@
+import asyncio
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+from libq.types import Prefixes
+
+from labfunctions import types
+
+
+def host_capacity() -> Tuple[float, int]:
+    """cpus and memory in MB of the machine"""
+    cpus = float(os.cpu_count() or 1)
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    return cpus, int(memory / 2**20)
+
+
+def requests_meta(
+    cpus: Optional[float] = None, memory_mb: Optional[int] = None
+) -> Dict[str, Any]:
+    """Requests of a task as kept in the metadata of its job"""
+    meta: Dict[str, Any] = {}
+    if cpus:
+        meta["cpus"] = cpus
+    if memory_mb:
+        meta["memory_mb"] = memory_mb
+    return meta
+
+
+def job_requests(meta: Optional[Dict[str, Any]]) -> Tuple[float, int]:
+    meta = meta or {}
+    return float(meta.get("cpus") or 0), int(meta.get("memory_mb") or 0)
+
+
+class Capacity:
+    """
+    Resources of an agent reserved by the tasks running. A task is
+    admitted when its requests fit in what is free. A task which requests
+    more than the whole agent is admitted when nothing else runs,
+    otherwise it would wait forever.
+
+    :param cpus: cpus of the agent
+    :param memory_mb: memory of the agent
+    """
+
+    def __init__(self, cpus: float, memory_mb: int):
+        self.cpus = cpus
+        self.memory_mb = memory_mb
+        self.reserved: Dict[str, Tuple[float, int]] = {}
+        self._freed = asyncio.Event()
+
+    @property
+    def free_cpus(self) -> float:
+        return self.cpus - sum(c for c, _ in self.reserved.values())
+
+    @property
+    def free_memory_mb(self) -> int:
+        return self.memory_mb - sum(m for _, m in self.reserved.values())
+
+    def free(self) -> Optional[Tuple[float, int]]:
+        """What a new task can request, None if any task fits"""
+        if not self.reserved:
+            return None
+        return self.free_cpus, self.free_memory_mb
+
+    def fits(self, cpus: float, memory_mb: int) -> bool:
+        if not self.reserved:
+            return True
+        return cpus <= self.free_cpus and memory_mb <= self.free_memory_mb
+
+    async def reserve(self, key: str, cpus: float, memory_mb: int):
+        """It waits until the requests fit"""
+        while not self.fits(cpus, memory_mb):
+            self._freed.clear()
+            await self._freed.wait()
+        self.reserved[key] = (cpus, memory_mb)
+
+    def release(self, key: str):
+        if self.reserved.pop(key, None) is not None:
+            self._freed.set()
+
+    def stats(self) -> types.AgentResources:
+        return types.AgentResources(
+            cpus=self.cpus,
+            memory_mb=self.memory_mb,
+            free_cpus=round(self.free_cpus, 3),
+            free_memory_mb=self.free_memory_mb,
+            running=len(self.reserved),
+        )
+
+
+async def fetch_meta(conn, execid: str) -> Dict[str, Any]:
+    """Metadata of a job waiting in a queue"""
+    data = await conn.get(f"{Prefixes.job.value}{execid}")
+    if not data:
+        return {}
+    try:
+        return orjson.loads(data).get("meta") or {}
+    except orjson.JSONDecodeError:
+        return {}
@@ -0,0 +1,156 @@
+"""
+Codecs for the execution context sent in the payload of notebook jobs.
+
+With the default "json" codec the context is sent as a dict, as always.
+Any other codec sends an envelope `{"codec": name, "blob": text}` where the
+blob is the slim context (see `slim_ctx`) packed by the codec. The payload
+of libq jobs is json, so binary blobs are sent as base85.
+
+Agents decode both forms with `unpack_ctx`, so the codec can be changed
+in the server once the agents are updated.
+
+msgpack and zstandard are optional dependencies (`codecs` extra).
+"""
+import base64
+import functools
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Union
+
+import orjson
+
+from labfunctions import defaults, types
+
+CODECS = ["json", "msgpack", "msgpack+zstd"]
+
+
+class JSONCodec:
+    name = "json"
+
+    def encode(self, data: Dict[str, Any]) -> str:
+        return orjson.dumps(data).decode("utf-8")
+
+    def decode(self, blob: str) -> Dict[str, Any]:
+        return orjson.loads(blob)
+
+
+class MsgpackCodec:
+    """
+    :param zstd: compress the msgpack bytes with zstandard
+    :param level: zstandard compression level
+    """
+
+    def __init__(self, zstd=False, level=3):
+        import msgpack
+
+        self._msgpack = msgpack
+        self.name = "msgpack"
+        self._compress: Callable[[bytes], bytes] = lambda b: b
+        self._decompress: Callable[[bytes], bytes] = lambda b: b
+        if zstd:
+            import zstandard
+
+            self.name = "msgpack+zstd"
+            self._compress = zstandard.ZstdCompressor(level=level).compress
+            self._decompress = zstandard.ZstdDecompressor().decompress
+
+    def encode(self, data: Dict[str, Any]) -> str:
+        packed = self._compress(self._msgpack.packb(data, use_bin_type=True))
+        return base64.b85encode(packed).decode("ascii")
+
+    def decode(self, blob: str) -> Dict[str, Any]:
+        packed = self._decompress(base64.b85decode(blob))
+        return self._msgpack.unpackb(packed, raw=False)
+
+
+@functools.lru_cache()
+def get_codec(name: str) -> Union[JSONCodec, MsgpackCodec]:
+    if name == "json":
+        return JSONCodec()
+    if name == "msgpack":
+        return MsgpackCodec()
+    if name == "msgpack+zstd":
+        return MsgpackCodec(zstd=True)
+    raise KeyError(f"Codec {name} not found, options: {CODECS}")
+
+
+def _derive(data: Dict[str, Any], field: str) -> Any:
+    """Value of a context field as built by `create_notebook_ctx`"""
+    if field == "today":
+        created = datetime.fromisoformat(data["created_at"])
+        return created.strftime("%Y%m%d")
+    if field == "output_dir":
+        return f"{defaults.NB_OUTPUTS}/ok/{data['today']}"
+    if field == "error_dir":
+        return f"{defaults.NB_OUTPUTS}/errors/{data['today']}"
+    if field == "output_name":
+        return f"{data['wfid']}.{data['nb_name']}.{data['execid']}.ipynb"
+    if field == "pm_input":
+        return str(Path(defaults.NOTEBOOKS_DIR) / f"{data['nb_name']}.ipynb")
+    if field == "pm_output":
+        return f"{data['output_dir']}/{data['output_name']}"
+    raise KeyError(field)
+
+
+def _is_derived(data: Dict[str, Any], field: str) -> bool:
+    try:
+        return data[field] == _derive(data, field)
+    except (KeyError, ValueError):
+        return False
+
+
+# derivation order matters, a field can depend on a previous one
+DERIVED = ["today", "output_dir", "error_dir", "output_name", "pm_input", "pm_output"]
+DERIVED_PARAMS = {"WFID": "wfid", "EXECID": "execid", "NOW": "created_at"}
+
+
+def slim_ctx(ctx: types.ExecutionNBTask) -> Dict[str, Any]:
+    """
+    The context without the fields that the agent can derive and
+    without the fields equal to their default. A field is only dropped
+    if its value is the derived one, the names dropped are kept in
+    `_derived` so `expand_ctx` rebuilds exactly them.
+    """
+    full = ctx.dict()
+    data = ctx.dict(exclude_defaults=True)
+    dropped: List[str] = []
+    for field in DERIVED:
+        if _is_derived(full, field):
+            data.pop(field, None)
+            dropped.append(field)
+    params = dict(data.get("params", {}))
+    for param, field in DERIVED_PARAMS.items():
+        if param in params and params[param] == full[field]:
+            del params[param]
+            dropped.append(param)
+    data["params"] = params
+    data["_derived"] = dropped
+    return data
+
+
+def expand_ctx(data: Dict[str, Any]) -> types.ExecutionNBTask:
+    data = dict(data)
+    dropped = data.pop("_derived", [])
+    for field in DERIVED:
+        if field in dropped:
+            data[field] = _derive(data, field)
+    params = dict(data.get("params", {}))
+    for param, field in DERIVED_PARAMS.items():
+        if param in dropped:
+            params[param] = data[field]
+    data["params"] = params
+    return types.ExecutionNBTask(**data)
+
+
+def pack_ctx(ctx: types.ExecutionNBTask, codec: str = "json") -> Dict[str, Any]:
+    """`data` param of a notebook job"""
+    if codec == "json":
+        return ctx.dict()
+    return {"codec": codec, "blob": get_codec(codec).encode(slim_ctx(ctx))}
+
+
+def unpack_ctx(data: Dict[str, Any]) -> types.ExecutionNBTask:
+    """Context from the `data` param of a job, packed by any codec"""
+    if "codec" in data and "blob" in data:
+        return expand_ctx(get_codec(data["codec"]).decode(data["blob"]))
+    return types.ExecutionNBTask(**data)
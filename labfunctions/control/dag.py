@@ -0,0 +1,129 @@
+from typing import Dict, List, Optional
+
+from libq.utils import parse_timeout
+from redis.asyncio import Redis
+
+from labfunctions import errors, types
+
+DAG_PREFIX = "lf.dag::"
+
+
+def downstreams(
+    workflows: Dict[str, types.WorkflowDataWeb], alias: str
+) -> List[types.WorkflowDataWeb]:
+    """Workflows which depend directly on `alias`"""
+    return [wf for wf in workflows.values() if alias in wf.depends_on]
+
+
+def is_ready(wf: types.WorkflowDataWeb, nodes: Dict[str, types.DagNodeRef]) -> bool:
+    """All the upstreams of `wf` finished ok"""
+    return all(up in nodes and not nodes[up].error for up in wf.depends_on)
+
+
+def find_cycle(workflows: Dict[str, types.WorkflowDataWeb]) -> Optional[List[str]]:
+    """
+    It returns the aliases of the first cycle found or None.
+    """
+    visiting: List[str] = []
+    done = set()
+
+    def _visit(alias: str) -> Optional[List[str]]:
+        if alias in visiting:
+            return visiting[visiting.index(alias) :] + [alias]
+        if alias in done or alias not in workflows:
+            return None
+        visiting.append(alias)
+        for up in workflows[alias].depends_on:
+            cycle = _visit(up)
+            if cycle:
+                return cycle
+        visiting.pop()
+        done.add(alias)
+        return None
+
+    for alias in sorted(workflows):
+        cycle = _visit(alias)
+        if cycle:
+            return cycle
+    return None
+
+
+def validate_dag(
+    workflows: Dict[str, types.WorkflowDataWeb], wfd: types.WorkflowDataWeb
+):
+    """
+    Checks the dependencies of `wfd` against the workflows already
+    registered in the project.
+
+    :raises errors.WorkflowDagError: if an upstream doesn't exist or
+    the dependencies make a cycle.
+    """
+    graph = {
+        a: wf for a, wf in workflows.items() if not wfd.wfid or wf.wfid != wfd.wfid
+    }
+    graph[wfd.alias] = wfd
+    for up in wfd.depends_on:
+        if up not in graph:
+            raise errors.WorkflowDagError(wfd.alias, f"{up} not found")
+    cycle = find_cycle(graph)
+    if cycle:
+        raise errors.WorkflowDagError(wfd.alias, f"cycle {' -> '.join(cycle)}")
+
+
+class DagState:
+    """
+    State of a DAG run kept in redis: a hash with the result of each
+    workflow finished by alias, and a set with the downstreams already
+    enqueued. The set is used as a claim so a downstream with many
+    upstreams finishing at the same time is enqueued once.
+
+    :param conn: async redis
+    :param dagid: execid of the workflow which started the run
+    :param ttl: how long the state is kept, a run with an upstream
+    that never finishes is forgotten after it.
+    """
+
+    def __init__(self, conn: Redis, dagid: str, *, ttl="48h"):
+        self.conn = conn
+        self.dagid = dagid
+        self.ttl = parse_timeout(ttl)
+
+    @property
+    def nodes_key(self) -> str:
+        return f"{DAG_PREFIX}{self.dagid}:nodes"
+
+    @property
+    def triggered_key(self) -> str:
+        return f"{DAG_PREFIX}{self.dagid}:triggered"
+
+    async def record(self, ref: types.DagNodeRef):
+        async with self.conn.pipeline(transaction=True) as pipe:
+            pipe.hset(self.nodes_key, ref.alias, ref.json())
+            pipe.expire(self.nodes_key, self.ttl)
+            await pipe.execute()
+
+    async def nodes(self) -> Dict[str, types.DagNodeRef]:
+        data = await self.conn.hgetall(self.nodes_key)
+        return {_decode(k): types.DagNodeRef.parse_raw(v) for k, v in data.items()}
+
+    async def claim(self, alias: str) -> bool:
+        """True only for the first caller"""
+        async with self.conn.pipeline(transaction=True) as pipe:
+            pipe.sadd(self.triggered_key, alias)
+            pipe.expire(self.triggered_key, self.ttl)
+            added, _ = await pipe.execute()
+        return added == 1
+
+    async def get(self) -> types.DagRun:
+        triggered = await self.conn.smembers(self.triggered_key)
+        return types.DagRun(
+            dagid=self.dagid,
+            nodes=await self.nodes(),
+            triggered=sorted(_decode(t) for t in triggered),
+        )
+
+
+def _decode(value) -> str:
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
@@ -0,0 +1,413 @@
+from typing import Any, Dict, Optional, Tuple
+
+from libq import serializers
+from libq.jobs import Job
+from libq.types import JobPayload, JobStatus, Prefixes
+from libq.utils import generate_random, now_secs, parse_timeout
+from redis.asyncio import ConnectionPool
+
+from labfunctions import defaults, types
+from labfunctions.timeline import percentile
+
+from .capacity import job_requests
+
+FAIRQ_PREFIX = "lf.fq::"
+WAIT_SAMPLES = 500
+NOTIFY_MAX = 1000
+LEASE_GRACE = 60
+
+_ENQUEUE_LUA = """
+local base = KEYS[1]
+local execid, prj, prio = ARGV[1], ARGV[2], ARGV[3]
+local active = base .. ':active:' .. prio
+redis.call('RPUSH', base .. ':lane:' .. prio .. ':' .. prj, execid)
+if not redis.call('ZSCORE', active, prj) then
+  local head = redis.call('ZRANGE', active, 0, 0, 'WITHSCORES')
+  local vt = 0
+  if head[2] then vt = head[2] end
+  redis.call('ZADD', active, vt, prj)
+end
+redis.call('ZADD', base .. ':ts', ARGV[4], execid)
+-- a retry keeps the conf of the project and the lease and requests of the job
+if ARGV[5] ~= '' then
+  redis.call('HSET', base .. ':conf', 'w:' .. prj, ARGV[5], 'c:' .. prj, ARGV[6])
+end
+if ARGV[8] ~= '' then
+  redis.call('HSET', base .. ':leases', execid, ARGV[8])
+end
+if ARGV[9] ~= '' and (tonumber(ARGV[9]) > 0 or tonumber(ARGV[10]) > 0) then
+  redis.call('HSET', base .. ':reqs', 'c:' .. execid, ARGV[9], 'm:' .. execid, ARGV[10])
+end
+redis.call('RPUSH', base .. ':notify', execid)
+redis.call('LTRIM', base .. ':notify', -tonumber(ARGV[7]), -1)
+return 1
+"""
+
+_FORGET_LUA = """
+local function forget(base, execid)
+  redis.call('HDEL', base .. ':owners', execid, 'p:' .. execid)
+  redis.call('HDEL', base .. ':leases', execid)
+  redis.call('HDEL', base .. ':reqs', 'c:' .. execid, 'm:' .. execid)
+end
+"""
+
+_POP_LUA = (
+    _FORGET_LUA
+    + """
+local base = KEYS[1]
+local now = tonumber(ARGV[1])
+local samples = tonumber(ARGV[2])
+local free_cpus, free_mem = tonumber(ARGV[4]), tonumber(ARGV[5])
+local function fits(execid)
+  if free_cpus < 0 then
+    return true
+  end
+  local req = redis.call('HMGET', base .. ':reqs', 'c:' .. execid, 'm:' .. execid)
+  return tonumber(req[1] or '0') <= free_cpus and tonumber(req[2] or '0') <= free_mem
+end
+for i = 6, #ARGV do
+  local prio = ARGV[i]
+  local active = base .. ':active:' .. prio
+  local projects = redis.call('ZRANGE', active, 0, -1)
+  for _, prj in ipairs(projects) do
+    local cap = tonumber(redis.call('HGET', base .. ':conf', 'c:' .. prj) or '0')
+    local running = base .. ':running:' .. prj
+    local expired = redis.call('ZRANGEBYSCORE', running, '-inf', now)
+    if #expired > 0 then
+      redis.call('ZREMRANGEBYSCORE', running, '-inf', now)
+      for _, ex in ipairs(expired) do
+        forget(base, ex)
+      end
+    end
+    if cap <= 0 or redis.call('ZCARD', running) < cap then
+      local lane = base .. ':lane:' .. prio .. ':' .. prj
+      local execid = redis.call('LINDEX', lane, 0)
+      if not execid then
+        redis.call('ZREM', active, prj)
+      elseif fits(execid) then
+        redis.call('LPOP', lane)
+        if redis.call('LLEN', lane) == 0 then
+          redis.call('ZREM', active, prj)
+        else
+          local w = tonumber(redis.call('HGET', base .. ':conf', 'w:' .. prj) or '1')
+          redis.call('ZINCRBY', active, 1 / w, prj)
+        end
+        local lease = tonumber(redis.call('HGET', base .. ':leases', execid) or ARGV[3])
+        redis.call('ZADD', running, now + lease, execid)
+        redis.call('HSET', base .. ':owners', execid, prj, 'p:' .. execid, prio)
+        local ts = tonumber(redis.call('ZSCORE', base .. ':ts', execid) or ARGV[1])
+        redis.call('ZREM', base .. ':ts', execid)
+        local wait = math.max(now - ts, 0)
+        redis.call('HINCRBY', base .. ':dispatched', prio, 1)
+        redis.call('HINCRBYFLOAT', base .. ':waited', prio, wait)
+        redis.call('LPUSH', base .. ':waits:' .. prio, wait)
+        redis.call('LTRIM', base .. ':waits:' .. prio, 0, samples - 1)
+        return {execid, prio, prj}
+      end
+    end
+  end
+end
+return nil
+"""
+)
+
+_RELEASE_LUA = (
+    _FORGET_LUA
+    + """
+local base = KEYS[1]
+local execid = ARGV[1]
+local owner = redis.call('HMGET', base .. ':owners', execid, 'p:' .. execid)
+if not owner[1] then
+  return nil
+end
+redis.call('ZREM', base .. ':running:' .. owner[1], execid)
+if ARGV[3] == '1' then
+  -- it goes back to its lane by the enqueue script
+  redis.call('HDEL', base .. ':owners', execid, 'p:' .. execid)
+else
+  forget(base, execid)
+  redis.call('RPUSH', base .. ':notify', execid)
+  redis.call('LTRIM', base .. ':notify', -tonumber(ARGV[2]), -1)
+end
+return {owner[1], owner[2] or ''}
+"""
+)
+
+
+def lane_for(priority: Optional[str]) -> str:
+    if priority in defaults.PRIORITY_LANES:
+        return priority
+    return defaults.PRIORITY_DEFAULT
+
+
+class FairQueue:
+    """
+    FairQueue sits between the webserver and the libq workers of a queue.
+    Jobs are stored as any other libq job, but instead of going to the
+    FIFO list of the queue, they wait in a lane by priority and project.
+
+    Lanes are served in strict priority order. Inside of a lane, projects
+    are served by a weighted virtual time, so a project with a large backlog
+    only gets its share, and a project never runs more than `max_running`
+    jobs at the same time in this queue.
+
+    Every enqueue pushes a token into the notify list, workers block on it
+    and then pop the next job fairly. See `FairWorker`.
+
+    A popped job holds a running slot of its project, with its owner, in
+    redis until it's released. The slot is a lease of the job timeout plus
+    `lease_grace` secs: if the agent dies while the job runs, the slot is
+    reaped by the next pop of the project instead of blocking it forever.
+    Jobs to retry go back to their lane with `requeue`.
+
+    :param name: name of the queue, usually `{cluster}.{machine}`
+    :param conn: an async redis connection
+    :param default_timeout: timeout for jobs enqueued without one
+    :param queue_wait_ttl: how long a job payload lives while it's waiting
+    :param weights: weight by projectid, default 1
+    :param max_running: max concurrent jobs by projectid
+    :param max_running_default: cap for projects not in max_running,
+    0 is unlimited.
+    :param lease_grace: secs which a running slot lasts after the timeout
+    of its job.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        conn: ConnectionPool,
+        default_timeout="30m",
+        queue_wait_ttl="24h",
+        weights: Optional[Dict[str, float]] = None,
+        max_running: Optional[Dict[str, int]] = None,
+        max_running_default: int = 0,
+        lease_grace: int = LEASE_GRACE,
+    ):
+        self._name = name
+        self.conn = conn
+        self._default_timeout = parse_timeout(default_timeout)
+        self._queue_wait_ttl = parse_timeout(queue_wait_ttl)
+        self._weights = weights or {}
+        self._max_running = max_running or {}
+        self._max_running_default = max_running_default
+        self._lease_grace = lease_grace
+        self._enqueue_script = self.conn.register_script(_ENQUEUE_LUA)
+        self._pop_script = self.conn.register_script(_POP_LUA)
+        self._release_script = self.conn.register_script(_RELEASE_LUA)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def base(self) -> str:
+        return f"{FAIRQ_PREFIX}{self._name}"
+
+    @property
+    def notify_key(self) -> str:
+        return f"{self.base}:notify"
+
+    def _running_key(self, projectid: str) -> str:
+        return f"{self.base}:running:{projectid}"
+
+    def weight(self, projectid: str) -> float:
+        w = self._weights.get(projectid, 1.0)
+        return w if w > 0 else 1.0
+
+    def max_running(self, projectid: str) -> int:
+        return self._max_running.get(projectid, self._max_running_default)
+
+    async def enqueue(
+        self,
+        func_name: str,
+        *,
+        projectid: str,
+        priority: str = defaults.PRIORITY_DEFAULT,
+        execid: Optional[str] = None,
+        params: Dict[str, Any] = {},
+        timeout=None,
+        result_ttl=60 * 5,
+        background=False,
+        max_retry=3,
+        meta: Optional[Dict[str, Any]] = None,
+    ) -> Job:
+        execid = execid or generate_random()
+        _now = now_secs()
+        payload = JobPayload(
+            func_name=func_name,
+            execid=execid,
+            timeout=parse_timeout(timeout) or self._default_timeout,
+            background=background,
+            params=params,
+            result_ttl=result_ttl,
+            status=JobStatus.queued.value,
+            created_ts=int(_now),
+            max_retry=max_retry,
+            queue=self._name,
+            meta=meta,
+        )
+        data = serializers.job_serializer(payload)
+        cpus, memory_mb = job_requests(meta)
+        async with self.conn.pipeline() as pipe:
+            pipe.setex(f"{Prefixes.job.value}{execid}", self._queue_wait_ttl, data)
+            pipe.sadd(Prefixes.queues_list.value, self.jobs_key)
+            await pipe.execute()
+        await self._enqueue_script(
+            keys=[self.base],
+            args=[
+                execid,
+                projectid,
+                lane_for(priority),
+                _now,
+                self.weight(projectid),
+                self.max_running(projectid),
+                NOTIFY_MAX,
+                payload.timeout + self._lease_grace,
+                cpus,
+                memory_mb,
+            ],
+        )
+        return Job(execid, conn=self.conn, payload=payload)
+
+    async def pop(
+        self, free: Optional[Tuple[float, int]] = None
+    ) -> Optional[Tuple[str, str, str]]:
+        """
+        Takes the next job to run, it returns a tuple of
+        (execid, priority, projectid) or None if every lane is empty
+        or the projects waiting are over their limit.
+
+        :param free: cpus and memory in MB free in the agent, a project
+        whose next job requests more is skipped and its job stays first
+        in its lane. None if any job fits.
+        """
+        free_cpus, free_memory_mb = free or (-1, -1)
+        rsp = await self._pop_script(
+            keys=[self.base],
+            args=[
+                now_secs(),
+                WAIT_SAMPLES,
+                self._default_timeout + self._lease_grace,
+                free_cpus,
+                free_memory_mb,
+                *defaults.PRIORITY_LANES,
+            ],
+        )
+        if not rsp:
+            return None
+        execid, priority, projectid = [_decode(r) for r in rsp]
+        return execid, priority, projectid
+
+    async def release(self, execid: str) -> bool:
+        """Frees the slot of the project which owns the job and wakes up
+        a worker, if some job was waiting for the slot. False if the job
+        didn't come from this queue or its lease was reaped."""
+        rsp = await self._release_script(keys=[self.base], args=[execid, NOTIFY_MAX, 0])
+        return bool(rsp)
+
+    async def requeue(self, execid: str) -> bool:
+        """A job to retry goes back to the end of its lane, with the
+        conf of its project, its lease and its requests. False if the job
+        didn't come from this queue or its lease was reaped."""
+        rsp = await self._release_script(keys=[self.base], args=[execid, NOTIFY_MAX, 1])
+        if not rsp:
+            return False
+        projectid, priority = [_decode(r) for r in rsp]
+        await self._enqueue_script(
+            keys=[self.base],
+            args=[
+                execid,
+                projectid,
+                lane_for(priority),
+                now_secs(),
+                "",
+                "",
+                NOTIFY_MAX,
+                "",
+                "",
+                "",
+            ],
+        )
+        return True
+
+    async def running(self, projectid: str) -> int:
+        return await self.conn.zcard(self._running_key(projectid))
+
+    async def pending(self, priority: Optional[str] = None) -> int:
+        lanes = [priority] if priority else defaults.PRIORITY_LANES
+        total = 0
+        for lane in lanes:
+            projects = await self.conn.zrange(f"{self.base}:active:{lane}", 0, -1)
+            async with self.conn.pipeline() as pipe:
+                for prj in projects:
+                    pipe.llen(f"{self.base}:lane:{lane}:{_decode(prj)}")
+                total += sum(await pipe.execute())
+        return total
+
+    @property
+    def jobs_key(self) -> str:
+        """libq list of the queue, used by the scheduler"""
+        return f"{Prefixes.queue_jobs.value}{self._name}"
+
+    async def depth(self) -> int:
+        """Jobs waiting in the lanes and in the libq list of the queue"""
+        async with self.conn.pipeline() as pipe:
+            pipe.zcard(f"{self.base}:ts")
+            pipe.llen(self.jobs_key)
+            rsp = await pipe.execute()
+        return sum(rsp)
+
+    async def oldest_age(self) -> Optional[float]:
+        """Secs waiting of the oldest job in the queue"""
+        oldest = []
+        head = await self.conn.zrange(f"{self.base}:ts", 0, 0, withscores=True)
+        if head:
+            oldest.append(float(head[0][1]))
+        execid = await self.conn.lindex(self.jobs_key, 0)
+        if execid:
+            data = await self.conn.get(f"{Prefixes.job.value}{_decode(execid)}")
+            if data:
+                oldest.append(serializers.job_deserializer(data).created_ts)
+        if not oldest:
+            return None
+        return round(max(now_secs() - min(oldest), 0), 3)
+
+    async def workers(self) -> int:
+        return await self.conn.scard(f"{Prefixes.queue_workers.value}{self._name}")
+
+    async def stats(self) -> types.QueueStats:
+        lanes = []
+        dispatched = await self.conn.hgetall(f"{self.base}:dispatched")
+        waited = await self.conn.hgetall(f"{self.base}:waited")
+        dispatched = {_decode(k): int(v) for k, v in dispatched.items()}
+        waited = {_decode(k): float(v) for k, v in waited.items()}
+        for lane in defaults.PRIORITY_LANES:
+            samples = await self.conn.lrange(f"{self.base}:waits:{lane}", 0, -1)
+            values = sorted(float(s) for s in samples)
+            n = dispatched.get(lane, 0)
+            lanes.append(
+                types.LaneStats(
+                    priority=lane,
+                    pending=await self.pending(lane),
+                    projects=await self.conn.zcard(f"{self.base}:active:{lane}"),
+                    dispatched=n,
+                    wait_avg=round(waited.get(lane, 0) / n, 3) if n else None,
+                    wait_p50=percentile(values, 0.5),
+                    wait_p95=percentile(values, 0.95),
+                    wait_max=round(values[-1], 3) if values else None,
+                )
+            )
+        return types.QueueStats(
+            qname=self._name,
+            lanes=lanes,
+            depth=await self.depth(),
+            oldest_age=await self.oldest_age(),
+            workers=await self.workers(),
+        )
+
+
+def _decode(value) -> str:
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return str(value)
@@ -0,0 +1,163 @@
+"""
+A map runs a task once by partition. The children are normal executions
+which get their partition as a param, they are enqueued up to the
+concurrency of the map and each result registered starts the next
+partition pending. A failed partition is enqueued again while it has
+retries left, otherwise the map fails and no more partitions are started.
+
+When all the partitions finished ok the reduce notebook of the map runs
+with the results of the children, a notebook can gather what they wrote
+with `io.cache.get_map_results`. The map takes the place of its task in
+a DAG run: downstreams continue after the reduce, or after the last
+partition if the map doesn't have a reduce.
+"""
+from typing import Dict, List, Optional
+
+from libq.utils import parse_timeout
+from redis.asyncio import Redis
+
+from labfunctions import defaults, types
+
+from .dag import _decode
+
+MAP_PREFIX = "lf.map::"
+
+
+def is_partition(result: types.ExecutionResult) -> bool:
+    """The result is of a child of a map"""
+    return result.params.get(defaults.MAP_INDEX_PARAM) is not None
+
+
+def partition_task(mt: types.MapTask, index: int) -> types.NBTask:
+    params = {
+        **mt.task.params,
+        mt.map.param: mt.map.partitions[index],
+        defaults.MAP_INDEX_PARAM: index,
+    }
+    return mt.task.copy(update={"params": params})
+
+
+def reduce_task(
+    mt: types.MapTask, results: Dict[int, types.MapPartitionRef]
+) -> types.NBTask:
+    params = {
+        **mt.task.params,
+        defaults.MAP_RESULTS_PARAM: [results[ix].dict() for ix in sorted(results)],
+    }
+    return mt.task.copy(
+        update={"nb_name": mt.map.reduce, "params": params, "memoize": False}
+    )
+
+
+def map_result(
+    mt: types.MapTask, last: types.ExecutionResult, error: bool
+) -> types.ExecutionResult:
+    """Result of the map as a whole, from the last partition finished"""
+    return last.copy(
+        update={
+            "execid": mt.mapid,
+            "name": mt.task.nb_name,
+            "params": mt.task.params,
+            "error": error,
+            "memo_key": None,
+            "memo_of": None,
+        }
+    )
+
+
+class MapState:
+    """
+    State of a map kept in redis: the spec of its children, a list with
+    the partitions pending, a hash with the results of the partitions
+    finished ok and a hash with the failures by partition.
+
+    :param conn: async redis
+    :param mapid: execid of the map
+    :param ttl: how long the state is kept
+    """
+
+    def __init__(self, conn: Redis, mapid: str, *, ttl="48h"):
+        self.conn = conn
+        self.mapid = mapid
+        self.ttl = parse_timeout(ttl)
+
+    def _key(self, name: str) -> str:
+        return f"{MAP_PREFIX}{self.mapid}:{name}"
+
+    async def create(self, mt: types.MapTask):
+        size = len(mt.map.partitions)
+        async with self.conn.pipeline(transaction=True) as pipe:
+            pipe.set(self._key("spec"), mt.json(), ex=self.ttl)
+            pipe.rpush(self._key("pending"), *range(size))
+            pipe.expire(self._key("pending"), self.ttl)
+            await pipe.execute()
+
+    async def spec(self) -> Optional[types.MapTask]:
+        data = await self.conn.get(self._key("spec"))
+        if not data:
+            return None
+        return types.MapTask.parse_raw(data)
+
+    async def next(self, n: int = 1) -> List[int]:
+        """It takes up to `n` partitions pending"""
+        async with self.conn.pipeline(transaction=True) as pipe:
+            for _ in range(n):
+                pipe.lpop(self._key("pending"))
+            rsp = await pipe.execute()
+        return [int(ix) for ix in rsp if ix is not None]
+
+    async def record(self, ref: types.MapPartitionRef) -> int:
+        """It returns the number of partitions finished ok"""
+        async with self.conn.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key("results"), str(ref.index), ref.json())
+            pipe.expire(self._key("results"), self.ttl)
+            pipe.hlen(self._key("results"))
+            _, _, done = await pipe.execute()
+        return done
+
+    async def failure(self, index: int) -> int:
+        """It counts a failure of a partition, the total is returned"""
+        async with self.conn.pipeline(transaction=True) as pipe:
+            pipe.hincrby(self._key("tries"), str(index), 1)
+            pipe.expire(self._key("tries"), self.ttl)
+            tries, _ = await pipe.execute()
+        return tries
+
+    async def fail(self, index: int):
+        """The partition doesn't have more retries, the partitions pending
+        aren't started"""
+        async with self.conn.pipeline(transaction=True) as pipe:
+            pipe.sadd(self._key("failed"), str(index))
+            pipe.expire(self._key("failed"), self.ttl)
+            pipe.delete(self._key("pending"))
+            await pipe.execute()
+
+    async def claim(self, name: str) -> bool:
+        """True only for the first caller"""
+        async with self.conn.pipeline(transaction=True) as pipe:
+            pipe.sadd(self._key("claims"), name)
+            pipe.expire(self._key("claims"), self.ttl)
+            added, _ = await pipe.execute()
+        return added == 1
+
+    async def results(self) -> Dict[int, types.MapPartitionRef]:
+        data = await self.conn.hgetall(self._key("results"))
+        return {
+            int(_decode(k)): types.MapPartitionRef.parse_raw(v) for k, v in data.items()
+        }
+
+    async def get(self) -> Optional[types.MapRun]:
+        mt = await self.spec()
+        if not mt:
+            return None
+        pending = await self.conn.lrange(self._key("pending"), 0, -1)
+        tries = await self.conn.hgetall(self._key("tries"))
+        failed = await self.conn.smembers(self._key("failed"))
+        return types.MapRun(
+            mapid=self.mapid,
+            size=len(mt.map.partitions),
+            pending=[int(ix) for ix in pending],
+            results=await self.results(),
+            tries={int(_decode(k)): int(v) for k, v in tries.items()},
+            failed=sorted(int(ix) for ix in failed),
+        )
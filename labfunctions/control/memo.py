@@ -0,0 +1,116 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+from libq.utils import parse_timeout
+from redis.asyncio import Redis
+
+from labfunctions import defaults, types
+from labfunctions.types.runtimes import RuntimeData
+
+MEMO_PREFIX = "lf.memo::"
+
+
+def memo_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Params as used for the memo key: the volatile params are removed and
+    upstreams are identified by their outputs, because a memoized upstream
+    has a new execid but the same output.
+    """
+    data = {k: v for k, v in params.items() if k not in defaults.VOLATILE_PARAMS}
+    upstream = data.get("UPSTREAM")
+    if isinstance(upstream, dict):
+        data["UPSTREAM"] = {
+            alias: [ref.get("output_dir"), ref.get("output_name")]
+            for alias, ref in upstream.items()
+        }
+    return data
+
+
+def memo_key(
+    ctx: types.ExecutionNBTask,
+    runtime: Optional[RuntimeData],
+    mutable_tags: Optional[List[str]] = None,
+) -> Optional[str]:
+    """
+    Fingerprint of an execution: the project, the notebook, the runtime and
+    the params. Notebooks are part of the runtime image, built from a
+    bundle of the project, so the build of the runtime identifies the
+    content of the notebook.
+
+    It returns None when the notebook isn't fixed by a runtime: when the
+    task doesn't have a registered runtime or its tag is mutable.
+    """
+    if not runtime or runtime.version in (mutable_tags or []):
+        return None
+    spec = dict(
+        projectid=ctx.projectid,
+        nb_name=ctx.nb_name,
+        image=ctx.runtime,
+        runtimeid=runtime.runtimeid,
+        built_at=runtime.created_at,
+        params=memo_params(ctx.params),
+    )
+    data = json.dumps(spec, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class MemoStore:
+    """
+    Successful executions by memo key, kept in redis during `ttl`.
+
+    :param conn: async redis
+    :param ttl: how long an execution is reused
+    """
+
+    def __init__(self, conn: Redis, *, ttl="24h"):
+        self.conn = conn
+        self.ttl = parse_timeout(ttl)
+
+    @staticmethod
+    def key(projectid: str, memo_key: str) -> str:
+        return f"{MEMO_PREFIX}{projectid}:{memo_key}"
+
+    async def get(
+        self, projectid: str, memo_key: str
+    ) -> Optional[types.ExecutionResult]:
+        data = await self.conn.get(self.key(projectid, memo_key))
+        if not data:
+            return None
+        return types.ExecutionResult.parse_raw(data)
+
+    async def put(self, result: types.ExecutionResult) -> bool:
+        """Only successful executions of memoized tasks are kept. A result
+        which reused another execution doesn't extend its life."""
+        if not result.memo_key or result.error or result.memo_of:
+            return False
+        await self.conn.set(
+            self.key(result.projectid, result.memo_key), result.json(), ex=self.ttl
+        )
+        return True
+
+
+def memo_result(
+    ctx: types.ExecutionNBTask, hit: types.ExecutionResult
+) -> types.ExecutionResult:
+    """Result of an execution skipped, it points to the output of `hit`"""
+    return types.ExecutionResult(
+        projectid=ctx.projectid,
+        execid=ctx.execid,
+        wfid=ctx.wfid,
+        name=ctx.nb_name,
+        params=ctx.params,
+        input_=ctx.pm_input,
+        error=False,
+        elapsed_secs=0,
+        created_at=ctx.created_at,
+        cluster=ctx.cluster,
+        machine=ctx.machine,
+        runtime=ctx.runtime,
+        output_dir=hit.output_dir,
+        output_name=hit.output_name,
+        error_dir=ctx.error_dir,
+        dagid=ctx.dagid,
+        memo_key=ctx.memo_key,
+        memo_of=hit.execid,
+    )
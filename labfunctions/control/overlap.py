@@ -0,0 +1,154 @@
+import threading
+from typing import Optional
+
+import redis
+from pydantic import BaseModel
+
+import docker
+from labfunctions import log
+
+RUNNING_PREFIX = "lf.wf.running::"
+PENDING_PREFIX = "lf.wf.pending::"
+CANCEL_PREFIX = "lf.wf.cancel::"
+
+_ACQUIRE_LUA = """
+local cur = redis.call('GET', KEYS[1])
+local execid, policy, ttl = ARGV[1], ARGV[2], ARGV[3]
+if not cur then
+  redis.call('SET', KEYS[1], execid, 'EX', ttl)
+  return {'run', ''}
+end
+if policy == 'skip' then
+  return {'skip', cur}
+elseif policy == 'coalesce' then
+  redis.call('SET', KEYS[2], execid, 'EX', ttl)
+  return {'coalesce', cur}
+elseif policy == 'cancel' then
+  redis.call('SET', KEYS[1], execid, 'EX', ttl)
+  redis.call('SET', ARGV[4] .. cur, execid, 'EX', ttl)
+  return {'cancel', cur}
+end
+return {'run', cur}
+"""
+
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+  return false
+end
+local nxt = redis.call('GET', KEYS[2])
+if nxt then
+  redis.call('DEL', KEYS[2])
+  redis.call('SET', KEYS[1], nxt, 'EX', ARGV[2])
+  return nxt
+end
+redis.call('DEL', KEYS[1])
+return false
+"""
+
+
+class OverlapDecision(BaseModel):
+    """
+    :param action: run, skip, coalesce or cancel. For cancel, the
+    current execution runs and `previous` should be stopped.
+    :param previous: execid of the run that was in progress, if any.
+    """
+
+    action: str
+    previous: Optional[str] = None
+
+    @property
+    def should_run(self) -> bool:
+        return self.action in ("run", "cancel")
+
+
+def _decode(value) -> Optional[str]:
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+
+class WorkflowLock:
+    """
+    It tracks the execution in progress of a workflow in redis,
+    one key by wfid with the execid as value, and applies the overlap
+    policy of the workflow atomically when a new run is triggered.
+
+    The keys expires after `ttl` secs, usually the timeout of the task,
+    so a crashed agent doesn't lock a workflow forever.
+
+    :param conn: a sync Redis client
+    :param wfid: workflow id
+    :param ttl: secs to hold the lock
+    """
+
+    def __init__(self, conn: redis.Redis, wfid: str, *, ttl: int):
+        self.conn = conn
+        self.wfid = wfid
+        self.ttl = ttl
+        self._acquire = self.conn.register_script(_ACQUIRE_LUA)
+        self._release = self.conn.register_script(_RELEASE_LUA)
+
+    @property
+    def running_key(self) -> str:
+        return f"{RUNNING_PREFIX}{self.wfid}"
+
+    @property
+    def pending_key(self) -> str:
+        return f"{PENDING_PREFIX}{self.wfid}"
+
+    def acquire(self, execid: str, policy: str) -> OverlapDecision:
+        action, previous = self._acquire(
+            keys=[self.running_key, self.pending_key],
+            args=[execid, policy, self.ttl, CANCEL_PREFIX],
+        )
+        return OverlapDecision(
+            action=_decode(action), previous=_decode(previous) or None
+        )
+
+    def release(self, execid: str) -> Optional[str]:
+        """
+        Frees the lock if `execid` still owns it. If a run was coalesced
+        meanwhile, the lock is passed to it and its execid is returned.
+        """
+        nxt = self._release(
+            keys=[self.running_key, self.pending_key], args=[execid, self.ttl]
+        )
+        return _decode(nxt) or None
+
+    def running(self) -> Optional[str]:
+        return _decode(self.conn.get(self.running_key))
+
+    def is_canceled(self, execid: str) -> bool:
+        return self.conn.exists(f"{CANCEL_PREFIX}{execid}") == 1
+
+
+class CancelWatcher(threading.Thread):
+    """
+    Polls the cancel flag of an execution and kills its container
+    (named after the execid) when a newer run of the workflow takes over.
+    """
+
+    def __init__(self, lock: WorkflowLock, execid: str, every_secs=5):
+        super().__init__(daemon=True)
+        self.lock = lock
+        self.execid = execid
+        self.every_secs = every_secs
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.every_secs):
+            if self.lock.is_canceled(self.execid):
+                log.server_logger.warning(
+                    f"Execution {self.execid} canceled by a newer run"
+                )
+                self.kill()
+                break
+
+    def kill(self):
+        try:
+            docker.from_env().containers.get(self.execid).kill()
+        except docker.errors.DockerException as e:
+            log.server_logger.error(f"Cancel of {self.execid} failed: {e}")
+
+    def stop(self):
+        self._stop_event.set()
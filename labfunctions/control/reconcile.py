@@ -0,0 +1,186 @@
+import time
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from croniter import croniter
+from libq.types import JobSchedule, Prefixes
+from libq.utils import generate_random, now_dt, now_secs
+
+from labfunctions import log, types
+from labfunctions.managers import workflows_mg
+
+from .dag import _decode
+from .scheduler import JobManager
+
+RECONCILE_LOCK = "lf.reconcile::lock"
+RECONCILE_LOCK_TTL = 60 * 5
+
+
+def next_run(schedule: Optional[JobSchedule]) -> Optional[float]:
+    if not schedule:
+        return None
+    if schedule.interval:
+        return now_secs() + schedule.interval
+    if schedule.cron:
+        return croniter(schedule.cron, now_dt()).get_next()
+    return None
+
+
+def _job_info(data) -> Tuple[Optional[str], Optional[str]]:
+    """func_name and digest of a job in the store, a job which can't be
+    decoded doesn't have a digest, so it is rewritten"""
+    try:
+        job = orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return None, None
+    return job.get("func_name"), (job.get("meta") or {}).get("digest")
+
+
+class Reconciler:
+    """
+    It rebuilds the periodic jobs of the workflows from the database,
+    for instance after redis was flushed or migrated, or after
+    SCHEDULER_SHARDS was changed.
+
+    Enabled workflows are read in pages and compared with the jobs in the
+    `RedisJobStore` of the `JobManager` by the digest kept in each job.
+    Jobs missing or outdated are written, jobs out of their scheduler
+    partition are scheduled for their next run (not run now, to avoid a
+    burst of runs after a flush), and jobs of workflows which are no
+    longer periodic are removed. Writes are sent in a pipeline by page.
+
+    :param jm: JobManager whose store is a RedisJobStore
+    :param page_size: workflows read and written at once
+    :param dry_run: only report the drift
+    """
+
+    def __init__(self, jm: JobManager, *, page_size=500, dry_run=False):
+        self.jm = jm
+        self.conn = jm.conn
+        self.store_key = jm.store.jobs_prefix
+        self.page_size = page_size
+        self.dry_run = dry_run
+
+    async def run(self, session) -> types.ReconcileReport:
+        started = time.time()
+        report = types.ReconcileReport(dry_run=self.dry_run)
+        # wfid -> key of its scheduler partition
+        desired: Dict[str, str] = {}
+        runtimes: Dict[str, Optional[types.RuntimeData]] = {}
+        async for page in workflows_mg.iter_enabled(session, self.page_size):
+            report.scanned += len(page)
+            wfs = [(prj, wd) for prj, wd in page if self.jm.is_periodic(wd)]
+            if wfs:
+                await self._sync_page(session, wfs, desired, runtimes, report)
+        await self._remove_orphans(desired, report)
+        report.elapsed = round(time.time() - started, 3)
+        return report
+
+    async def _sync_page(
+        self,
+        session,
+        wfs: List[Tuple[str, types.WorkflowDataWeb]],
+        desired: Dict[str, str],
+        runtimes: Dict[str, Optional[types.RuntimeData]],
+        report: types.ReconcileReport,
+    ):
+        wfids = [wd.wfid for _, wd in wfs]
+        keys = [self.jm.scheduler_for(wfid).jobs_key for wfid in wfids]
+        async with self.conn.pipeline(transaction=False) as pipe:
+            pipe.hmget(self.store_key, wfids)
+            for wfid, key in zip(wfids, keys):
+                pipe.zscore(key, wfid)
+            current, *scores = await pipe.execute()
+
+        async with self.conn.pipeline(transaction=False) as pipe:
+            for (projectid, wd), key, data, score in zip(wfs, keys, current, scores):
+                desired[wd.wfid] = key
+                payload = await self.jm.workflow_payload(
+                    session, projectid, wd, runtimes
+                )
+                if data is None:
+                    report.created.append(wd.wfid)
+                elif _job_info(data)[1] != payload.meta["digest"]:
+                    report.updated.append(wd.wfid)
+                else:
+                    report.unchanged += 1
+                    payload = None
+                if payload:
+                    pipe.hset(self.store_key, wd.wfid, payload.json())
+                if score is None:
+                    if payload:
+                        schedule = payload.schedule
+                    else:
+                        schedule = JobSchedule(**orjson.loads(data)["schedule"])
+                        report.rescheduled.append(wd.wfid)
+                    run = next_run(schedule)
+                    if run:
+                        pipe.zadd(key, {wd.wfid: run})
+            if not self.dry_run:
+                await pipe.execute()
+
+    async def _remove_orphans(
+        self, desired: Dict[str, str], report: types.ReconcileReport
+    ):
+        workflow_func = self.jm.tasks["workflow"]
+        removed = set()
+        async for jobid, data in self.conn.hscan_iter(
+            self.store_key, count=self.page_size
+        ):
+            jobid = _decode(jobid)
+            if jobid not in desired and _job_info(data)[0] == workflow_func:
+                removed.add(jobid)
+
+        stale = []
+        async for key in self.conn.scan_iter(
+            match=f"{Prefixes.scheduler_jobs.value}*", count=self.page_size
+        ):
+            key = _decode(key)
+            for jobid in await self.conn.zrange(key, 0, -1):
+                jobid = _decode(jobid)
+                wrong_partition = jobid in desired and desired[jobid] != key
+                if jobid in removed or wrong_partition:
+                    stale.append((key, jobid))
+
+        report.removed = sorted(removed)
+        if self.dry_run:
+            return
+        ids = sorted(removed)
+        for ix in range(0, max(len(ids), len(stale)), self.page_size):
+            async with self.conn.pipeline(transaction=False) as pipe:
+                chunk = ids[ix : ix + self.page_size]
+                if chunk:
+                    pipe.hdel(self.store_key, *chunk)
+                    pipe.delete(
+                        *[f"{Prefixes.schedule_job_repeat.value}{j}" for j in chunk]
+                    )
+                for key, jobid in stale[ix : ix + self.page_size]:
+                    pipe.zrem(key, jobid)
+                await pipe.execute()
+
+
+async def reconcile_on_start(
+    db, jm: JobManager, *, page_size=500
+) -> Optional[types.ReconcileReport]:
+    """
+    Used when the server starts. Only the first worker which takes the lock
+    reconciles, the lock isn't released so the others servers starting in
+    the next minutes skip it.
+    """
+    taken = await jm.conn.set(
+        RECONCILE_LOCK, generate_random(), ex=RECONCILE_LOCK_TTL, nx=True
+    )
+    if not taken:
+        return None
+    session = db.sessionmaker()
+    try:
+        async with session.begin():
+            report = await Reconciler(jm, page_size=page_size).run(session)
+    finally:
+        await session.close()
+    log.server_logger.info(
+        f"Workflows reconciled in {report.elapsed} secs: "
+        f"{len(report.created)} created, {len(report.updated)} updated, "
+        f"{len(report.rescheduled)} rescheduled, {len(report.removed)} removed"
+    )
+    return report
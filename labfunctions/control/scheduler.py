@@ -1,75 +1,206 @@
-from typing import Optional, Union
+import asyncio
+import hashlib
+import json
+from typing import Dict, List, Optional, Set, Union
 
 from libq import JobStoreSpec, Queue, RedisJobStore, Scheduler, create_pool
+from libq import defaults as libq_defaults
+from libq import serializers
 from libq.errors import JobNotFound
 from libq.jobs import Job
+from libq.types import JobPayload, JobSchedule, JobStatus, Prefixes
+from libq.utils import now_secs, parse_timeout
 from redis.asyncio import ConnectionPool
 
-from labfunctions import cluster, conf, defaults, types
+from labfunctions import cluster, conf, defaults, timeline, types
 from labfunctions.executors import ExecID
-from labfunctions.managers import runtimes_mg, workflows_mg
+from labfunctions.managers import history_mg, runtimes_mg, workflows_mg
 from labfunctions.notebooks import create_notebook_ctx
 from labfunctions.runtimes.context import create_build_ctx
 
+from .admission import check_admission
+from .batch import batch_meta
+from .capacity import requests_meta
+from .codec import pack_ctx
+from .dag import DagState, downstreams, is_ready
+from .fairq import FairQueue
+from .fanout import MapState, is_partition, map_result, partition_task, reduce_task
+from .memo import MemoStore, memo_key, memo_result
+from .shards import partition_for
+
+
+async def task_runtime(
+    session, projectid: str, task: types.NBTask
+) -> Optional[types.runtimes.RuntimeData]:
+    if not task.runtime:
+        return None
+    return await runtimes_mg.get_runtime(session, projectid, task.runtime, task.version)
+
 
 async def create_task_ctx(
-    session, projectid: str, task: types.NBTask, prefix="nb"
+    session,
+    projectid: str,
+    task: types.NBTask,
+    prefix="nb",
+    wfid=None,
+    runtime: Optional[types.runtimes.RuntimeData] = None,
 ) -> types.ExecutionNBTask:
+    """
+    :param runtime: if not given, it is fetched from the db
+    """
     execid = str(ExecID(prefix=prefix))
-    runtime = None
-    if task.runtime:
-        runtime = await runtimes_mg.get_runtime(
-            session, projectid, task.runtime, task.version
-        )
+    if runtime is None:
+        runtime = await task_runtime(session, projectid, task)
 
-    nb_ctx = create_notebook_ctx(projectid, task, execid=execid, runtime=runtime)
+    nb_ctx = create_notebook_ctx(
+        projectid, task, execid=execid, runtime=runtime, wfid=wfid
+    )
     return nb_ctx
 
 
+def workflow_digest(projectid: str, wd: types.WorkflowDataWeb, runtime: str) -> str:
+    """Fingerprint of what a registered workflow job depends on"""
+    spec = dict(
+        projectid=projectid,
+        nbtask=wd.nbtask.dict(),
+        schedule=wd.schedule.dict() if wd.schedule else None,
+        runtime=runtime,
+    )
+    data = json.dumps(spec, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def changed_tasks(
+    tasks: Dict[str, Union[types.TaskStatus, None]], statuses: Dict[str, str]
+) -> List[str]:
+    """execids whose status differs from the status known by the caller,
+    a task not found has the status `not_found`"""
+    changed = []
+    for execid, task in tasks.items():
+        status = task.status if task else JobStatus.not_found.name
+        if statuses.get(execid) != status:
+            changed.append(execid)
+    return changed
+
+
 class JobManager:
     """
     Manage periodic tasks like Workflows
+
+    :param shards: partitions where workflows are registered, they are
+    evaluated by the `ShardedScheduler` processes.
     """
 
     tasks = {
         "workflow": "labfunctions.control.tasks.workflow_dispatcher",
     }
 
-    def __init__(self, conn: ConnectionPool = None, *, store: JobStoreSpec = None):
+    def __init__(
+        self, conn: ConnectionPool = None, *, store: JobStoreSpec = None, shards=1
+    ):
 
         self.conn = conn or create_pool()
         self.store = store or RedisJobStore(self.conn)
-        self.scheduler = Scheduler(self.store, conn=self.conn)
+        self.shards = shards
 
-    async def register_workflow(
-        self, session, *, projectid: str, wd: types.WorkflowDataWeb
-    ):
-        runtime = None
-        task = wd.nbtask
+    def scheduler_for(self, jobid: str) -> Scheduler:
+        partition = partition_for(jobid, self.shards)
+        return Scheduler(self.store, conn=self.conn, partition=partition)
 
-        qname = f"{task.cluster}.{task.machine}"
-        ctx = await create_task_ctx(session, projectid, task)
+    @staticmethod
+    def is_periodic(wd: types.WorkflowDataWeb) -> bool:
+        """Workflows which should have a periodic job"""
+        return bool(wd.enabled and wd.schedule and not wd.depends_on)
+
+    async def workflow_payload(
+        self,
+        session,
+        projectid: str,
+        wd: types.WorkflowDataWeb,
+        runtimes: Optional[Dict[str, Optional[types.runtimes.RuntimeData]]] = None,
+    ) -> JobPayload:
+        """
+        Job registered in the store for a workflow. Its digest is kept as
+        metadata to know later if the workflow changed.
+
+        :param runtimes: cache of the runtimes already fetched, by name and
+        version, useful when many workflows are built at once.
+        """
+        task = wd.nbtask
+        runtime = None
+        if task.runtime:
+            cache = runtimes if runtimes is not None else {}
+            key = f"{projectid}/{task.runtime}/{task.version}"
+            if key not in cache:
+                cache[key] = await runtimes_mg.get_runtime(
+                    session, projectid, task.runtime, task.version
+                )
+            runtime = cache[key]
+        ctx = create_notebook_ctx(
+            projectid, task, execid=str(ExecID(prefix="nb")), runtime=runtime
+        )
         ctx.wfid = wd.wfid
 
-        await self.scheduler.create_job(
-            self.tasks["workflow"],
-            queue=qname,
+        schedule = wd.schedule
+        return JobPayload(
+            func_name=self.tasks["workflow"],
             jobid=wd.wfid,
-            params={"data": ctx.dict()},
-            interval=wd.schedule.interval,
-            cron=wd.schedule.cron,
+            timeout=libq_defaults.JOB_TIMEOUT,
             background=True,
-            repeat=wd.schedule.repeat,
+            params={"data": ctx.dict(), "overlap": schedule.overlap},
+            status=JobStatus.created.value,
+            created_ts=int(now_secs()),
+            queue=f"{task.cluster}.{task.machine}",
+            schedule=JobSchedule(
+                interval=parse_timeout(schedule.interval),
+                cron=schedule.cron,
+                repeat=schedule.repeat,
+            ),
+            meta={
+                "digest": workflow_digest(projectid, wd, ctx.runtime),
+                **requests_meta(task.cpus, task.memory_mb),
+            },
         )
+
+    async def register_workflow(
+        self, session, *, projectid: str, wd: types.WorkflowDataWeb
+    ):
+        """
+        Workflows disabled or with dependencies (they are triggered by
+        their upstreams) don't have a periodic job, so it is removed.
+        """
+        if not self.is_periodic(wd):
+            await self.unregister_workflow(wd.wfid)
+            return
+        payload = await self.workflow_payload(session, projectid, wd)
+        await self.store.put(wd.wfid, payload)
         await self.enqueue_job(wd.wfid)
 
     async def unregister_workflow(self, wfid: str, remove_job=True):
-        await self.scheduler.unregister_job(wfid)
+        scheduler = self.scheduler_for(wfid)
+        await scheduler.unregister_job(wfid)
         if remove_job:
-            await self.scheduler.remove_job(wfid)
+            await scheduler.remove_job(wfid)
 
     async def enqueue_job(self, jobid: str):
-        await self.scheduler.enqueue_job(jobid)
+        await self.scheduler_for(jobid).enqueue_job(jobid)
+
+    async def runtimes_for(self, qnames: List[str]) -> Set[str]:
+        """Runtimes of the workflows registered for the given queues, used
+        by agents to pull them before their first run"""
+        runtimes = set()
+        workflow_func = self.tasks["workflow"]
+        async for _, data in self.conn.hscan_iter(self.store.jobs_prefix):
+            try:
+                job = json.loads(data)
+            except ValueError:
+                continue
+            if job.get("func_name") != workflow_func or job.get("queue") not in qnames:
+                continue
+            ctx = job.get("params", {}).get("data", {})
+            if ctx.get("runtime"):
+                runtimes.add(ctx["runtime"])
+        return runtimes
 
 
 class SchedulerExec:
@@ -88,6 +219,7 @@ class SchedulerExec:
 
     tasks = {
         "notebook": "labfunctions.control.tasks.notebook_dispatcher",
+        "notebook_batch": "labfunctions.control.tasks.notebook_batch_dispatcher",
         "build": "labfunctions.control.tasks.build_dispatcher",
         "create_instance": "labfunctions.control.tasks.create_instance",
         "destroy_instance": "labfunctions.control.tasks.destroy_instance",
@@ -119,22 +251,249 @@ class SchedulerExec:
         projectid: str,
         task: types.NBTask,
         prefix=None,
+        wfid: Optional[str] = None,
+        dagid: Optional[str] = None,
+        upstream: Optional[Dict[str, types.DagNodeRef]] = None,
+        admit: bool = True,
     ) -> types.ExecutionNBTask:
+        """
+        :param wfid: workflow which is being run, if any
+        :param dagid: DAG run of the workflow, if not given the run of
+        a workflow starts a new DAG run with its execid as dagid.
+        :param upstream: results of the upstreams of the workflow,
+        passed to the notebook as the `UPSTREAM` param.
+        :param admit: check the limits of the queue
+        :raises errors.QueueFull: if the queue of the task is over its limits
+
+        If the task is memoized and a successful execution with the same
+        key exists, the task isn't enqueued: its result, pointing to the
+        output of the execution found, is registered in the history.
+
+        A task with `map` starts a map instead, see `enqueue_map`.
+        """
+        if task.map:
+            return await self.enqueue_map(
+                session,
+                projectid=projectid,
+                task=task,
+                wfid=wfid,
+                dagid=dagid,
+                upstream=upstream,
+                admit=admit,
+            )
+        qname = f"{task.cluster}.{task.machine}"
+        Q = self.fair_queue(qname)
+
+        runtime = await task_runtime(session, projectid, task)
+        nb_ctx = await create_task_ctx(
+            session, projectid, task, prefix=prefix, wfid=wfid, runtime=runtime
+        )
+        if wfid:
+            nb_ctx.dagid = dagid or nb_ctx.execid
+            nb_ctx.params["DAGID"] = nb_ctx.dagid
+        if upstream:
+            nb_ctx.params["UPSTREAM"] = {k: v.dict() for k, v in upstream.items()}
+        if task.memoize:
+            nb_ctx.memo_key = memo_key(
+                nb_ctx, runtime, self.settings.DOCKER_MUTABLE_TAGS
+            )
+            if nb_ctx.memo_key and await self.reuse_execution(session, nb_ctx):
+                return nb_ctx
 
-        nb_ctx = await create_task_ctx(session, projectid, task, prefix=prefix)
+        if admit:
+            await self.admit(Q)
 
-        qname = f"{nb_ctx.cluster}.{nb_ctx.machine}"
-        Q = Queue(qname, conn=self.conn)
+        meta = requests_meta(task.cpus, task.memory_mb)
+        if task.batch:
+            meta.update(batch_meta(projectid, nb_ctx.runtime, task.gpu_support))
+        timeline.mark(nb_ctx.timeline, "enqueued")
         job = await Q.enqueue(
             self.tasks["notebook"],
+            projectid=projectid,
+            priority=nb_ctx.priority,
             execid=nb_ctx.execid,
             timeout=task.timeout,
             background=True,
-            params={"data": nb_ctx.dict()},
+            params={"data": pack_ctx(nb_ctx, self.settings.PAYLOAD_CODEC)},
+            meta=meta,
         )
 
         return nb_ctx
 
+    def map_state(self, mapid: str) -> MapState:
+        return MapState(self.conn, mapid, ttl=self.settings.DAG_STATE_TTL)
+
+    async def enqueue_map(
+        self,
+        session,
+        *,
+        projectid: str,
+        task: types.NBTask,
+        wfid: Optional[str] = None,
+        dagid: Optional[str] = None,
+        upstream: Optional[Dict[str, types.DagNodeRef]] = None,
+        admit: bool = True,
+    ) -> types.ExecutionNBTask:
+        """
+        It starts a map: the first partitions of the task, up to its
+        concurrency, are enqueued as children of the map (see
+        `control.fanout`). The admission limits are checked once for the
+        whole map.
+
+        The ctx returned is the ctx of the map, its execid is the mapid
+        which is given to the children as the `MAPID` param.
+        """
+        if admit:
+            await self.admit(self.fair_queue(f"{task.cluster}.{task.machine}"))
+        nb_ctx = await create_task_ctx(
+            session, projectid, task, prefix="map", wfid=wfid
+        )
+        if wfid:
+            nb_ctx.dagid = dagid or nb_ctx.execid
+        params = {**task.params, defaults.MAPID_PARAM: nb_ctx.execid}
+        if upstream:
+            params["UPSTREAM"] = {k: v.dict() for k, v in upstream.items()}
+        mt = types.MapTask(
+            mapid=nb_ctx.execid,
+            projectid=projectid,
+            task=task.copy(update={"map": None, "params": params}),
+            map=task.map,
+            wfid=wfid,
+            dagid=nb_ctx.dagid,
+        )
+        state = self.map_state(mt.mapid)
+        await state.create(mt)
+        first = await state.next(task.map.concurrency or len(task.map.partitions))
+        for index in first:
+            await self.enqueue_partition(session, mt, index)
+        return nb_ctx
+
+    async def enqueue_partition(
+        self, session, mt: types.MapTask, index: int
+    ) -> types.ExecutionNBTask:
+        return await self.enqueue_notebook(
+            session,
+            projectid=mt.projectid,
+            task=partition_task(mt, index),
+            wfid=mt.wfid,
+            dagid=mt.dagid,
+            admit=False,
+        )
+
+    async def on_partition_result(
+        self, session, result: types.ExecutionResult
+    ) -> List[types.ExecutionNBTask]:
+        """
+        A child of a map finished. A failed partition is enqueued again
+        while it has retries, otherwise the map fails. After a partition
+        ok the next one pending is enqueued, and after the last one the
+        reduce of the map.
+
+        The map is registered in the history when it fails or when it
+        finished without a reduce, then its DAG run continues.
+        """
+        state = self.map_state(result.params[defaults.MAPID_PARAM])
+        mt = await state.spec()
+        if not mt:
+            return []
+        index = int(result.params[defaults.MAP_INDEX_PARAM])
+        if result.error:
+            if await state.failure(index) <= mt.map.retries:
+                return [await self.enqueue_partition(session, mt, index)]
+            await state.fail(index)
+            if await state.claim("done"):
+                await self.register_map(session, map_result(mt, result, error=True))
+            return []
+
+        done = await state.record(
+            types.MapPartitionRef(
+                index=index,
+                partition=mt.map.partitions[index],
+                execid=result.execid,
+                output_dir=result.output_dir,
+                output_name=result.output_name,
+            )
+        )
+        enqueued = []
+        for next_ix in await state.next():
+            enqueued.append(await self.enqueue_partition(session, mt, next_ix))
+        if done < len(mt.map.partitions) or not await state.claim("done"):
+            return enqueued
+        if mt.map.reduce:
+            ctx = await self.enqueue_notebook(
+                session,
+                projectid=mt.projectid,
+                task=reduce_task(mt, await state.results()),
+                wfid=mt.wfid,
+                dagid=mt.dagid,
+                admit=False,
+            )
+            enqueued.append(ctx)
+        else:
+            result = map_result(mt, result, error=False)
+            enqueued.extend(await self.register_map(session, result))
+        return enqueued
+
+    async def register_map(
+        self, session, result: types.ExecutionResult
+    ) -> List[types.ExecutionNBTask]:
+        await history_mg.create(session, result)
+        return await self.on_workflow_result(session, result)
+
+    @property
+    def memo(self) -> MemoStore:
+        return MemoStore(self.conn, ttl=self.settings.MEMO_TTL)
+
+    async def reuse_execution(self, session, nb_ctx: types.ExecutionNBTask) -> bool:
+        """
+        Registers the result of a memoized task from the execution kept by
+        its memo key, if any. The output of `nb_ctx` is changed to the
+        output reused and downstreams continue as after any result.
+        """
+        hit = await self.memo.get(nb_ctx.projectid, nb_ctx.memo_key)
+        if not hit:
+            return False
+        result = memo_result(nb_ctx, hit)
+        nb_ctx.output_dir = result.output_dir
+        nb_ctx.output_name = result.output_name
+        nb_ctx.pm_output = f"{result.output_dir}/{result.output_name}"
+        await history_mg.create(session, result)
+        await self.on_workflow_result(session, result)
+        return True
+
+    def fair_queue(self, qname: str) -> FairQueue:
+        return FairQueue(
+            qname,
+            conn=self.conn,
+            default_timeout=self.settings.QUEUE_DEFAULT_TIMEOUT,
+            queue_wait_ttl=self.settings.QUEUE_WAIT_TTL,
+            weights=self.settings.QUEUE_PROJECT_WEIGHTS,
+            max_running=self.settings.QUEUE_PROJECT_MAX_RUNNING,
+            max_running_default=self.settings.QUEUE_MAX_RUNNING_DEFAULT,
+        )
+
+    async def queue_stats(self, qname: str) -> types.QueueStats:
+        return await self.fair_queue(qname).stats()
+
+    async def list_queues(self) -> List[str]:
+        keys = await self.conn.smembers(Prefixes.queues_list.value)
+        prefix = Prefixes.queue_jobs.value
+        return sorted(k[len(prefix) :] for k in keys if k.startswith(prefix))
+
+    def queue_limits(self, qname: str) -> types.QueueLimits:
+        return self.settings.QUEUE_LIMITS.get(qname, self.settings.QUEUE_LIMITS_DEFAULT)
+
+    async def admit(self, Q: FairQueue):
+        limits = self.queue_limits(Q.name)
+        stats = types.QueueStats(qname=Q.name)
+        if limits.require_workers:
+            stats.workers = await Q.workers()
+        if limits.max_depth:
+            stats.depth = await Q.depth()
+        if limits.max_age:
+            stats.oldest_age = await Q.oldest_age()
+        check_admission(stats, limits)
+
     async def enqueue_build(
         self,
         session,
@@ -171,11 +530,69 @@ class SchedulerExec:
         )
         if wd and wd.enabled:
             ctx = await self.enqueue_notebook(
-                session, projectid=projectid, task=wd.nbtask
+                session, projectid=projectid, task=wd.nbtask, wfid=wfid
             )
             return ctx
         return None
 
+    def dag_state(self, dagid: str) -> DagState:
+        return DagState(self.conn, dagid, ttl=self.settings.DAG_STATE_TTL)
+
+    async def on_workflow_result(
+        self, session, result: types.ExecutionResult
+    ) -> List[types.ExecutionNBTask]:
+        """
+        Records the result of a workflow in its DAG run and enqueues the
+        downstreams whose upstreams are all done. Independent downstreams
+        are enqueued at the same time, each one to the queue of its machine.
+
+        Downstreams are continuations of a run already accepted,
+        so they skip the admission limits of their queues.
+
+        Results of the children of a map go to `on_partition_result`.
+        """
+        if is_partition(result):
+            return await self.on_partition_result(session, result)
+        if not result.dagid or not result.wfid:
+            return []
+        workflows = await workflows_mg.get_dag(session, result.projectid)
+        wf = next((w for w in workflows.values() if w.wfid == result.wfid), None)
+        if not wf:
+            return []
+
+        state = self.dag_state(result.dagid)
+        await state.record(
+            types.DagNodeRef(
+                alias=wf.alias,
+                wfid=wf.wfid,
+                execid=result.execid,
+                error=result.error,
+                output_dir=result.output_dir,
+                output_name=result.output_name,
+            )
+        )
+        if result.error:
+            return []
+
+        nodes = await state.nodes()
+        enqueued = []
+        for down in downstreams(workflows, wf.alias):
+            if not down.enabled or not is_ready(down, nodes):
+                continue
+            if not await state.claim(down.alias):
+                continue
+            ctx = await self.enqueue_notebook(
+                session,
+                projectid=result.projectid,
+                task=down.nbtask,
+                wfid=down.wfid,
+                dagid=result.dagid,
+                upstream={up: nodes[up] for up in down.depends_on},
+                admit=False,
+            )
+            enqueued.append(ctx)
+        return enqueued
+
     async def enqueue_instance_creation(self, ctx: cluster.CreateRequest) -> Job:
         execid = f"cls{str(ExecID())}"
         job = await self.control_q.enqueue(
@@ -223,6 +640,48 @@ class SchedulerExec:
         job = await self._get_job(execid)
         if not job:
             return None
+        return self._task_status(execid, job)
+
+    async def get_tasks(
+        self, execids: List[str]
+    ) -> Dict[str, Union[types.TaskStatus, None]]:
+        """Like get_task but fetching all the jobs in one pipeline"""
+        async with self.conn.pipeline(transaction=False) as pipe:
+            for execid in execids:
+                pipe.get(f"{Prefixes.job.value}{execid}")
+            rsp = await pipe.execute()
+
+        tasks = {}
+        for execid, data in zip(execids, rsp):
+            tasks[execid] = None
+            if data:
+                payload = serializers.job_deserializer(data)
+                job = Job(execid, conn=self.conn, payload=payload)
+                tasks[execid] = self._task_status(execid, job)
+        return tasks
+
+    async def wait_tasks(
+        self,
+        execids: List[str],
+        *,
+        statuses: Dict[str, str],
+        timeout: float,
+        poll_delay: float = 0.5,
+    ) -> Dict[str, Union[types.TaskStatus, None]]:
+        """
+        Long polling of tasks, it returns as soon as the status of some task
+        is different from the one given in `statuses` or after `timeout` secs.
+        """
+        started = now_secs()
+        while True:
+            tasks = await self.get_tasks(execids)
+            if changed_tasks(tasks, statuses):
+                return tasks
+            if now_secs() - started + poll_delay > timeout:
+                return tasks
+            await asyncio.sleep(poll_delay)
+
+    def _task_status(self, execid: str, job: Job) -> types.TaskStatus:
         r = None
         e = None
         if job.result:
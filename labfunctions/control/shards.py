@@ -0,0 +1,195 @@
+import asyncio
+import bisect
+import hashlib
+from typing import List, Optional, Set
+
+from libq import JobStoreSpec, RedisJobStore, Scheduler
+from libq import defaults as libq_defaults
+from libq.utils import generate_random, now_secs
+from redis.asyncio import ConnectionPool
+
+from labfunctions import log, types
+from labfunctions.redis_conn import create_pool
+
+SHARDS_PREFIX = "lf.sch::"
+RING_VNODES = 64
+
+# renew the lease if it is ours, otherwise take it only if it is free
+_ACQUIRE_LUA = """
+local cur = redis.call('GET', KEYS[1])
+if cur == ARGV[1] then
+  redis.call('PEXPIRE', KEYS[1], ARGV[2])
+  return 1
+end
+if not cur then
+  redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+  return 1
+end
+return 0
+"""
+
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _hash(key: str) -> int:
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+def partition_for(jobid: str, shards: int) -> str:
+    """
+    libq partition of a scheduled job. With one shard, the default libq
+    partition is used, so jobs registered before sharding keep working.
+    The number of shards must not change while jobs are registered.
+    """
+    if shards <= 1:
+        return libq_defaults.SCHEDULER_PARTITION
+    return f"{libq_defaults.SCHEDULER_PARTITION}.{_hash(jobid) % shards}"
+
+
+def partitions(shards: int) -> List[str]:
+    if shards <= 1:
+        return [libq_defaults.SCHEDULER_PARTITION]
+    return [f"{libq_defaults.SCHEDULER_PARTITION}.{n}" for n in range(shards)]
+
+
+class HashRing:
+    """
+    Consistent hashing of keys to members. Each member is placed many
+    times (`vnodes`) in the ring, so when a member is added or removed
+    only its share of keys moves to other members.
+    """
+
+    def __init__(self, members: List[str], vnodes: int = RING_VNODES):
+        self._ring = sorted(
+            (_hash(f"{m}#{v}"), m) for m in set(members) for v in range(vnodes)
+        )
+        self._points = [p for p, _ in self._ring]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._ring:
+            return None
+        ix = bisect.bisect(self._points, _hash(key)) % len(self._ring)
+        return self._ring[ix][1]
+
+
+class ShardedScheduler:
+    """
+    One of many scheduler processes. Scheduled jobs are split in a fixed
+    number of libq partitions (`partition_for`), and partitions are split
+    between the live scheduler processes with a `HashRing`.
+
+    Each process heartbeats in a redis sorted set, takes a lease by
+    partition before evaluating it and renews it on each check. When a
+    process dies, its heartbeat gets old and its leases expire, then the
+    partitions are taken by the next owners in the ring.
+
+    :param conn: async redis where the libq jobs are
+    :param shards: number of partitions, the same as used by `JobManager`
+    :param interval: secs between checks
+    """
+
+    def __init__(
+        self,
+        conn: ConnectionPool,
+        *,
+        shards: int = 1,
+        store: Optional[JobStoreSpec] = None,
+        member_id: Optional[str] = None,
+        interval: int = 30,
+    ):
+        self.conn = conn
+        self.store = store or RedisJobStore(conn)
+        self.shards = shards
+        self.id = member_id or generate_random()
+        self.interval = interval
+        self.ttl = interval * 3
+        self.leading: Set[str] = set()
+        self._acquire = self.conn.register_script(_ACQUIRE_LUA)
+        self._release = self.conn.register_script(_RELEASE_LUA)
+
+    @property
+    def members_key(self) -> str:
+        return f"{SHARDS_PREFIX}members"
+
+    def lease_key(self, partition: str) -> str:
+        return f"{SHARDS_PREFIX}lease:{partition}"
+
+    async def heartbeat(self):
+        now = now_secs()
+        async with self.conn.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.members_key, {self.id: now})
+            pipe.zremrangebyscore(self.members_key, 0, now - self.ttl)
+            await pipe.execute()
+
+    async def members(self) -> List[str]:
+        since = now_secs() - self.ttl
+        return await self.conn.zrangebyscore(self.members_key, since, "+inf")
+
+    def assigned(self, members: List[str]) -> List[str]:
+        ring = HashRing(members)
+        return [p for p in partitions(self.shards) if ring.owner(p) == self.id]
+
+    async def acquire(self, partition: str) -> bool:
+        ok = await self._acquire(
+            keys=[self.lease_key(partition)], args=[self.id, self.ttl * 1000]
+        )
+        return ok == 1
+
+    async def release(self, partition: str):
+        await self._release(keys=[self.lease_key(partition)], args=[self.id])
+
+    async def tick(self, partition: str) -> int:
+        """Enqueues the jobs of the partition whose next run is due"""
+        sched = Scheduler(self.store, conn=self.conn, partition=partition)
+        due = await self.conn.zrangebyscore(sched.jobs_key, 0, now_secs())
+        for jobid in due:
+            await sched.enqueue_job(jobid)
+        return len(due)
+
+    async def run_once(self) -> List[str]:
+        """It returns the partitions led in this check"""
+        await self.heartbeat()
+        mine = self.assigned(await self.members())
+        for p in self.leading - set(mine):
+            await self.release(p)
+        led = []
+        for p in mine:
+            if await self.acquire(p):
+                await self.tick(p)
+                led.append(p)
+        if set(led) != self.leading:
+            log.server_logger.info(f"SCHEDULER {self.id}: leading {sorted(led)}")
+        self.leading = set(led)
+        return led
+
+    async def stop(self):
+        for p in self.leading:
+            await self.release(p)
+        self.leading = set()
+        await self.conn.zrem(self.members_key, self.id)
+
+    async def run(self):
+        try:
+            while True:
+                try:
+                    await self.run_once()
+                except Exception as e:
+                    log.server_logger.error(f"SCHEDULER {self.id}: check failed {e}")
+                await asyncio.sleep(self.interval)
+        finally:
+            await self.stop()
+
+
+def create_sharded_scheduler(
+    settings: types.ServerSettings, interval: Optional[int] = None
+) -> ShardedScheduler:
+    return ShardedScheduler(
+        create_pool(settings.QUEUE_REDIS),
+        shards=settings.SCHEDULER_SHARDS,
+        interval=interval or settings.SCHEDULER_INTERVAL_SECS,
+    )
@@ -1,18 +1,26 @@
 # import asyncio
 from datetime import datetime
 from functools import partial
-from typing import Any, Dict
+from typing import Any, Dict, List
 
+import redis
 from tenacity import RetryError, retry, stop_after_attempt, wait_random
 
-from labfunctions import client, cluster, log, types
+from labfunctions import client, cluster, defaults, log, timeline, types
 from labfunctions.conf import load_server
 from labfunctions.executors import ExecID
-from labfunctions.executors.docker_exec import docker_exec
+from labfunctions.executors.docker_exec import docker_exec, docker_exec_batch
+from labfunctions.executors.pool import create_container_pool
+from labfunctions.executors.pull_cache import create_pull_cache
 from labfunctions.redis_conn import create_pool
 from labfunctions.runtimes.builder import builder_exec
 from labfunctions.utils import get_version, run_async, today_string
 
+from .codec import unpack_ctx
+from .overlap import CancelWatcher, WorkflowLock
+
+OVERLAP_TTL_MARGIN = 60 * 5
+
 
 @retry(stop=stop_after_attempt(5), wait=wait_random(min=10, max=20))
 async def _deploy_agent(
@@ -61,21 +69,81 @@ async def _deploy_agent(
 
 
 def notebook_dispatcher(data: Dict[str, Any]):
-    ctx = types.ExecutionNBTask(**data)
-    result = docker_exec(ctx)
+    ctx = unpack_ctx(data)
+    timeline.mark(ctx.timeline, "dequeued")
+    settings = load_server()
+    pool = create_container_pool(settings)
+    pulls = create_pull_cache(settings)
+    result = docker_exec(
+        ctx,
+        pool=pool,
+        pulls=pulls,
+        ctx_dir=settings.DOCKER_CTX_DIR,
+        settings=settings,
+    )
     return result.dict()
 
 
-def workflow_dispatcher(data: Dict[str, Any]):
-    ctx = types.ExecutionNBTask(**data)
-    ctx.execid = str(ExecID())
+def notebook_batch_dispatcher(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Tasks grouped by `control.batch.Batcher`, a result by task"""
+    ctxs = [unpack_ctx(data) for data in items]
+    for ctx in ctxs:
+        timeline.mark(ctx.timeline, "dequeued")
+    settings = load_server()
+    pulls = create_pull_cache(settings)
+    results = docker_exec_batch(
+        ctxs, pulls=pulls, ctx_dir=settings.DOCKER_CTX_DIR, settings=settings
+    )
+    return [r.dict() for r in results]
+
 
+def _run_workflow(ctx: types.ExecutionNBTask, execid: str) -> Dict[str, Any]:
+    """A scheduled run starts a new DAG run for the downstreams of the workflow"""
+    ctx.execid = execid
+    ctx.dagid = execid
     today = today_string(format_="day")
     _now = datetime.utcnow().isoformat()
+    ctx.params["EXECID"] = execid
+    ctx.params["DAGID"] = execid
     ctx.params["NOW"] = _now
     ctx.created_at = _now
     ctx.today = today
-    result = notebook_dispatcher(ctx.dict())
+    return notebook_dispatcher(ctx.dict())
+
+
+def workflow_dispatcher(data: Dict[str, Any], overlap=defaults.OVERLAP_DEFAULT):
+    """
+    Runs a scheduled workflow applying its overlap policy. While the run is
+    in progress its execid is kept in redis by wfid, if the policy is
+    coalesce, triggers received meanwhile are run once when it finishes.
+    """
+    ctx = unpack_ctx(data)
+    execid = str(ExecID())
+    if overlap == "allow" or overlap not in defaults.OVERLAP_POLICIES:
+        return _run_workflow(ctx, execid)
+
+    settings = load_server()
+    conn = redis.from_url(settings.QUEUE_REDIS, decode_responses=True)
+    lock = WorkflowLock(conn, ctx.wfid, ttl=ctx.timeout + OVERLAP_TTL_MARGIN)
+    decision = lock.acquire(execid, overlap)
+    if not decision.should_run:
+        log.server_logger.info(
+            f"{ctx.wfid}: {decision.action} {execid}, {decision.previous} running"
+        )
+        return dict(wfid=ctx.wfid, execid=execid, **decision.dict())
+
+    result = None
+    while execid:
+        watcher = None
+        if overlap == "cancel":
+            watcher = CancelWatcher(lock, execid)
+            watcher.start()
+        try:
+            result = _run_workflow(ctx, execid)
+        finally:
+            if watcher:
+                watcher.stop()
+            execid = lock.release(execid)
     return result
 
 
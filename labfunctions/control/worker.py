@@ -0,0 +1,145 @@
+import random
+from typing import Dict, Optional
+
+from libq.logs import logger
+from libq.utils import elapsed_from, now_iso
+from libq.worker import AsyncWorker
+
+from .batch import Batcher
+from .capacity import Capacity, fetch_meta, job_requests
+from .fairq import FairQueue
+
+
+class FairWorker(AsyncWorker):
+    """
+    A libq AsyncWorker which also takes jobs from the fair queues
+    (see `FairQueue`) of the queues that it listens to.
+
+    It blocks on the libq lists of the queues, which are still used by
+    the scheduler for periodic workflows, and on the notify lists
+    of the fair queues. When a notification arrives, the next job is
+    taken from the lanes by priority and project share.
+
+    With a `Capacity`, a job starts only when the cpus and memory it
+    requests are free. Jobs of the fair queues are only taken when they
+    fit, the others wait first in their lanes; jobs of the libq lists
+    wait in the worker. The free capacity is sent in the metadata of each
+    heartbeat.
+
+    With a `Batcher`, the jobs that it accepts run grouped with others
+    of the same batch key, see `control.batch`. The batcher reserves the
+    capacity of each group, not its jobs.
+    """
+
+    def __init__(
+        self,
+        queues: str,
+        *,
+        conn=None,
+        capacity: Optional[Capacity] = None,
+        batcher: Optional[Batcher] = None,
+        **kwargs,
+    ):
+        super().__init__(queues, conn=conn, **kwargs)
+        self.capacity = capacity
+        self.batcher = batcher
+        self.fairqs: Dict[str, FairQueue] = {}
+        for q in self._queues:
+            fq = FairQueue(q, conn=self.conn)
+            self.fairqs[fq.notify_key] = fq
+
+    async def _poll_fair(self, fq: FairQueue):
+        item = await fq.pop(self.capacity.free() if self.capacity else None)
+        if item:
+            execid, priority, projectid = item
+            logger.debug(f"Job: {execid} from lane {priority} of {projectid}")
+            await self.start_job(execid, fq.name)
+
+    async def _poll_blocking(self):
+        keys = self.queues + list(self.fairqs.keys())
+        random.shuffle(keys)
+
+        async with self.sem:
+            task = await self.conn.blpop(keys, self.poll_delay_s)
+
+        if task:
+            _key = task[0]
+            self.last_job = now_iso()
+            if _key in self.fairqs:
+                await self._poll_fair(self.fairqs[_key])
+            else:
+                await self.start_job(task[1], _key)
+        else:
+            # jobs could be waiting for a slot without a token
+            for fq in self.fairqs.values():
+                await self._poll_fair(fq)
+            last = elapsed_from(self.last_job)
+            self.idle_secs += last
+
+        for exec_id, t in list(self.tasks.items()):
+            if t.done():
+                del self.tasks[exec_id]
+                t.result()
+
+    async def start_job(self, execid: str, qname: str):
+        if not self.capacity:
+            await super().start_job(execid, qname)
+            return
+        meta = await fetch_meta(self.conn, execid)
+        if self.batcher and self.batcher.batchable(meta):
+            await super().start_job(execid, qname)
+            return
+        cpus, memory_mb = job_requests(meta)
+        await self.capacity.reserve(execid, cpus, memory_mb)
+        await super().start_job(execid, qname)
+        task = self.tasks.get(execid)
+        if task:
+            task.add_done_callback(lambda _: self.capacity.release(execid))
+        else:
+            # it was already running elsewhere
+            self.capacity.release(execid)
+
+    async def call_func_bg(self, payload):
+        if self.batcher and self.batcher.accepts(payload):
+            return await self.batcher.submit(payload)
+        return await super().call_func_bg(payload)
+
+    async def close(self):
+        await super().close()
+        if self.batcher:
+            self.batcher.shutdown()
+
+    async def register(self):
+        if self.capacity:
+            self._metadata = dict(
+                self._metadata or {}, resources=self.capacity.stats().dict()
+            )
+        await super().register()
+
+    async def _release(self, execid: str, qname: str):
+        fq = self._fairq(qname)
+        if fq:
+            await fq.release(execid)
+
+    def _fairq(self, qname: str) -> Optional[FairQueue]:
+        for fq in self.fairqs.values():
+            if fq.name == qname:
+                return fq
+        return None
+
+    async def _set_job_failed(self, execid: str, *, qname: str, payload):
+        await super()._set_job_failed(execid, qname=qname, payload=payload)
+        await self._release(execid, qname)
+
+    async def _set_job_completed(self, execid: str, *, qname: str):
+        await super()._set_job_completed(execid, qname=qname)
+        await self._release(execid, qname)
+
+    async def _set_retry_job(self, execid: str, *, qname: str):
+        """Jobs of a fair queue are retried from their lane, with the
+        limits of their project"""
+        fq = self._fairq(qname)
+        if fq and await fq.requeue(execid):
+            await self.unlock_job(execid)
+            return
+        await super()._set_retry_job(execid, qname=qname)
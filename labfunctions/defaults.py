@@ -44,13 +44,37 @@ DOCKER_UID = "1000"
 DOCKER_GID = "997"
 DOCKER_APP_UID = 1089
 DOCKER_APP_GID = 1090
+# warm containers kept by the agent
+WARM_PORT = 9977
+WARM_TOKEN_VAR = "LF_WARM_TOKEN"
+WARM_KERNEL_VAR = "LF_WARM_KERNEL"
+# cell cache of local runs, see executors.cell_cache
+CELL_CACHE_VAR = "LF_CELL_CACHE"
+CELL_CHECKPOINT_TAG = "checkpoint"
+# dir of the "local" strategy of io.cache
+CACHE_DIR_VAR = "LF_CACHE_DIR"
+# how a notebook runs: "notebook" with papermill or "script" as a module,
+# see executors.script
+EXEC_MODES = ["notebook", "script"]
+SCRIPT_STDOUT_MAX = 64 * 1024
+# params added to each execution which don't change what a notebook does
+VOLATILE_PARAMS = ["WFID", "EXECID", "NOW", "DAGID", "MAPID"]
+# params of the children of a map and of its reduce
+MAPID_PARAM = "MAPID"
+MAP_INDEX_PARAM = "MAP_INDEX"
+MAP_RESULTS_PARAM = "MAP_RESULTS"
 
 # Sanic
 SANIC_APP_NAME = "labfunctions"
 
 NB_OUTPUTS = "outputs"
+# compression of the output notebooks uploaded, see io.streams
+OUTPUT_ENCODING = "gzip"
 
 EXECUTIONTASK_VAR = "LF_EXECUTION_TASK"
+# the env of a task written to a file, see executors.handoff
+CTX_FILE_VAR = "LF_CTX_FILE"
+CTX_FILE_MOUNT = "/run/lf/ctx.json"
 JUPYTERCTX_VAR = "LF_JUPYTER_CTX"
 
 BASE_PATH_ENV = "LF_BASE_PATH"
@@ -72,6 +96,18 @@ NANO_MACHINE_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
 MACHINE_TYPE = "cpu"
 CLUSTER_NAME = "default"
 
+# Priority lanes, ordered from the most to the least important
+PRIORITY_LANES = ["high", "normal", "low"]
+PRIORITY_DEFAULT = "normal"
+
+# What to do when a workflow is triggered while a previous run is in progress
+OVERLAP_POLICIES = ["allow", "skip", "coalesce", "cancel"]
+OVERLAP_DEFAULT = "allow"
+
+# Batch lookup of tasks status
+TASK_BATCH_MAX = 200
+TASK_BATCH_MAX_WAIT = 50
+
 AGENT_HOMEDIR = "/home/op"
 AGENT_DOCKER_IMG = "nuxion/labfunctions"
 AGENT_ENV_TPL = "agent.docker.envfile"
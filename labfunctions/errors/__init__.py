@@ -6,6 +6,8 @@ from .generics import (
     HistoryNotebookError,
     PrivateKeyNotFound,
     ProjectNotFound,
+    QueueFull,
+    WorkflowDagError,
     WorkflowDisabled,
     WorkflowNotFound,
 )
@@ -30,6 +30,23 @@ class WorkflowRegisterClientError(Exception):
         super().__init__(_msg)
 
 
+class QueueFull(Exception):
+    def __init__(self, qname, reason, retry_after):
+        self.qname = qname
+        self.reason = reason
+        self.retry_after = retry_after
+        _msg = f"Queue {qname} is not accepting tasks: {reason}"
+        super().__init__(_msg)
+
+
+class WorkflowDagError(Exception):
+    def __init__(self, alias, reason):
+        self.alias = alias
+        self.reason = reason
+        _msg = f"Wrong dependencies for workflow {alias}: {reason}"
+        super().__init__(_msg)
+
+
 class HistoryNotebookError(Exception):
     def __init__(self, addr, uri):
         _msg = f"Error getting {uri} from {addr}"
@@ -0,0 +1,99 @@
+"""
+Short notebooks of a project which share the runtime are run in one
+container session: the agent groups them (see `control.batch`) and starts
+one container with `lab exec batch` for all of them, so the creation of
+the container and the startup of Python are paid once by batch.
+
+The handoff file of a batch (see `executors.handoff`) has the env shared
+by the tasks and the context of each task. Inside the container the tasks
+run one after the other, each one in a forked child with its own env and
+its own scratch dir as TMPDIR, removed when the task ends. The context of
+a task is written to a handoff file in its scratch dir, it isn't put in
+the env of the child. Outputs are
+named by execid, and each child registers its result as `lab exec local`
+does.
+
+The agent reads the status and the output of each task from the lines of
+the logs of the container which start with `BATCH_MARKER`.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from labfunctions import defaults
+
+from .handoff import child_handoff
+from .warm import run_forked, run_local
+
+BATCH_MARKER = "lf-batch:"
+
+
+def batch_handoff(env: Dict[str, str], ctxs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """What the agent writes in the handoff file of a batch"""
+    return {"env": env, "tasks": ctxs}
+
+
+def _in_scratch(scratch: str, func: Callable[[], int]) -> Callable[[], int]:
+    def run() -> int:
+        # the parent already cached its temp dir before forking
+        tempfile.tempdir = scratch
+        return func()
+
+    return run
+
+
+def run_batch(path: Optional[str] = None, func: Callable[[], int] = run_local) -> int:
+    """
+    It runs the tasks of the handoff file of a batch, a line with the
+    result of each task is printed after it. It returns the number of
+    tasks failed.
+
+    :param path: by default, taken from `defaults.CTX_FILE_VAR`
+    :param func: what each child runs, `run_local` by default
+    """
+    path = path or os.environ[defaults.CTX_FILE_VAR]
+    with open(path) as f:
+        data = json.load(f)
+    failed = 0
+    for ctx in data["tasks"]:
+        scratch = tempfile.mkdtemp(prefix=f"lf-{ctx['execid']}-")
+        started = time.time()
+        try:
+            env = child_handoff(
+                {
+                    **data["env"],
+                    defaults.EXECUTIONTASK_VAR: json.dumps(ctx),
+                    "TMPDIR": scratch,
+                },
+                scratch,
+            )
+            status, logs = run_forked(env, _in_scratch(scratch, func))
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        line = dict(
+            execid=ctx["execid"],
+            status=status,
+            elapsed=round(time.time() - started, 2),
+            logs=logs,
+        )
+        print(f"{BATCH_MARKER}{json.dumps(line)}", flush=True)
+        failed += int(status != 0)
+    return failed
+
+
+def parse_batch_logs(logs: str) -> Dict[str, Dict[str, Any]]:
+    """Results of the tasks of a batch by execid, from the logs of
+    its container"""
+    results = {}
+    for line in logs.splitlines():
+        if not line.startswith(BATCH_MARKER):
+            continue
+        try:
+            item = json.loads(line[len(BATCH_MARKER) :])
+        except ValueError:
+            continue
+        results[item["execid"]] = item
+    return results
@@ -0,0 +1,250 @@
+"""
+Incremental execution of a notebook by cells, for the edit-run cycles of
+local runs (`lab exec notebook -L --cell-cache local`).
+
+Each code cell has a fingerprint made from its source and the fingerprint
+of the cell before it, so a change in a cell invalidates the cells after
+it. The params of the run are part of the fingerprints, except the
+volatile ones (`defaults.VOLATILE_PARAMS`).
+
+After a cell tagged `defaults.CELL_CHECKPOINT_TAG` runs, the namespace of
+the kernel is kept with the cache of `io.cache`, by the fingerprint of the
+cell. In the next run the notebook resumes from the deepest checkpoint
+still valid: its namespace is restored, the injected params are run again
+and the cells before it are skipped.
+
+A namespace with values that can't be pickled, like locks or
+connections, isn't kept, because resuming without them would fail later.
+"""
+import ast
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import cloudpickle
+from nbclient.exceptions import CellExecutionError
+from nbclient.util import run_sync
+from papermill.clientwrap import PapermillNotebookClient
+from papermill.engines import NBClientEngine, papermill_engines
+from papermill.utils import merge_kwargs, remove_args
+
+from labfunctions import defaults, log
+from labfunctions.io.cache import (
+    CacheConfig,
+    build_ctx,
+    cache_manager_read,
+    cache_manager_write,
+    is_valid_date,
+)
+
+ENGINE_NAME = "lf-cells"
+PARAMS_TAG = "injected-parameters"
+_EXCLUDED = {"In", "Out", "get_ipython", "exit", "quit"}
+
+_SAVE_CODE = """
+from labfunctions.executors.cell_cache import save_namespace as _lf_save
+_lf_result = _lf_save(globals(), {name!r}, {strategy!r}, {valid_for_min!r})
+del _lf_save
+"""
+
+_RESTORE_CODE = """
+from labfunctions.executors.cell_cache import restore_namespace as _lf_restore
+_lf_result = _lf_restore(globals(), {name!r}, {strategy!r}, {valid_for_min!r})
+del _lf_restore
+"""
+
+
+def _tags(cell) -> List[str]:
+    return cell.get("metadata", {}).get("tags", [])
+
+
+def cell_fingerprints(nb, seed: str = "") -> List[str]:
+    """
+    Fingerprint of each cell. Cells other than code share the
+    fingerprint of the code cell before them.
+
+    :param seed: what identifies the notebook, like its path
+    """
+    params = nb.get("metadata", {}).get("papermill", {}).get("parameters", {})
+    fixed = {k: v for k, v in params.items() if k not in defaults.VOLATILE_PARAMS}
+    current = hashlib.sha256(seed.encode("utf-8")).hexdigest()
+    fps = []
+    for cell in nb.cells:
+        if cell.cell_type == "code":
+            if PARAMS_TAG in _tags(cell):
+                source = json.dumps(fixed, sort_keys=True, default=str)
+            else:
+                source = cell.source
+            data = f"{current}:{source}"
+            current = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        fps.append(current)
+    return fps
+
+
+def checkpoints(nb) -> List[int]:
+    """Indexes of the code cells tagged as checkpoints"""
+    return [
+        ix
+        for ix, cell in enumerate(nb.cells)
+        if cell.cell_type == "code" and defaults.CELL_CHECKPOINT_TAG in _tags(cell)
+    ]
+
+
+def _cache_config(name: str, strategy: str, valid_for_min: int) -> CacheConfig:
+    return CacheConfig(
+        name=name,
+        ctx=build_ctx("lf", "cells"),
+        valid_for_min=valid_for_min,
+        strategy=strategy,
+    )
+
+
+def save_namespace(
+    ns: Dict[str, Any], name: str, strategy="local", valid_for_min=24 * 60
+) -> List[str]:
+    """
+    Run inside of the kernel, it keeps the user variables of `ns`.
+    It returns the names which can't be pickled, if any nothing is kept.
+    """
+    data, skipped = {}, []
+    for k, v in ns.items():
+        if k.startswith("_") or k in _EXCLUDED:
+            continue
+        try:
+            cloudpickle.dumps(v)
+        except Exception:  # pylint: disable=broad-except
+            skipped.append(k)
+            continue
+        data[k] = v
+    if not skipped:
+        cache_manager_write(data, _cache_config(name, strategy, valid_for_min))
+    return skipped
+
+
+def restore_namespace(
+    ns: Dict[str, Any], name: str, strategy="local", valid_for_min=24 * 60
+) -> bool:
+    """Run inside of the kernel, it loads a namespace kept in `ns`"""
+    data, meta = cache_manager_read(_cache_config(name, strategy, valid_for_min))
+    if data is None or not meta:
+        return False
+    if not is_valid_date(meta["execution_dt"], valid_for_min):
+        return False
+    ns.update(data)
+    return True
+
+
+def cell_cache_conf() -> Optional[Dict[str, Any]]:
+    """Conf of the cache from `defaults.CELL_CACHE_VAR`"""
+    data = os.getenv(defaults.CELL_CACHE_VAR)
+    return json.loads(data) if data else None
+
+
+class CellCacheClient(PapermillNotebookClient):
+    """
+    :param seed: what identifies the notebook, like its path
+    :param strategy: one of `io.cache.VALID_STRATEGIES`
+    :param valid_for_min: minutes while a checkpoint is valid
+    """
+
+    def __init__(
+        self, nb_man, *, seed: str, strategy="local", valid_for_min=24 * 60, **kw
+    ):
+        super().__init__(nb_man, **kw)
+        self.seed = seed
+        self.strategy = strategy
+        self.valid_for_min = valid_for_min
+        self.resumed_from: Optional[int] = None
+
+    async def _async_kernel_call(self, code: str, name: str):
+        code = code.format(
+            name=name, strategy=self.strategy, valid_for_min=self.valid_for_min
+        )
+        msg_id = self.kc.execute(
+            code,
+            silent=True,
+            store_history=False,
+            user_expressions={"result": "_lf_result"},
+        )
+        reply = await self.async_wait_for_reply(msg_id)
+        content = reply["content"] if reply else {}
+        result = content.get("user_expressions", {}).get("result", {})
+        if content.get("status") != "ok" or result.get("status") != "ok":
+            log.server_logger.warning(f"Cell cache: {content.get('evalue')}")
+            return None
+        return ast.literal_eval(result["data"]["text/plain"])
+
+    kernel_call = run_sync(_async_kernel_call)
+
+    def papermill_execute_cells(self):
+        fps = cell_fingerprints(self.nb, self.seed)
+        points = checkpoints(self.nb)
+        start = 0
+        for index in reversed(points):
+            if self.kernel_call(_RESTORE_CODE, fps[index]):
+                self.resumed_from = index
+                start = index + 1
+                log.server_logger.info(f"Cell cache: resuming after cell {index}")
+                break
+
+        for index, cell in enumerate(self.nb.cells):
+            try:
+                self.nb_man.cell_start(cell, index)
+                if index < start and PARAMS_TAG not in _tags(cell):
+                    cell.metadata["lf_cached"] = True
+                    continue
+                self.execute_cell(cell, index)
+                if index in points and index >= start:
+                    skipped = self.kernel_call(_SAVE_CODE, fps[index])
+                    if skipped:
+                        log.server_logger.warning(
+                            f"Cell cache: checkpoint {index} not kept, "
+                            f"{', '.join(skipped)} can't be pickled"
+                        )
+            except CellExecutionError as ex:
+                self.nb_man.cell_exception(
+                    self.nb.cells[index], cell_index=index, exception=ex
+                )
+                break
+            finally:
+                self.nb_man.cell_complete(self.nb.cells[index], cell_index=index)
+
+
+class CellCacheEngine(NBClientEngine):
+    """
+    Papermill engine which resumes a notebook from its checkpoints, the
+    cache is configured by `defaults.CELL_CACHE_VAR`.
+    """
+
+    @classmethod
+    def execute_managed_notebook(
+        cls,
+        nb_man,
+        kernel_name,
+        log_output=False,
+        stdout_file=None,
+        stderr_file=None,
+        start_timeout=60,
+        execution_timeout=None,
+        **kwargs,
+    ):
+        conf = cell_cache_conf() or {}
+        seed = kwargs.get("input_path") or ""
+        kwargs = remove_args(["input_path"], **kwargs)
+        safe_kwargs = remove_args(["timeout", "startup_timeout"], **kwargs)
+        final_kwargs = merge_kwargs(
+            safe_kwargs,
+            timeout=execution_timeout if execution_timeout else kwargs.get("timeout"),
+            startup_timeout=start_timeout,
+            kernel_name=kernel_name,
+            log=log.server_logger,
+            log_output=log_output,
+            stdout_file=stdout_file,
+            stderr_file=stderr_file,
+        )
+        client = CellCacheClient(nb_man, seed=str(seed), **conf, **final_kwargs)
+        return client.execute()
+
+
+papermill_engines.register(ENGINE_NAME, CellCacheEngine)
@@ -0,0 +1,128 @@
+import fcntl
+import json
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Union
+
+import jwt
+
+from labfunctions import errors
+from labfunctions.client.diskclient import DiskClient
+from labfunctions.client.nbclient import NBClient
+from labfunctions.types import ServerSettings
+from labfunctions.types.user import AgentJWTResponse
+
+from .handoff import private_dir
+
+
+def token_exp(access_token: str) -> float:
+    """exp claim of a jwt, the signature is checked by the server"""
+    decoded = jwt.decode(access_token, options={"verify_signature": False})
+    return float(decoded.get("exp", 0))
+
+
+def auth_failed(logs: Optional[str]) -> bool:
+    """The logs of a task show that the server refused its token: the
+    refresh failed in the client or a request ended with a 401"""
+    if not logs:
+        return False
+    return errors.AuthValidationFailed.__name__ in logs or "401 Unauthorized" in logs
+
+
+class CredsCache:
+    """
+    Private keys and agent tokens of the projects, shared by the jobs of
+    an agent. Each job runs in its own process, so credentials are kept by
+    project in a json file, in a private folder of a tmpfs (see
+    `handoff.private_dir`), and fetched under a file lock: when many jobs
+    of a project start at once only one of them asks the server.
+
+    A token is given to a task only when it lasts the timeout of the task
+    plus `refresh_margin` secs, otherwise a new one is fetched, so it
+    doesn't expire while the task runs. A token refused by the server is
+    dropped with `invalidate`.
+
+    :param key_ttl: secs while a private key is used without asking it
+    again, so a new key is taken in that time.
+    :param refresh_margin: secs which a token must last after the timeout
+    of the task.
+    """
+
+    def __init__(
+        self,
+        client: Union[NBClient, DiskClient],
+        *,
+        path: Optional[str] = None,
+        key_ttl: int = 60 * 60,
+        refresh_margin: int = 60 * 10,
+    ):
+        self.client = client
+        self.folder = private_dir("lf-creds", path)
+        self.key_ttl = key_ttl
+        self.refresh_margin = refresh_margin
+
+    @contextmanager
+    def _project(self, projectid: str):
+        """Cached creds of a project, saved when the block ends"""
+        with open(self.folder / f"{projectid}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                fp = self.folder / f"{projectid}.json"
+                try:
+                    data: Dict[str, Any] = json.loads(fp.read_text())
+                except (OSError, ValueError):
+                    data = {}
+                before = dict(data)
+                yield data
+                if data != before:
+                    tmp = fp.with_suffix(".tmp")
+                    tmp.write_text(json.dumps(data))
+                    tmp.chmod(0o600)
+                    tmp.replace(fp)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _fresh(self, data: Dict[str, Any], now: float, timeout: float) -> bool:
+        if not data.get("token"):
+            return False
+        return data["exp"] - now >= timeout + self.refresh_margin
+
+    def private_key(self, projectid: str) -> str:
+        with self._project(projectid) as data:
+            now = time.time()
+            if not data.get("private_key") or now - data["key_ts"] > self.key_ttl:
+                data["private_key"] = self.client.projects_private_key(projectid)
+                data["key_ts"] = now
+            return data["private_key"]
+
+    def agent_token(
+        self, projectid: str, timeout: float = 0
+    ) -> Optional[AgentJWTResponse]:
+        """
+        :param timeout: secs which the task can run with the token
+        """
+        with self._project(projectid) as data:
+            now = time.time()
+            if not self._fresh(data, now, timeout):
+                rsp = self.client.projects_agent_token(projectid=projectid)
+                if not rsp:
+                    return None
+                data["token"] = rsp.dict()
+                data["exp"] = token_exp(rsp.creds.access_token)
+            return AgentJWTResponse(**data["token"])
+
+    def invalidate(self, projectid: str):
+        with self._project(projectid) as data:
+            data.clear()
+
+
+def create_creds_cache(
+    client: Union[NBClient, DiskClient], settings: ServerSettings
+) -> Optional[CredsCache]:
+    if not settings.AGENT_CREDS_CACHE:
+        return None
+    return CredsCache(
+        client,
+        key_ttl=settings.AGENT_CREDS_KEY_TTL,
+        refresh_margin=settings.AGENT_CREDS_REFRESH_MARGIN,
+    )
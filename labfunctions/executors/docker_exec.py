@@ -2,33 +2,79 @@ import json
 import logging
 import os
 from datetime import datetime, timedelta
+from typing import List, Optional
 
 from labfunctions import client, defaults, log, secrets
 
 # from labfunctions.executors import context
 # from labfunctions.conf.server_settings import settings
-from labfunctions.types import ExecutionNBTask, ExecutionResult
+from labfunctions.types import ExecutionNBTask, ExecutionResult, ServerSettings
 
+from .creds import create_creds_cache
 from .nbtask_base import NBTaskDocker
+from .pool import ContainerPool
+from .pull_cache import PullCache
 
 
-def docker_exec(ctx: ExecutionNBTask) -> ExecutionResult:
+def docker_exec(
+    ctx: ExecutionNBTask,
+    pool: Optional[ContainerPool] = None,
+    pulls: Optional[PullCache] = None,
+    ctx_dir: Optional[str] = None,
+    settings: Optional[ServerSettings] = None,
+) -> ExecutionResult:
     """
     It will get a wfid from the control plane.
     This function runs in RQ Worker from a data plane machine.
 
-    Passing task exec information though serialized as an environment
-    variable could be a questionable design decision, checks:
+    The task exec information isn't passed as an environment variable,
+    which is limited by ARG_MAX, checks:
         - https://www.in-ulm.de/~mascheck/various/argmax/
         - and https://stackoverflow.com/questions/1078031/what-is-the-maximum-size-of-a-linux-environment-variable-value
         - and getconf -a | grep ARG_MAX # (value in kib)
+    It is written to a file mounted in the container, see `executors.handoff`.
+
+    :param settings: if given, credentials are cached between tasks
+    following the `AGENT_CREDS_*` settings, see `executors.creds`, and
+    the container is sampled each `DOCKER_STATS_INTERVAL` secs.
     """
 
     nbclient = client.from_env()
     print("NB Addr: ", nbclient._addr)
-    runner = NBTaskDocker(nbclient)
+    creds = create_creds_cache(nbclient, settings) if settings else None
+    runner = NBTaskDocker(
+        nbclient,
+        pool=pool,
+        pulls=pulls,
+        ctx_dir=ctx_dir,
+        creds=creds,
+        stats_interval=settings.DOCKER_STATS_INTERVAL if settings else 0,
+    )
     log.server_logger.debug(f"Ctx: {ctx}")
     result = runner.run(ctx)
     if result.error and not os.getenv("DEBUG"):
         runner.register(result)
+    elif result.resources:
+        runner.register_resources(result)
     return result
+
+
+def docker_exec_batch(
+    ctxs: List[ExecutionNBTask],
+    pulls: Optional[PullCache] = None,
+    ctx_dir: Optional[str] = None,
+    settings: Optional[ServerSettings] = None,
+) -> List[ExecutionResult]:
+    """
+    Like `docker_exec` for tasks of the same project and runtime, which
+    run in one container, see `executors.batch`.
+    """
+    nbclient = client.from_env()
+    creds = create_creds_cache(nbclient, settings) if settings else None
+    runner = NBTaskDocker(nbclient, pulls=pulls, ctx_dir=ctx_dir, creds=creds)
+    log.server_logger.debug(f"Batch: {[ctx.execid for ctx in ctxs]}")
+    results = runner.run_batch(ctxs)
+    for result in results:
+        if result.error and not os.getenv("DEBUG"):
+            runner.register(result)
+    return results
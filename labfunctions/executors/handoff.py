@@ -0,0 +1,101 @@
+"""
+Handoff of the context of a task to its container by a file.
+
+The env of a task (the execution context, the private key of the project
+and the tokens of the agent) is written by the agent to a json file in a
+tmpfs, which is mounted read only in the container. Only the path of the
+file is passed in the env, so the size of the context, mostly its params,
+isn't limited by the size allowed for env vars.
+
+The context is always read from the file (see `task_context`), it is
+never put back in the env, which is inherited by the kernel of the
+notebook and by any other child of the task.
+
+The folder of the files is only readable by the agent user, and files
+are removed when the container ends.
+"""
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from labfunctions import defaults
+from labfunctions.hashes import generate_random
+
+TMPFS_DIRS = ["/dev/shm"]
+
+
+def private_dir(name: str, base: Optional[str] = None) -> Path:
+    """A folder only readable by the agent user, in `base` or in a tmpfs
+    if there is one, so secrets never hit the disk"""
+    if not base:
+        tmpfs = [d for d in TMPFS_DIRS if os.access(d, os.W_OK)]
+        base = tmpfs[0] if tmpfs else tempfile.gettempdir()
+    folder = Path(base) / name
+    folder.mkdir(mode=0o700, parents=True, exist_ok=True)
+    return folder
+
+
+def handoff_dir(base: Optional[str] = None) -> Path:
+    return private_dir("lf-ctx", base)
+
+
+def write_handoff(env: Dict[str, Any], base: Optional[str] = None) -> str:
+    """It returns the path of the file written"""
+    path = handoff_dir(base) / f"{generate_random(16)}.json"
+    # the user of the container can be other than the agent user
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    with os.fdopen(fd, "w") as f:
+        json.dump(env, f)
+    return str(path)
+
+
+def load_handoff(path: Optional[str] = None) -> bool:
+    """
+    Inside the container, it loads the env written by `write_handoff`,
+    except the context of the task. Vars already defined aren't replaced.
+
+    :param path: by default, taken from `defaults.CTX_FILE_VAR`
+    """
+    path = path or os.getenv(defaults.CTX_FILE_VAR)
+    if not path:
+        return False
+    with open(path) as f:
+        env: Dict[str, str] = json.load(f)
+    for k, v in env.items():
+        if k != defaults.EXECUTIONTASK_VAR:
+            os.environ.setdefault(k, v)
+    return True
+
+
+def task_context(path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    The context of the task from the handoff file, or from
+    `defaults.EXECUTIONTASK_VAR` for tasks started without a file.
+
+    :param path: by default, taken from `defaults.CTX_FILE_VAR`
+    """
+    path = path or os.getenv(defaults.CTX_FILE_VAR)
+    ctx_str = None
+    if path:
+        with open(path) as f:
+            ctx_str = json.load(f).get(defaults.EXECUTIONTASK_VAR)
+    ctx_str = ctx_str or os.getenv(defaults.EXECUTIONTASK_VAR)
+    if not ctx_str:
+        return None
+    return json.loads(ctx_str)
+
+
+def child_handoff(env: Dict[str, Any], base: Optional[str] = None) -> Dict[str, Any]:
+    """
+    The env of a child which runs a task: the context is moved from `env`
+    to a handoff file, given to the child by `defaults.CTX_FILE_VAR`.
+    The file is removed with `base`, or by the caller.
+    """
+    env = dict(env)
+    ctx_str = env.pop(defaults.EXECUTIONTASK_VAR, None)
+    if ctx_str:
+        data = {defaults.EXECUTIONTASK_VAR: ctx_str}
+        env[defaults.CTX_FILE_VAR] = write_handoff(data, base)
+    return env
@@ -0,0 +1,270 @@
+"""
+Warm Jupyter kernels for the notebooks run by a warm container
+(see `executors.warm`).
+
+The `KernelPool` lives in the warm server process. It starts a kernel,
+imports the modules to preload in it, and gives its connection to each
+task by the env var `defaults.WARM_KERNEL_VAR`. The task, a forked child,
+runs the notebook with the papermill engine `lf-warm`, which connects to
+that kernel instead of starting a new one.
+
+Before each run the namespace of the kernel is reset and its env and
+working dir are replaced by the ones of the task. The modules imported
+stay loaded, so imports in the notebook are almost free. A kernel is
+recycled after `max_runs` runs or when its memory grows over `max_mem_mb`.
+"""
+import json
+import os
+import signal
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from jupyter_client import KernelManager
+from papermill.clientwrap import PapermillNotebookClient
+from papermill.engines import NBClientEngine, papermill_engines
+from papermill.utils import remove_args
+
+from labfunctions import defaults, log
+
+ENGINE_NAME = "lf-warm"
+
+_PRELOAD_CODE = """
+import os as _lf_os, sys as _lf_sys, types as _lf_types
+_lf_mod = _lf_types.ModuleType("_lf_warm")
+_lf_mod.env = dict(_lf_os.environ)
+_lf_sys.modules["_lf_warm"] = _lf_mod
+{imports}
+del _lf_os, _lf_sys, _lf_types, _lf_mod
+"""
+
+_RESET_CODE = """
+get_ipython().run_line_magic("reset", "-f")
+import os as _lf_os, sys as _lf_sys
+_lf_os.environ.clear()
+_lf_os.environ.update(_lf_sys.modules["_lf_warm"].env)
+_lf_os.environ.update({env!r})
+_lf_os.chdir({cwd!r})
+del _lf_os, _lf_sys
+"""
+
+
+def process_memory(pid: int) -> Optional[int]:
+    """Resident memory of a process in bytes"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _execute(kc, code: str, timeout: int):
+    reply = kc.execute_interactive(
+        code, silent=True, store_history=False, timeout=timeout
+    )
+    if reply["content"]["status"] != "ok":
+        raise RuntimeError(f"Warm kernel: {reply['content'].get('evalue')}")
+
+
+@dataclass
+class WarmKernel:
+    km: KernelManager
+    kernel_name: str
+    runs: int = 0
+
+    @property
+    def pid(self) -> Optional[int]:
+        return getattr(self.km.provisioner, "pid", None)
+
+    def info(self) -> str:
+        """Value of `defaults.WARM_KERNEL_VAR` for the task"""
+        return json.dumps(
+            dict(
+                connection_file=self.km.connection_file,
+                kernel_name=self.kernel_name,
+                pid=self.pid,
+            )
+        )
+
+
+class KernelPool:
+    """
+    Kernels kept by the warm server, one by kernel name because the
+    server runs a task at a time.
+
+    :param preload: modules imported when a kernel starts
+    :param max_runs: runs before the kernel is recycled
+    :param max_mem_mb: memory of the kernel after a run to recycle it
+    :param start_timeout: secs to wait for a kernel and its imports
+    """
+
+    def __init__(
+        self,
+        *,
+        preload: Optional[List[str]] = None,
+        max_runs: int = 20,
+        max_mem_mb: int = 1024,
+        start_timeout: int = 120,
+    ):
+        self.preload = preload or []
+        self.max_runs = max_runs
+        self.max_mem_mb = max_mem_mb
+        self.start_timeout = start_timeout
+        self.kernels: Dict[str, WarmKernel] = {}
+
+    def start(self, kernel_name: str) -> WarmKernel:
+        km = KernelManager(kernel_name=kernel_name)
+        km.start_kernel()
+        kc = km.client()
+        kc.start_channels()
+        try:
+            kc.wait_for_ready(timeout=self.start_timeout)
+            imports = "\n".join(f"import {m}" for m in self.preload)
+            _execute(kc, _PRELOAD_CODE.format(imports=imports), self.start_timeout)
+        except Exception:
+            km.shutdown_kernel(now=True)
+            raise
+        finally:
+            kc.stop_channels()
+        return WarmKernel(km=km, kernel_name=kernel_name)
+
+    def acquire(self, kernel_name: str = "python3") -> WarmKernel:
+        wk = self.kernels.get(kernel_name)
+        if wk and not wk.km.is_alive():
+            self.remove(wk)
+            wk = None
+        if not wk:
+            wk = self.start(kernel_name)
+            self.kernels[kernel_name] = wk
+        return wk
+
+    def should_recycle(self, wk: WarmKernel) -> bool:
+        if wk.runs >= self.max_runs or not wk.km.is_alive():
+            return True
+        memory = process_memory(wk.pid) if wk.pid else None
+        return bool(memory and memory / 2**20 > self.max_mem_mb)
+
+    def release(self, wk: WarmKernel):
+        wk.runs += 1
+        if self.should_recycle(wk):
+            log.server_logger.info(
+                f"Kernels: recycling {wk.kernel_name} after {wk.runs} runs"
+            )
+            self.remove(wk)
+
+    def remove(self, wk: WarmKernel):
+        if self.kernels.get(wk.kernel_name) is wk:
+            del self.kernels[wk.kernel_name]
+        try:
+            wk.km.shutdown_kernel(now=True)
+        except RuntimeError as e:
+            log.error_logger.error(f"Kernels: error stopping kernel {e}")
+
+    def shutdown(self):
+        for wk in list(self.kernels.values()):
+            self.remove(wk)
+
+
+class ConnectedKernelManager(KernelManager):
+    """
+    Manager of a kernel started by another process. nbclient doesn't
+    stop kernels whose manager is given to it, so the kernel keeps running
+    after the notebook.
+    """
+
+    def __init__(self, connection_file: str, pid: Optional[int] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.load_connection_file(connection_file)
+        self.kernel_pid = pid
+
+    @property
+    def has_kernel(self) -> bool:
+        return True
+
+    def is_alive(self) -> bool:
+        if not self.kernel_pid:
+            return True
+        try:
+            os.kill(self.kernel_pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def interrupt_kernel(self):
+        if self.kernel_pid:
+            os.kill(self.kernel_pid, signal.SIGINT)
+
+
+def warm_kernel_info() -> Optional[Dict[str, Any]]:
+    data = os.getenv(defaults.WARM_KERNEL_VAR)
+    return json.loads(data) if data else None
+
+
+class WarmKernelEngine(NBClientEngine):
+    """
+    Papermill engine which runs the notebook in the warm kernel of the
+    task. Without a warm kernel, or when the notebook asks for another
+    kernel, it works as the default engine.
+    """
+
+    @classmethod
+    def execute_managed_notebook(
+        cls,
+        nb_man,
+        kernel_name,
+        log_output=False,
+        stdout_file=None,
+        stderr_file=None,
+        start_timeout=60,
+        execution_timeout=None,
+        **kwargs,
+    ):
+        info = warm_kernel_info()
+        if not info or info["kernel_name"] != kernel_name:
+            return super().execute_managed_notebook(
+                nb_man,
+                kernel_name,
+                log_output=log_output,
+                stdout_file=stdout_file,
+                stderr_file=stderr_file,
+                start_timeout=start_timeout,
+                execution_timeout=execution_timeout,
+                **kwargs,
+            )
+
+        km = ConnectedKernelManager(
+            info["connection_file"], info.get("pid"), kernel_name=kernel_name
+        )
+        env = {k: v for k, v in os.environ.items() if k != defaults.WARM_KERNEL_VAR}
+        cwd = os.getcwd()
+        kc = km.client()
+        kc.start_channels()
+        try:
+            kc.wait_for_ready(timeout=start_timeout)
+            _execute(kc, _RESET_CODE.format(env=env, cwd=cwd), start_timeout)
+        finally:
+            kc.stop_channels()
+
+        client = PapermillNotebookClient(
+            nb_man,
+            km=km,
+            timeout=execution_timeout,
+            startup_timeout=start_timeout,
+            kernel_name=kernel_name,
+            log=log.server_logger,
+            log_output=log_output,
+            stdout_file=stdout_file,
+            stderr_file=stderr_file,
+            # hooks of nbclient
+            **remove_args(["input_path", "timeout", "startup_timeout"], **kwargs),
+        )
+        try:
+            return client.execute()
+        finally:
+            if client.kc is not None:
+                client.kc.stop_channels()
+
+
+papermill_engines.register(ENGINE_NAME, WarmKernelEngine)
@@ -4,29 +4,33 @@ import os
 import shutil
 import time
 from pathlib import Path
-from typing import Union
+from typing import Optional, Union
 
-from labfunctions import client, defaults
+from labfunctions import client, defaults, timeline
 from labfunctions.conf import load_client
 from labfunctions.types import ExecutionNBTask, ExecutionResult, NBTask
 
+from .handoff import task_context
 from .nbtask_base import NBTaskLocal
 
 # from labfunctions.notebooks import nb_job_executor
 
 
-def local_exec_env() -> ExecutionResult:
+def local_exec_env(etask: Optional[ExecutionNBTask] = None) -> ExecutionResult:
     """
     Control the notebook execution.
     TODO: implement notifications
     TODO: base executor class?
+
+    :param etask: by default, the context is read from the handoff file
+    of the task, see `executors.handoff.task_context`
     """
     # Init
     nbclient = client.from_env()
     runner = NBTaskLocal(nbclient)
-    ctx_str = os.getenv(defaults.EXECUTIONTASK_VAR)
-
-    etask = ExecutionNBTask(**json.loads(ctx_str))
+    if not etask:
+        etask = ExecutionNBTask(**task_context())
+    timeline.mark(etask.timeline, "started")
     result = runner.run(etask)
 
     if not os.getenv("LF_LOCAL"):
@@ -9,19 +9,51 @@ from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Union
 
-from labfunctions import defaults
+from labfunctions import defaults, timeline
 from labfunctions.client.diskclient import DiskClient
 from labfunctions.client.nbclient import NBClient
 from labfunctions.commands import DockerCommand, DockerRunResult
-from labfunctions.types import ExecutionNBTask, ExecutionResult, NBTask
+from labfunctions.notebooks.utils import read_notebook
+from labfunctions.types import ExecutionNBTask, ExecutionResult, NBTask, ResourceUsage
+from labfunctions.types.docker import DockerResources, DockerVolume
 from labfunctions.types.runtimes import RuntimeData
 from labfunctions.utils import get_version, today_string
 
+from .batch import batch_handoff, parse_batch_logs
+from .creds import CredsCache, auth_failed
 from .execid import ExecID
+from .handoff import write_handoff
+from .pool import ContainerPool
+from .profile import CellMemory, cell_marks, notebook_profile
+from .pull_cache import PullCache
+from .stats import StatsSampler
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
 
+def task_resources(ctx: ExecutionNBTask) -> DockerResources:
+    """Docker limits from the requests of the task"""
+    resources = DockerResources()
+    if ctx.memory_mb:
+        resources.mem_limit = ctx.memory_mb * 2**20
+    if ctx.cpus:
+        resources.nano_cpus = int(ctx.cpus * 1e9)
+    return resources
+
+
+def batch_resources(ctxs: List[ExecutionNBTask]) -> DockerResources:
+    """Tasks of a batch run one after the other, the container is limited
+    to the largest requests"""
+    memory_mb = max((ctx.memory_mb or 0 for ctx in ctxs), default=0)
+    cpus = max((ctx.cpus or 0 for ctx in ctxs), default=0)
+    resources = DockerResources()
+    if memory_mb:
+        resources.mem_limit = memory_mb * 2**20
+    if cpus:
+        resources.nano_cpus = int(cpus * 1e9)
+    return resources
+
+
 def _prepare_runtime(runtime: Optional[RuntimeData] = None) -> str:
     if not runtime:
         version = get_version()
@@ -63,22 +95,84 @@ class NBTaskExecBase:
         raise NotImplementedError()
 
     def register(self, result: ExecutionResult):
-        self.client.history_register(result)
+        """The output goes first, downstreams started by the registration
+        of the result can read it"""
         if result.output_name:
             try:
                 self.client.history_nb_output(result)
             except FileNotFoundError:
                 print(f"WARNING: file not found for {result.execid}")
+        if result.timeline is not None:
+            timeline.mark(result.timeline, "uploaded")
+        self.client.history_register(result)
 
     def notificate(self, ctx: ExecutionNBTask, result: ExecutionResult):
         raise NotImplementedError()
 
 
 class NBTaskDocker(NBTaskExecBase):
+    """
+    :param pool: warm containers used when one is free, otherwise a new
+    container is created for the task. Tasks which request cpus or memory
+    always get a new container, limited to their requests.
+    :param pulls: the runtime is pulled only when its digest changed,
+    otherwise it is pulled on each task.
+    :param ctx_dir: where the env of the task is written for the container,
+    a tmpfs by default (see `executors.handoff`).
+    :param creds: private keys and tokens are taken from the cache,
+    otherwise they are asked to the server on each task.
+    :param stats_interval: secs between the `stats` events published
+    while the container runs, 0 disables the sampling (see
+    `executors.stats`).
+    """
+
     cmd = "lab exec local"
+    batch_cmd = "lab exec batch"
+
+    def __init__(
+        self,
+        client: Union[NBClient, DiskClient],
+        pool: Optional[ContainerPool] = None,
+        pulls: Optional[PullCache] = None,
+        ctx_dir: Optional[str] = None,
+        creds: Optional[CredsCache] = None,
+        stats_interval: float = 0,
+    ):
+        super().__init__(client)
+        self.pool = pool
+        self.pulls = pulls
+        self.ctx_dir = ctx_dir
+        self.creds = creds
+        self.stats_interval = stats_interval
+
+    def _private_key(self, projectid: str) -> Optional[str]:
+        if self.creds:
+            return self.creds.private_key(projectid)
+        return self.client.projects_private_key(projectid)
+
+    def _agent_token(self, projectid: str, timeout: float):
+        if self.creds:
+            return self.creds.agent_token(projectid, timeout=timeout)
+        return self.client.projects_agent_token(projectid=projectid)
+
+    def _check_auth(self, projectid: str, result: DockerRunResult):
+        """A cached token refused by the server isn't given to other tasks"""
+        if self.creds and result.status != 0 and auth_failed(result.msg):
+            self.creds.invalidate(projectid)
+
+    def _sampler(self, ctx: ExecutionNBTask) -> Optional[StatsSampler]:
+        if self.stats_interval <= 0:
+            return None
+
+        def publish(data):
+            self.client.events_publish(
+                ctx.execid, data, event="stats", projectid=ctx.projectid
+            )
+
+        return StatsSampler(self.stats_interval, publish=publish)
 
     def build_env(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        priv_key = self.client.projects_private_key(data["projectid"])
+        priv_key = self._private_key(data["projectid"])
         if not priv_key:
             raise IndexError(f"No priv key found for {data['projectid']}")
 
@@ -93,28 +187,142 @@ class NBTaskDocker(NBTaskExecBase):
     def run(self, ctx: ExecutionNBTask) -> ExecutionResult:
         _started = time.time()
         env = self.build_env(ctx.dict())
-        agent_token = self.client.projects_agent_token(projectid=ctx.projectid)
+        agent_token = self._agent_token(ctx.projectid, ctx.timeout)
         env.update(
             {
                 "LF_AGENT_TOKEN": agent_token.creds.access_token,
                 "LF_AGENT_REFRESH_TOKEN": agent_token.creds.refresh_token,
             }
         )
-        cmd = DockerCommand()
-        repo, tag = ctx.runtime.rsplit(":", maxsplit=1)
-        cmd.pull_image(repo, tag=tag)
-        result = cmd.run(
-            self.cmd,
-            ctx.runtime,
-            timeout=ctx.timeout,
-            env_data=env,
-            require_gpu=ctx.gpu_support,
+        timeline.mark(ctx.timeline, "creds")
+        cmd = None
+        if self.pulls:
+            self.pulls.ensure(ctx.runtime)
+        sampler = self._sampler(ctx)
+        resources = task_resources(ctx)
+        pooled = None
+        # warm containers run without the limits of the task
+        if self.pool and not (resources.mem_limit or resources.nano_cpus):
+            pooled = self.pool.acquire(ctx.runtime, ctx.gpu_support)
+        if not pooled:
+            cmd = DockerCommand()
+            if not self.pulls:
+                repo, tag = ctx.runtime.rsplit(":", maxsplit=1)
+                cmd.pull_image(repo, tag=tag)
+        timeline.mark(ctx.timeline, "pulled")
+        # the context with the marks of the agent
+        env[defaults.EXECUTIONTASK_VAR] = json.dumps(ctx.dict())
+        if pooled:
+            if sampler:
+                sampler.start(pooled.container)
+            try:
+                result = self.pool.run(pooled, env, timeout=ctx.timeout)
+            finally:
+                if sampler:
+                    sampler.stop()
+                self.pool.release(pooled)
+        else:
+            ctx_file = write_handoff(env, self.ctx_dir)
+            try:
+                result = cmd.run(
+                    self.cmd,
+                    ctx.runtime,
+                    timeout=ctx.timeout,
+                    env_data={defaults.CTX_FILE_VAR: defaults.CTX_FILE_MOUNT},
+                    volumes=[
+                        DockerVolume(
+                            orig_mount=ctx_file,
+                            dst_mount=defaults.CTX_FILE_MOUNT,
+                            extra={"mode": "ro"},
+                        )
+                    ],
+                    require_gpu=ctx.gpu_support,
+                    name=ctx.execid,
+                    resources=resources,
+                    sampler=sampler,
+                )
+            finally:
+                os.remove(ctx_file)
+        self._check_auth(ctx.projectid, result)
+        return self._result(
+            ctx,
+            result.status,
+            result.msg,
+            round(time.time() - _started),
+            resources=sampler.usage() if sampler else None,
+        )
+
+    def run_batch(self, ctxs: List[ExecutionNBTask]) -> List[ExecutionResult]:
+        """
+        Tasks of the same project and runtime run one after the other in
+        one container (see `executors.batch`). The container can run for
+        the sum of the timeouts of the tasks, a task not reached when it
+        ends is failed.
+        """
+        first = ctxs[0]
+        env = self.build_env(first.dict())
+        del env[defaults.EXECUTIONTASK_VAR]
+        timeout = sum(ctx.timeout for ctx in ctxs)
+        agent_token = self._agent_token(first.projectid, timeout)
+        env.update(
+            {
+                "LF_AGENT_TOKEN": agent_token.creds.access_token,
+                "LF_AGENT_REFRESH_TOKEN": agent_token.creds.refresh_token,
+            }
         )
-        error = False
-        if result.status != 0:
-            error = True
+        for ctx in ctxs:
+            timeline.mark(ctx.timeline, "creds")
+        cmd = DockerCommand()
+        if self.pulls:
+            self.pulls.ensure(first.runtime)
+        else:
+            repo, tag = first.runtime.rsplit(":", maxsplit=1)
+            cmd.pull_image(repo, tag=tag)
+        for ctx in ctxs:
+            timeline.mark(ctx.timeline, "pulled")
+        data = batch_handoff(env, [ctx.dict() for ctx in ctxs])
+        ctx_file = write_handoff(data, self.ctx_dir)
+        try:
+            result = cmd.run(
+                self.batch_cmd,
+                first.runtime,
+                timeout=timeout,
+                env_data={defaults.CTX_FILE_VAR: defaults.CTX_FILE_MOUNT},
+                volumes=[
+                    DockerVolume(
+                        orig_mount=ctx_file,
+                        dst_mount=defaults.CTX_FILE_MOUNT,
+                        extra={"mode": "ro"},
+                    )
+                ],
+                require_gpu=first.gpu_support,
+                name=f"batch-{first.execid}",
+                resources=batch_resources(ctxs),
+            )
+        finally:
+            os.remove(ctx_file)
+        self._check_auth(first.projectid, result)
+        done = parse_batch_logs(result.msg)
+        results = []
+        for ctx in ctxs:
+            item = done.get(ctx.execid)
+            if item:
+                results.append(
+                    self._result(ctx, item["status"], item["logs"], item["elapsed"])
+                )
+            else:
+                msg = f"Batch ended before the task, status {result.status}"
+                results.append(self._result(ctx, -1, msg, 0))
+        return results
 
-        elapsed = round(time.time() - _started)
+    def _result(
+        self,
+        ctx: ExecutionNBTask,
+        status: int,
+        msg: str,
+        elapsed: float,
+        resources: Optional[ResourceUsage] = None,
+    ) -> ExecutionResult:
         return ExecutionResult(
             projectid=ctx.projectid,
             name=ctx.nb_name,
@@ -129,17 +337,29 @@ class NBTaskDocker(NBTaskExecBase):
             output_dir=ctx.output_dir,
             output_name=ctx.output_name,
             error_dir=ctx.error_dir,
-            error=error,
-            error_msg=result.msg,
+            error=status != 0,
+            error_msg=msg,
             created_at=ctx.created_at,
+            dagid=ctx.dagid,
+            memo_key=ctx.memo_key,
+            resources=resources,
+            timeline=ctx.timeline,
         )
 
+    def register_resources(self, result: ExecutionResult) -> bool:
+        """The container registers the executions that finish ok, the
+        usage is added to its history row."""
+        return self.client.history_resources(result)
+
     def notificate(self, ctx: ExecutionNBTask, result: ExecutionResult):
         pass
 
 
 class NBTaskLocal(NBTaskExecBase):
     def run(self, ctx: ExecutionNBTask) -> ExecutionResult:
+        if ctx.mode == "script":
+            return self.run_script(ctx)
+
         import papermill as pm
 
         _started = time.time()
@@ -148,12 +368,31 @@ class NBTaskLocal(NBTaskExecBase):
         Path(ctx.output_dir).mkdir(parents=True, exist_ok=True)
         print(f"Current dir: {Path.cwd()}")
         print(f"Input: {ctx.pm_input}")
+        engine = {}
+        memory = CellMemory()
+        if os.getenv(defaults.WARM_KERNEL_VAR):
+            from labfunctions.executors.kernels import ENGINE_NAME
+
+            engine["engine_name"] = ENGINE_NAME
+        else:
+            engine["kernel_manager_class"] = memory.manager_class()
+            if os.getenv(defaults.CELL_CACHE_VAR):
+                from labfunctions.executors.cell_cache import ENGINE_NAME
+
+                engine["engine_name"] = ENGINE_NAME
         try:
-            pm.execute_notebook(ctx.pm_input, ctx.pm_output, parameters=ctx.params)
+            nb = pm.execute_notebook(
+                ctx.pm_input,
+                ctx.pm_output,
+                parameters=ctx.params,
+                on_cell_executed=memory,
+                **engine,
+            )
         except pm.exceptions.PapermillExecutionError as e:
             self.logger.error(f"jobdid:{ctx.wfid} execid:{ctx.execid} failed {e}")
             _error = True
             _error_msg = str(e)
+            nb = read_notebook(ctx.pm_output)
             self._error_handler(ctx)
 
         elapsed = time.time() - _started
@@ -174,6 +413,40 @@ class NBTaskLocal(NBTaskExecBase):
             error_msg=_error_msg,
             elapsed_secs=round(elapsed, 2),
             created_at=ctx.created_at,
+            dagid=ctx.dagid,
+            memo_key=ctx.memo_key,
+            cells=notebook_profile(nb, memory.peaks),
+            timeline={**ctx.timeline, **cell_marks(nb)},
+        )
+
+    def run_script(self, ctx: ExecutionNBTask) -> ExecutionResult:
+        """Runs the notebook as a module, there isn't an output notebook
+        to upload (see `executors.script`)"""
+        from labfunctions.executors.script import ScriptCache, run_script
+
+        print(f"Input: {ctx.pm_input} (script)")
+        code = ScriptCache().load(ctx.pm_input)
+        res = run_script(code, ctx.params)
+        if res.error:
+            self.logger.error(f"jobdid:{ctx.wfid} execid:{ctx.execid} failed")
+        return ExecutionResult(
+            projectid=ctx.projectid,
+            name=ctx.nb_name,
+            wfid=ctx.wfid,
+            execid=ctx.execid,
+            cluster=ctx.cluster,
+            machine=ctx.machine,
+            runtime=ctx.runtime,
+            params=ctx.params,
+            input_=ctx.pm_input,
+            error=res.error,
+            error_msg=res.error_msg,
+            stdout=res.stdout,
+            elapsed_secs=round(res.elapsed, 2),
+            created_at=ctx.created_at,
+            dagid=ctx.dagid,
+            memo_key=ctx.memo_key,
+            timeline=ctx.timeline,
         )
 
     def notificate(self, ctx: ExecutionNBTask, result: ExecutionResult):
@@ -0,0 +1,280 @@
+import fcntl
+import hashlib
+import json
+import socket
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Any, Dict, List, Optional
+
+import docker
+from labfunctions import defaults, log
+from labfunctions.hashes import generate_random
+from labfunctions.types import ServerSettings
+from labfunctions.types.docker import DockerRunResult
+
+POOL_LABEL = "lf.pool"
+POOL_TOKEN_LABEL = "lf.pool.token"
+
+
+@dataclass
+class PooledContainer:
+    container: Any
+    addr: str
+    token: str
+    lock: IO
+    tasks: int = 0
+    memory: Optional[int] = None
+    broken: bool = False
+
+
+class ContainerPool:
+    """
+    Warm containers kept by the agent by runtime image. Each container runs
+    `lab exec warm` and tasks are sent to it by tcp, so the pull, the
+    creation of the container and the startup of Python are skipped.
+
+    The pool is shared by the processes of the agent: containers are found
+    by their docker labels and a container is used by one task at a time,
+    with a file lock held while the task runs. If the process dies, the
+    lock is released by the OS.
+
+    Containers are recycled after `max_tasks` tasks, when their memory
+    usage grows over `max_mem_mb` or when a task times out.
+
+    :param size: max containers by image
+    :param lock_dir: folder for the locks, shared by the agent processes
+    :param start_timeout: secs to wait for a new container to be ready
+    :param kernels: notebooks run in a Jupyter kernel kept by the container
+    :param kernel_preload: modules imported in the kernel when it starts
+    """
+
+    def __init__(
+        self,
+        docker_client=None,
+        *,
+        size: int = 2,
+        max_tasks: int = 50,
+        max_mem_mb: int = 2048,
+        port: int = defaults.WARM_PORT,
+        lock_dir: Optional[str] = None,
+        start_timeout: int = 60,
+        kernels: bool = False,
+        kernel_preload: Optional[List[str]] = None,
+        kernel_max_runs: int = 20,
+        kernel_max_mem_mb: int = 1024,
+    ):
+        self.docker = docker_client or docker.from_env()
+        self.size = size
+        self.max_tasks = max_tasks
+        self.max_mem_mb = max_mem_mb
+        self.port = port
+        self.lock_dir = Path(lock_dir or f"{tempfile.gettempdir()}/lf-pool")
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self.start_timeout = start_timeout
+        self.kernels = kernels
+        self.kernel_preload = kernel_preload or []
+        self.kernel_max_runs = kernel_max_runs
+        self.kernel_max_mem_mb = kernel_max_mem_mb
+
+    @staticmethod
+    def pool_key(image: str, require_gpu: bool = False) -> str:
+        return hashlib.md5(f"{image}|{require_gpu}".encode()).hexdigest()[:16]
+
+    def containers(self, image: str, require_gpu: bool = False) -> List[Any]:
+        key = self.pool_key(image, require_gpu)
+        return self.docker.containers.list(
+            filters={"label": f"{POOL_LABEL}={key}", "status": "running"}
+        )
+
+    def _flock(self, name: str, block=False) -> Optional[IO]:
+        f = open(self.lock_dir / f"{name}.lock", "a")
+        flags = fcntl.LOCK_EX if block else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+    def _unlock(self, lock: IO):
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    def warm_cmd(self) -> str:
+        cmd = f"lab exec warm --port {self.port}"
+        if self.kernels:
+            cmd += (
+                f" --kernels --kernel-max-runs {self.kernel_max_runs}"
+                f" --kernel-max-mem {self.kernel_max_mem_mb}"
+            )
+            if self.kernel_preload:
+                cmd += f" --preload {','.join(self.kernel_preload)}"
+        return cmd
+
+    def _image_id(self, image: str) -> Optional[str]:
+        try:
+            return self.docker.images.get(image).id
+        except docker.errors.ImageNotFound:
+            return None
+
+    def _remove(self, container, lock: IO):
+        try:
+            container.remove(force=True)
+        except docker.errors.APIError as e:
+            log.error_logger.error(f"Pool: error removing container {e}")
+        (self.lock_dir / f"{container.id}.lock").unlink(missing_ok=True)
+        self._unlock(lock)
+
+    def _addr(self, container) -> str:
+        container.reload()
+        return container.attrs["NetworkSettings"]["IPAddress"]
+
+    def _pooled(self, container, lock: IO) -> PooledContainer:
+        return PooledContainer(
+            container=container,
+            addr=self._addr(container),
+            token=container.labels[POOL_TOKEN_LABEL],
+            lock=lock,
+        )
+
+    def _wait_ready(self, addr: str) -> bool:
+        started = time.time()
+        while time.time() - started < self.start_timeout:
+            try:
+                with socket.create_connection((addr, self.port), timeout=1):
+                    return True
+            except OSError:
+                time.sleep(0.2)
+        return False
+
+    def start(self, image: str, require_gpu: bool = False):
+        """It starts a new container of the pool and waits until it is ready"""
+        try:
+            self.docker.images.get(image)
+        except docker.errors.ImageNotFound:
+            repo, tag = image.rsplit(":", maxsplit=1)
+            self.docker.images.pull(repo, tag=tag)
+        device_requests = []
+        if require_gpu:
+            device_requests = [
+                docker.types.DeviceRequest(count=-1, capabilities=[["gpu"]])
+            ]
+        token = generate_random(32)
+        container = self.docker.containers.run(
+            image,
+            self.warm_cmd(),
+            detach=True,
+            environment={defaults.WARM_TOKEN_VAR: token},
+            labels={
+                POOL_LABEL: self.pool_key(image, require_gpu),
+                POOL_TOKEN_LABEL: token,
+            },
+            device_requests=device_requests,
+            network_mode="bridge",
+        )
+        if not self._wait_ready(self._addr(container)):
+            container.remove(force=True)
+            raise TimeoutError(f"Warm container for {image} not ready")
+        return container
+
+    def acquire(
+        self, image: str, require_gpu: bool = False
+    ) -> Optional[PooledContainer]:
+        """
+        An idle container of the pool, a new one if the pool is not full,
+        or None when all the containers are busy.
+        """
+        current = self._image_id(image)
+        for container in self.containers(image, require_gpu):
+            lock = self._flock(container.id)
+            if not lock:
+                continue
+            running = container.attrs.get("Image")
+            if current and running and running != current:
+                # the runtime was pulled again with a new digest
+                self._remove(container, lock)
+                continue
+            return self._pooled(container, lock)
+
+        key = self.pool_key(image, require_gpu)
+        create_lock = self._flock(f"create-{key}", block=True)
+        try:
+            if len(self.containers(image, require_gpu)) >= self.size:
+                return None
+            try:
+                container = self.start(image, require_gpu)
+            except (docker.errors.APIError, TimeoutError) as e:
+                log.error_logger.error(f"Pool: error starting {image}: {e}")
+                return None
+            lock = self._flock(container.id)
+            return self._pooled(container, lock) if lock else None
+        finally:
+            self._unlock(create_lock)
+
+    def run(
+        self, pc: PooledContainer, env: Dict[str, str], *, timeout: int = 120
+    ) -> DockerRunResult:
+        req = json.dumps(dict(token=pc.token, env=env)).encode("utf-8") + b"\n"
+        try:
+            with socket.create_connection((pc.addr, self.port), timeout=5) as sock:
+                sock.settimeout(timeout)
+                sock.sendall(req)
+                with sock.makefile("rb") as f:
+                    rsp = json.loads(f.readline())
+        except socket.timeout:
+            pc.broken = True
+            return DockerRunResult(msg=f"Timeout after {timeout} secs", status=-1)
+        except (OSError, ValueError) as e:
+            pc.broken = True
+            return DockerRunResult(msg=str(e), status=-3)
+        pc.tasks = rsp["tasks"]
+        pc.memory = rsp.get("memory")
+        return DockerRunResult(msg=rsp["logs"], status=rsp["status"])
+
+    def should_recycle(self, pc: PooledContainer) -> bool:
+        """The memory is reported by the container after each task, it
+        avoids `docker stats` which takes a second."""
+        if pc.broken or pc.tasks >= self.max_tasks:
+            return True
+        return bool(pc.memory and pc.memory / 2**20 > self.max_mem_mb)
+
+    def release(self, pc: PooledContainer):
+        """It gives back the container to the pool or removes it"""
+        if self.should_recycle(pc):
+            log.server_logger.info(
+                f"Pool: recycling {pc.container.name} after {pc.tasks} tasks"
+            )
+            self._remove(pc.container, pc.lock)
+        else:
+            self._unlock(pc.lock)
+
+    def prewarm(self, image: str, require_gpu: bool = False, n: Optional[int] = None):
+        """It starts containers until the pool of the image has `n`"""
+        n = min(n or self.size, self.size)
+        missing = n - len(self.containers(image, require_gpu))
+        for _ in range(max(missing, 0)):
+            self.start(image, require_gpu)
+
+    def shutdown(self):
+        """It removes all the containers of the pool"""
+        for container in self.docker.containers.list(
+            all=True, filters={"label": POOL_LABEL}
+        ):
+            container.remove(force=True)
+
+
+def create_container_pool(settings: ServerSettings) -> Optional[ContainerPool]:
+    """None if the pool is disabled"""
+    if settings.DOCKER_POOL_SIZE < 1:
+        return None
+    return ContainerPool(
+        size=settings.DOCKER_POOL_SIZE,
+        max_tasks=settings.DOCKER_POOL_MAX_TASKS,
+        max_mem_mb=settings.DOCKER_POOL_MAX_MEM_MB,
+        kernels=settings.DOCKER_POOL_KERNELS,
+        kernel_preload=settings.DOCKER_POOL_KERNEL_PRELOAD,
+        kernel_max_runs=settings.DOCKER_POOL_KERNEL_MAX_RUNS,
+        kernel_max_mem_mb=settings.DOCKER_POOL_KERNEL_MAX_MEM_MB,
+    )
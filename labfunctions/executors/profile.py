@@ -0,0 +1,128 @@
+"""
+Timing of the cells of a notebook run by papermill. Durations come from
+the metadata papermill writes for each cell. The peak memory of each cell
+is taken by `CellMemory`, a hook of nbclient which reads the peak RSS of
+the kernel after each cell and resets it, where /proc allows it.
+"""
+import json
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from labfunctions import defaults
+from labfunctions.types import CellProfile
+
+SRC_LEN = 60
+
+
+def _status_kb(pid: int, field: str) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class CellMemory:
+    """
+    nbclient hook (`on_cell_executed`) which keeps the peak memory in MB
+    of the kernel by cell index. The kernel is the warm kernel of the
+    task, or the one started by the kernel manager of `manager_class`,
+    given to papermill as `kernel_manager_class`.
+    """
+
+    def __init__(self, pid: Optional[int] = None):
+        self.pid = pid
+        self.km = None
+        self.peaks: Dict[int, float] = {}
+
+    def manager_class(self):
+        """A kernel manager class which is kept by this hook when
+        nbclient creates it"""
+        from jupyter_client import AsyncKernelManager
+
+        memory = self
+
+        class MemoryKernelManager(AsyncKernelManager):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                memory.km = self
+
+        return MemoryKernelManager
+
+    def kernel_pid(self) -> Optional[int]:
+        if self.pid:
+            return self.pid
+        warm = os.getenv(defaults.WARM_KERNEL_VAR)
+        if warm:
+            self.pid = json.loads(warm).get("pid")
+        elif self.km:
+            self.pid = getattr(self.km.provisioner, "pid", None)
+        return self.pid
+
+    def __call__(self, cell=None, cell_index: int = 0, **kwargs):
+        pid = self.kernel_pid()
+        if not pid:
+            return
+        peak = _status_kb(pid, "VmHWM") or _status_kb(pid, "VmRSS")
+        if peak is None:
+            return
+        self.peaks[cell_index] = round(peak / 1024, 1)
+        try:
+            # 5 resets the peak RSS of the process
+            with open(f"/proc/{pid}/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+
+def notebook_profile(nb, peaks: Optional[Dict[int, float]] = None) -> List[CellProfile]:
+    """Profile of the code cells executed of a notebook"""
+    peaks = peaks or {}
+    cells = []
+    for ix, cell in enumerate(nb.cells):
+        if cell.cell_type != "code":
+            continue
+        duration = cell.get("metadata", {}).get("papermill", {}).get("duration")
+        if duration is None:
+            continue
+        lines = cell.source.strip().splitlines()
+        cells.append(
+            CellProfile(
+                ix=ix,
+                secs=round(duration, 3),
+                peak_mb=peaks.get(ix),
+                src=lines[0][:SRC_LEN] if lines else "",
+            )
+        )
+    return cells
+
+
+def _epoch(iso: Optional[str]) -> Optional[float]:
+    if not iso:
+        return None
+    dt = datetime.fromisoformat(iso.replace("Z", "+00:00"))
+    if not dt.tzinfo:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return round(dt.timestamp(), 3)
+
+
+def cell_marks(nb) -> Dict[str, float]:
+    """Marks of the timeline (see `labfunctions.timeline`) from the times
+    papermill writes: the kernel is ready when the first cell starts."""
+    times = [
+        cell.get("metadata", {}).get("papermill", {})
+        for cell in nb.cells
+        if cell.cell_type == "code"
+    ]
+    times = [t for t in times if t.get("start_time") and t.get("end_time")]
+    if not times:
+        return {}
+    return {
+        "kernel": _epoch(times[0]["start_time"]),
+        "first_cell": _epoch(times[0]["end_time"]),
+        "last_cell": _epoch(times[-1]["end_time"]),
+    }
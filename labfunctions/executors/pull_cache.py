@@ -0,0 +1,152 @@
+import fcntl
+import hashlib
+import json
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import docker
+from labfunctions import log
+from labfunctions.types import ServerSettings
+
+
+def split_image(image: str):
+    """repository and tag, a registry with port is kept in the repository"""
+    repo, _, tag = image.rpartition(":")
+    if not repo or "/" in tag:
+        return image, "latest"
+    return repo, tag
+
+
+class PullCache:
+    """
+    It avoids a registry round trip by task. The digest of each image is
+    kept in a json file shared by the processes of the agent, with the time
+    when it was checked against the registry.
+
+    An image is pulled when it is not in the host, or when its digest in the
+    registry changed. The registry is asked only when the check is older
+    than `ttl` or when the tag is mutable (like `latest`), which are
+    expected to change.
+
+    The check and the pull of an image run under a lock of that image,
+    so tasks of other images don't wait for them. The json file is only
+    locked while an entry is written.
+
+    :param path: json file with the digests
+    :param ttl: secs while a digest is trusted
+    :param mutable_tags: tags checked against the registry on each use
+    """
+
+    def __init__(
+        self,
+        docker_client=None,
+        *,
+        path: Optional[str] = None,
+        ttl: int = 60 * 60,
+        mutable_tags: Iterable[str] = ("latest", "current"),
+    ):
+        self.docker = docker_client or docker.from_env()
+        self.path = Path(path or f"{tempfile.gettempdir()}/lf-pulls.json")
+        self.ttl = ttl
+        self.mutable_tags = set(mutable_tags)
+
+    @contextmanager
+    def _locked(self, name: str):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{self.path}.{name}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _image_lock(self, image: str):
+        return self._locked(hashlib.md5(image.encode()).hexdigest()[:16])
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, image: str, entry: Dict[str, Any]):
+        with self._locked("entries"):
+            entries = self._read()
+            entries[image] = entry
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(entries))
+            tmp.replace(self.path)
+
+    def local_digest(self, image: str) -> Optional[str]:
+        try:
+            img = self.docker.images.get(image)
+        except docker.errors.ImageNotFound:
+            return None
+        repo, _ = split_image(image)
+        for repo_digest in img.attrs.get("RepoDigests") or []:
+            name, _, digest = repo_digest.partition("@")
+            if name == repo:
+                return digest
+        # built locally, never pushed
+        return img.id
+
+    def registry_digest(self, image: str) -> Optional[str]:
+        try:
+            return self.docker.images.get_registry_data(image).id
+        except docker.errors.APIError as e:
+            log.error_logger.warning(f"Pull cache: registry check of {image}: {e}")
+            return None
+
+    def pull(self, image: str) -> Optional[str]:
+        repo, tag = split_image(image)
+        self.docker.images.pull(repo, tag=tag)
+        return self.local_digest(image)
+
+    def ensure(self, image: str) -> bool:
+        """It makes sure that the image is present and updated, it returns
+        true if the image was pulled"""
+        with self._image_lock(image):
+            entry = self._read().get(image)
+            local = self.local_digest(image)
+            _, tag = split_image(image)
+            now = time.time()
+
+            pulled = False
+            if not local:
+                local = self.pull(image)
+                pulled = True
+            elif (
+                not entry
+                or entry.get("digest") != local
+                or tag in self.mutable_tags
+                or now - entry["checked"] > self.ttl
+            ):
+                remote = self.registry_digest(image)
+                if remote and remote != local:
+                    local = self.pull(image)
+                    pulled = True
+
+            self._save(image, {"digest": local, "checked": now})
+        return pulled
+
+    def prepull(self, images: Iterable[str]) -> List[str]:
+        """It returns the images pulled, errors are logged and skipped"""
+        pulled = []
+        for image in sorted(set(images)):
+            try:
+                if self.ensure(image):
+                    pulled.append(image)
+            except docker.errors.APIError as e:
+                log.error_logger.error(f"Pull cache: error pulling {image}: {e}")
+        return pulled
+
+
+def create_pull_cache(settings: ServerSettings, docker_client=None) -> PullCache:
+    return PullCache(
+        docker_client,
+        ttl=settings.DOCKER_PULL_TTL,
+        mutable_tags=settings.DOCKER_MUTABLE_TAGS,
+    )
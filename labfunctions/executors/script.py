@@ -0,0 +1,113 @@
+"""
+Script mode: a notebook runs as a python module in the process of the
+task, without kernel, papermill or output notebook. It is for production
+notebooks that don't need rich outputs, where starting a kernel and
+writing the notebook cost more than the run itself.
+
+The notebook is converted once by its content (see
+`notebooks.utils.notebook_to_script`) and kept as a .py file, the code
+compiled is also kept by process. Params are injected after the cell
+tagged as `parameters`, like papermill does.
+
+Only the last part of stdout and the traceback of an error are kept in
+the result. Magics and shell escapes need IPython, those notebooks should
+run in the default mode.
+"""
+import hashlib
+import sys
+import tempfile
+import time
+import traceback
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from pathlib import Path
+from types import CodeType
+from typing import Any, Dict, Optional
+
+from labfunctions import defaults
+from labfunctions.notebooks.utils import notebook_to_script, read_notebook
+
+PARAMS_VAR = "__lf_params__"
+PARAMS_HOOK = f"globals().update({PARAMS_VAR})"
+
+
+class _Tail:
+    """Stream which writes to `stream` and keeps the last `max_size` chars"""
+
+    def __init__(self, stream, max_size: int):
+        self.stream = stream
+        self.max_size = max_size
+        self.data = ""
+
+    def write(self, text: str) -> int:
+        self.stream.write(text)
+        self.data = (self.data + text)[-self.max_size :]
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+@dataclass
+class ScriptResult:
+    error: bool
+    stdout: str
+    elapsed: float
+    error_msg: Optional[str] = None
+
+
+class ScriptCache:
+    """
+    Notebooks converted to scripts by the hash of their content.
+
+    :param folder: where the scripts are kept, by default a folder of
+    the temp dir.
+    """
+
+    compiled: Dict[str, CodeType] = {}
+
+    def __init__(self, folder: Optional[str] = None):
+        self.folder = Path(folder or f"{tempfile.gettempdir()}/lf-scripts")
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    def load(self, nb_path: str) -> CodeType:
+        with open(nb_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        code = self.compiled.get(digest)
+        if code:
+            return code
+        fp = self.folder / f"{digest}.py"
+        if not fp.exists():
+            source = notebook_to_script(read_notebook(nb_path), PARAMS_HOOK)
+            tmp = fp.with_suffix(".tmp")
+            tmp.write_text(source)
+            tmp.replace(fp)
+        code = compile(fp.read_text(), str(fp), "exec")
+        self.compiled[digest] = code
+        return code
+
+
+def run_script(
+    code: CodeType,
+    params: Dict[str, Any],
+    max_stdout: int = defaults.SCRIPT_STDOUT_MAX,
+) -> ScriptResult:
+    """It runs the code as `__main__` in a new namespace"""
+    ns = {"__name__": "__main__", "__builtins__": __builtins__, PARAMS_VAR: params}
+    stdout = _Tail(sys.stdout, max_stdout)
+    error, error_msg = False, None
+    _started = time.time()
+    with redirect_stdout(stdout):
+        try:
+            exec(code, ns)  # pylint: disable=exec-used
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                error, error_msg = True, f"SystemExit: {e.code}"
+        except Exception:  # pylint: disable=broad-except
+            error, error_msg = True, traceback.format_exc()
+    return ScriptResult(
+        error=error,
+        stdout=stdout.data,
+        elapsed=time.time() - _started,
+        error_msg=error_msg,
+    )
@@ -0,0 +1,172 @@
+"""
+Usage of the container of a task, sampled from `docker stats` while it
+runs. Docker streams a sample each second: all of them are used for the
+peaks and averages kept in the result, and one each `interval` secs is
+published as a `stats` event of the execution (see `cmd.utils.watcher`).
+
+IO and network counters are cumulative by container, the usage of a task
+is the difference against the first sample, which matters for the warm
+containers of the pool.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from labfunctions import log
+from labfunctions.types import ResourceUsage
+
+MB = 2**20
+
+
+def cpu_percent(sample: Dict[str, Any]) -> Optional[float]:
+    """Same calc that `docker stats`, 100 is a full core. None for the
+    first sample, which doesn't have a previous one."""
+    cpu = sample.get("cpu_stats") or {}
+    pre = sample.get("precpu_stats") or {}
+    cpu_delta = cpu.get("cpu_usage", {}).get("total_usage", 0) - pre.get(
+        "cpu_usage", {}
+    ).get("total_usage", 0)
+    system_delta = cpu.get("system_cpu_usage", 0) - pre.get("system_cpu_usage", 0)
+    if not pre.get("system_cpu_usage") or system_delta <= 0:
+        return None
+    online = cpu.get("online_cpus") or len(
+        cpu.get("cpu_usage", {}).get("percpu_usage") or [1]
+    )
+    return max(cpu_delta, 0) / system_delta * online * 100
+
+
+def mem_usage(sample: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+    """Memory used without the page cache and the limit, in bytes"""
+    mem = sample.get("memory_stats") or {}
+    usage = mem.get("usage")
+    if usage is None:
+        return None, None
+    stats = mem.get("stats") or {}
+    # cgroup v1 reports total_inactive_file, v2 inactive_file
+    cache = stats.get("total_inactive_file", stats.get("inactive_file", 0))
+    return max(usage - cache, 0), mem.get("limit")
+
+
+def io_bytes(sample: Dict[str, Any]) -> Tuple[int, int]:
+    """Bytes read and written to block devices"""
+    read, write = 0, 0
+    blkio = (sample.get("blkio_stats") or {}).get("io_service_bytes_recursive")
+    for entry in blkio or []:
+        op = entry.get("op", "").lower()
+        if op == "read":
+            read += entry.get("value", 0)
+        elif op == "write":
+            write += entry.get("value", 0)
+    return read, write
+
+
+def net_bytes(sample: Dict[str, Any]) -> Tuple[int, int]:
+    """Bytes received and sent by all the interfaces"""
+    rx, tx = 0, 0
+    for iface in (sample.get("networks") or {}).values():
+        rx += iface.get("rx_bytes", 0)
+        tx += iface.get("tx_bytes", 0)
+    return rx, tx
+
+
+class StatsSampler:
+    """
+    It reads the stats of a container in a thread between `start` and
+    `stop`.
+
+    :param interval: secs between the samples published
+    :param publish: called with the data of a `stats` event, errors
+    raised by it are logged and ignored.
+    """
+
+    def __init__(
+        self,
+        interval: float = 5.0,
+        publish: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    ):
+        self.interval = interval
+        self.publish = publish
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._first: Optional[Tuple[int, int, int, int]] = None
+        self._last: Tuple[int, int, int, int] = (0, 0, 0, 0)
+        self._cpu = []
+        self._mem = []
+        self._mem_limit: Optional[int] = None
+
+    def add(self, sample: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """It adds a sample to the usage, the event data is returned.
+        Samples of a stopped container, without memory, are skipped."""
+        mem, limit = mem_usage(sample)
+        if mem is None:
+            return None
+        cpu = cpu_percent(sample)
+        counters = io_bytes(sample) + net_bytes(sample)
+        with self._lock:
+            if self._first is None:
+                self._first = counters
+            self._last = counters
+            if cpu is not None:
+                self._cpu.append(cpu)
+            self._mem.append(mem)
+            self._mem_limit = limit
+            read, write, rx, tx = (c - f for c, f in zip(counters, self._first))
+        return {
+            "cpu": {"cpu_pct": round(cpu or 0.0, 2)},
+            "mem": {"mem_usage": mem, "mem_limit": limit},
+            "io": {"read": read, "write": write, "rx": rx, "tx": tx},
+        }
+
+    def _loop(self, container):
+        last_pub = 0.0
+        try:
+            for sample in container.stats(stream=True, decode=True):
+                if self._stop.is_set():
+                    break
+                data = self.add(sample)
+                now = time.monotonic()
+                if data and self.publish and now - last_pub >= self.interval:
+                    last_pub = now
+                    try:
+                        self.publish(data)
+                    except Exception as e:  # pylint: disable=broad-except
+                        log.server_logger.warning(f"Stats: publish failed {e}")
+        except Exception as e:  # pylint: disable=broad-except
+            # the container is gone or docker closed the stream
+            log.server_logger.debug(f"Stats: {container.name} {e}")
+
+    def start(self, container):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._loop, args=(container,), daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0) -> Optional[ResourceUsage]:
+        """It waits for the thread up to `timeout`, the stream yields each
+        second. None if no sample was taken."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        return self.usage()
+
+    def usage(self) -> Optional[ResourceUsage]:
+        with self._lock:
+            if not self._mem:
+                return None
+            read, write, rx, tx = (c - f for c, f in zip(self._last, self._first))
+            return ResourceUsage(
+                samples=len(self._mem),
+                cpu_avg=round(sum(self._cpu) / len(self._cpu), 2) if self._cpu else 0.0,
+                cpu_peak=round(max(self._cpu, default=0.0), 2),
+                mem_avg_mb=round(sum(self._mem) / len(self._mem) / MB, 1),
+                mem_peak_mb=round(max(self._mem) / MB, 1),
+                mem_limit_mb=round(self._mem_limit / MB, 1)
+                if self._mem_limit
+                else None,
+                io_read_mb=round(read / MB, 2),
+                io_write_mb=round(write / MB, 2),
+                net_rx_mb=round(rx / MB, 2),
+                net_tx_mb=round(tx / MB, 2),
+            )
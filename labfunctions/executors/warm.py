@@ -0,0 +1,175 @@
+"""
+Executor which runs inside a warm container of the agent pool
+(see `executors.pool`). It imports papermill and the executor once, then
+it waits for tasks in a tcp port. Each task is run in a forked child with
+the env of the task, so tasks don't share state and the startup of Python
+is paid once by container.
+
+With a `KernelPool`, notebooks are run in a Jupyter kernel kept by the
+server between tasks (see `executors.kernels`).
+
+Protocol: one json line by connection with the token of the container and
+the env of the task, the answer is one json line with the exit status,
+the output of the task, the tasks run by the container and its memory.
+The context of the task is moved from its env to a handoff file, which
+the child reads (see `executors.handoff`).
+"""
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import traceback
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from labfunctions import defaults, log
+
+from .handoff import child_handoff
+
+LOGS_MAX = 64 * 1024
+# cgroup v2 and v1
+CGROUP_MEMORY = [
+    "/sys/fs/cgroup/memory.current",
+    "/sys/fs/cgroup/memory/memory.usage_in_bytes",
+]
+
+
+def run_local() -> int:
+    """Same exit status that `lab exec local`"""
+    from labfunctions.executors.local_exec import local_exec_env
+
+    result = local_exec_env()
+    return 255 if result.error else 0
+
+
+def memory_usage() -> Optional[int]:
+    """Memory used by the container in bytes, as docker stats reports it"""
+    for path in CGROUP_MEMORY:
+        try:
+            with open(path) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def run_forked(env: Dict[str, str], func: Callable[[], int]) -> Tuple[int, str]:
+    """It runs `func` in a child with `env` and returns its exit status
+    and its output"""
+    fd, logs_path = tempfile.mkstemp(prefix="lf-warm-")
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.dup2(fd, 1)
+            os.dup2(fd, 2)
+            sys.stdout = sys.stderr = open(fd, "w", buffering=1, closefd=False)
+            os.environ.update(env)
+            status = func()
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit((status or 0) & 0xFF)
+
+    _, wstatus = os.waitpid(pid, 0)
+    status = os.WEXITSTATUS(wstatus) if os.WIFEXITED(wstatus) else -1
+    os.close(fd)
+    with open(logs_path, "rb") as f:
+        f.seek(max(os.path.getsize(logs_path) - LOGS_MAX, 0))
+        logs = f.read().decode("utf-8", errors="replace")
+    os.remove(logs_path)
+    return status, logs
+
+
+class WarmHandler(socketserver.StreamRequestHandler):
+    server: "WarmServer"
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # used by the pool to know when the server is ready
+            return
+        req: Dict[str, Any] = json.loads(line)
+        if req.get("token") != self.server.token:
+            rsp = dict(status=-4, logs="Invalid token", tasks=self.server.tasks)
+        else:
+            env = child_handoff(req.get("env", {}))
+            kernel = self.server.acquire_kernel()
+            if kernel:
+                env[defaults.WARM_KERNEL_VAR] = kernel.info()
+            try:
+                status, logs = run_forked(env, self.server.func)
+            finally:
+                if kernel:
+                    self.server.kernels.release(kernel)
+                if defaults.CTX_FILE_VAR in env:
+                    os.remove(env[defaults.CTX_FILE_VAR])
+            self.server.tasks += 1
+            rsp = dict(
+                status=status,
+                logs=logs,
+                tasks=self.server.tasks,
+                memory=memory_usage(),
+            )
+        self.wfile.write(json.dumps(rsp).encode("utf-8") + b"\n")
+
+
+class WarmServer(socketserver.TCPServer):
+    """
+    Tasks are run one at a time, the pool gives a container to one
+    task at a time.
+
+    :param token: shared secret with the pool, by default it is taken
+    from the env var `defaults.WARM_TOKEN_VAR`
+    :param func: what each child runs, `run_local` by default
+    :param kernels: warm kernels for the notebooks, if None each notebook
+    starts its own kernel
+    """
+
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        addr: str = "0.0.0.0",
+        port: int = defaults.WARM_PORT,
+        *,
+        token: Optional[str] = None,
+        func: Callable[[], int] = run_local,
+        kernels=None,
+    ):
+        super().__init__((addr, port), WarmHandler)
+        self.token = token or os.environ[defaults.WARM_TOKEN_VAR]
+        self.func = func
+        self.kernels = kernels
+        self.tasks = 0
+
+    def acquire_kernel(self):
+        if not self.kernels:
+            return None
+        try:
+            return self.kernels.acquire()
+        except Exception as e:  # pylint: disable=broad-except
+            log.error_logger.error(f"Warm: kernel not available {e}")
+            return None
+
+    def server_close(self):
+        if self.kernels:
+            self.kernels.shutdown()
+        super().server_close()
+
+
+def warm_serve(addr: str = "0.0.0.0", port: int = defaults.WARM_PORT, kernels=None):
+    # imported before forking, so children start with them loaded
+    import papermill  # noqa: F401
+
+    from labfunctions.executors import local_exec  # noqa: F401
+
+    if kernels:
+        # started before the first task
+        kernels.acquire()
+    with WarmServer(addr, port, kernels=kernels) as server:
+        server.serve_forever()
@@ -1,15 +1,17 @@
 # import tempfile
 import json
 import logging
+import os
 import time
 from dataclasses import asdict, dataclass
 from datetime import datetime
 from functools import wraps
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 import cloudpickle
 import httpx
 
+from labfunctions import defaults
 from labfunctions.conf.client_settings import settings
 
 # from labfunctions.workflows.core import build_context
@@ -49,9 +51,14 @@ def build_ctx(wfid, execid, now=None) -> SimpleExecCtx:
     )
 
 
+def _local_path(name, ctx: SimpleExecCtx) -> str:
+    cache_dir = os.getenv(defaults.CACHE_DIR_VAR, "/tmp")
+    return f"{cache_dir}/{ctx.wfid}.{ctx.execid}.{name}"
+
+
 def _write_pickle(name, data, ctx: SimpleExecCtx):
-    fpath = f"/tmp/{ctx.wfid}.{ctx.execid}.{name}.pickle"
-    metapath = f"/tmp/{ctx.wfid}.{ctx.execid}.{name}.json"
+    fpath = f"{_local_path(name, ctx)}.pickle"
+    metapath = f"{_local_path(name, ctx)}.json"
     with open(fpath, "wb") as f:
         f.write(cloudpickle.dumps(data))
         logger.debug("CACHE: Wrote to %s", fpath)
@@ -60,21 +67,20 @@ def _write_pickle(name, data, ctx: SimpleExecCtx):
 
 
 def _restore_pickle(name, ctx: SimpleExecCtx):
-    fpath = f"/tmp/{ctx.wfid}.{ctx.execid}.{name}.pickle"
-    metapath = f"/tmp/{ctx.wfid}.{ctx.execid}.{name}.json"
+    fpath = f"{_local_path(name, ctx)}.pickle"
+    metapath = f"{_local_path(name, ctx)}.json"
     try:
         with open(fpath, "rb") as f:
             data = cloudpickle.load(f)
             logger.debug("CACHE: Reading from %s", fpath)
         with open(metapath, "r") as f:
-            data = f.read()
-            meta = json.loads(data)
+            meta = json.loads(f.read())
 
         return data, meta
     except EOFError:
-        return None
+        return None, None
     except FileNotFoundError:
-        return None
+        return None, None
 
 
 def _write_fileserver(name, data, ctx: SimpleExecCtx):
@@ -110,7 +116,7 @@ def _restore_fileserver(name, ctx: SimpleExecCtx):
 def is_valid_date(cache_dt: str, valid_for_min: int) -> bool:
     dt = datetime.fromisoformat(cache_dt)
     now = datetime.utcnow()
-    elapsed = round((now - dt).seconds / 60)
+    elapsed = round((now - dt).total_seconds() / 60)
     if elapsed > valid_for_min:
         return False
     return True
@@ -178,6 +184,39 @@ def frozen_result(
     return decorate
 
 
+def _map_conf(mapid: str, index: int, strategy: str) -> CacheConfig:
+    return CacheConfig(
+        name=f"part{index}", ctx=build_ctx(mapid, "map"), strategy=strategy
+    )
+
+
+def put_map_result(data, globals_dict: Dict[str, Any], strategy="fileserver"):
+    """
+    It keeps the result of a partition of a map (see `control.fanout`),
+    to be called from the notebook of the children with `globals()`.
+    """
+    conf = _map_conf(
+        globals_dict[defaults.MAPID_PARAM],
+        globals_dict[defaults.MAP_INDEX_PARAM],
+        strategy,
+    )
+    cache_manager_write(data, conf)
+
+
+def get_map_results(globals_dict: Dict[str, Any], strategy="fileserver") -> List[Any]:
+    """
+    Results kept by the partitions of a map in the order of the
+    partitions, to be called from the reduce notebook with `globals()`.
+    None for a partition which didn't keep a result.
+    """
+    mapid = globals_dict[defaults.MAPID_PARAM]
+    results = []
+    for ref in globals_dict[defaults.MAP_RESULTS_PARAM]:
+        data, _ = cache_manager_read(_map_conf(mapid, ref["index"], strategy))
+        results.append(data)
+    return results
+
+
 if __name__ == "__main__":
 
     @frozen_result(wfid="test", execid="test_t", strategy="fileserver", valid_for_min=5)
@@ -0,0 +1,217 @@
+"""
+Compression of streams by chunks, used to upload the output notebooks.
+The encoding is sent as the `Content-Encoding` of the request.
+
+zstd needs zstandard, an optional dependency (`codecs` extra).
+"""
+import zlib
+from typing import AsyncGenerator, Generator, List, Optional
+
+ENCODINGS = ["identity", "gzip", "zstd"]
+# gzip header and trailer
+GZIP_WBITS = 31
+# max size of each piece decompressed
+INFLATE_CHUNK = 64 * 1024
+
+
+class StreamTooLarge(ValueError):
+    pass
+
+
+class StreamDecodeError(ValueError):
+    pass
+
+
+class _Identity:
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes, max_length: int = 0) -> bytes:
+        return data
+
+    unconsumed_tail = b""
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class _ZstdFrames:
+    """
+    It follows the headers of zstd frames and of their blocks, without
+    decompressing them, to know if the data received ends a frame.
+    """
+
+    MAGIC = b"\x28\xb5\x2f\xfd"
+
+    def __init__(self):
+        self.frames = 0
+        self._pending = b""
+        self._in_frame = False
+        self._checksum = 0
+        self._skip = 0
+
+    @property
+    def eof(self) -> bool:
+        return self.frames > 0 and not (self._in_frame or self._skip or self._pending)
+
+    def feed(self, data: bytes):
+        data = self._pending + data
+        pos = 0
+        while pos < len(data):
+            if self._skip:
+                n = min(self._skip, len(data) - pos)
+                self._skip -= n
+                pos += n
+                continue
+            # magic and frame header descriptor, or a block header
+            need = 3 if self._in_frame else 5
+            if len(data) - pos < need:
+                break
+            head, pos = data[pos : pos + need], pos + need
+            if not self._in_frame:
+                if head[:4] != self.MAGIC:
+                    raise StreamDecodeError("Unknown zstd frame")
+                desc = head[4]
+                single = desc >> 5 & 1
+                self._checksum = 4 if desc >> 2 & 1 else 0
+                # window descriptor, dictionary id and content size
+                self._skip = (
+                    (1 - single) + (0, 1, 2, 4)[desc & 3] + (single, 2, 4, 8)[desc >> 6]
+                )
+                self._in_frame = True
+                continue
+            block = int.from_bytes(head, "little")
+            # a RLE block is one byte repeated
+            self._skip = 1 if block >> 1 & 3 == 1 else block >> 3
+            if block & 1:
+                self._skip += self._checksum
+                self._in_frame = False
+                self.frames += 1
+        self._pending = data[pos:]
+
+
+class _ZstdInflater:
+    """
+    Same interface that a zlib decompressor. zstandard doesn't limit the
+    output of a call, it is written by pieces of `max_length` to a sink
+    which stops the decompression when the limit given is reached.
+    The end of the frame is tracked apart, the writer doesn't tell it.
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        import zstandard
+
+        self.limit = limit
+        self.total = 0
+        self._pieces: List[bytes] = []
+        self._writer = zstandard.ZstdDecompressor().stream_writer(
+            self, write_size=INFLATE_CHUNK
+        )
+        self.unconsumed_tail = b""
+        self._frames = _ZstdFrames()
+
+    @property
+    def eof(self) -> bool:
+        return self._frames.eof
+
+    def write(self, data: bytes) -> int:
+        self.total += len(data)
+        if self.limit and self.total > self.limit:
+            raise StreamTooLarge(f"Stream bigger than {self.limit} bytes")
+        self._pieces.append(data)
+        return len(data)
+
+    def decompress(self, data: bytes, max_length: int = 0) -> bytes:
+        import zstandard
+
+        try:
+            self._writer.write(data)
+        except zstandard.ZstdError as e:
+            raise StreamDecodeError(str(e)) from e
+        self._frames.feed(data)
+        out, self._pieces = b"".join(self._pieces), []
+        return out
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def compressor(encoding: str):
+    if encoding == "identity":
+        return _Identity()
+    if encoding == "gzip":
+        return zlib.compressobj(wbits=GZIP_WBITS)
+    if encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor().compressobj()
+    raise KeyError(f"Encoding {encoding} not found, options: {ENCODINGS}")
+
+
+def decompressor(encoding: str, limit: Optional[int] = None):
+    """:param limit: bytes allowed once decompressed, only checked by
+    decompressors which can't limit the output of each call"""
+    if encoding == "identity":
+        return _Identity()
+    if encoding == "gzip":
+        return zlib.decompressobj(wbits=GZIP_WBITS)
+    if encoding == "zstd":
+        return _ZstdInflater(limit)
+    raise KeyError(f"Encoding {encoding} not found, options: {ENCODINGS}")
+
+
+def encode_file(
+    fp: str, encoding: str = "gzip", chunk_size=64 * 1024
+) -> Generator[bytes, None, None]:
+    """It reads and compresses a file by chunks"""
+    comp = compressor(encoding)
+    with open(fp, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            out = comp.compress(data)
+            if out:
+                yield out
+    out = comp.flush()
+    if out:
+        yield out
+
+
+async def decode_stream(
+    stream: AsyncGenerator[bytes, None],
+    encoding: str = "identity",
+    max_size: Optional[int] = None,
+) -> AsyncGenerator[bytes, None]:
+    """
+    It decompresses a stream by chunks. Each chunk received is inflated
+    by pieces of `INFLATE_CHUNK`, so the size is checked before a small
+    chunk can take much memory.
+
+    :param max_size: bytes allowed once decompressed
+    :raises StreamTooLarge: if the data is bigger than `max_size`
+    :raises StreamDecodeError: if the data can't be decompressed
+    """
+    decomp = decompressor(encoding, max_size)
+    total = 0
+    async for data in stream:
+        while data:
+            try:
+                out = decomp.decompress(data, INFLATE_CHUNK)
+            except zlib.error as e:
+                raise StreamDecodeError(str(e)) from e
+            data = decomp.unconsumed_tail
+            total += len(out)
+            if max_size and total > max_size:
+                raise StreamTooLarge(f"Stream bigger than {max_size} bytes")
+            if out:
+                yield out
+    try:
+        out = decomp.flush()
+    except zlib.error as e:
+        raise StreamDecodeError(str(e)) from e
+    if out:
+        yield out
+    # gzip and zstd streams end with a trailer or a last block
+    if not getattr(decomp, "eof", True):
+        raise StreamDecodeError("Stream truncated")
@@ -3,12 +3,18 @@ from typing import Any, Dict, List, Optional, Union
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 
+from labfunctions import timeline
 from labfunctions.models import HistoryModel
 from labfunctions.types import (
+    CellCompare,
+    CellCompareResponse,
+    CellProfileResponse,
+    CellStats,
     ExecutionResult,
     HistoryLastResponse,
     HistoryResult,
     NBTask,
+    ResourceUsage,
 )
 
 
@@ -51,11 +57,35 @@ async def get_last(
                 status=r.status,
                 result=r.result,
                 created_at=r.created_at.isoformat(),
+                dagid=r.dagid,
             )
         )
     return HistoryLastResponse(rows=rsp)
 
 
+async def get_by_dagid(session, projectid: str, dagid: str) -> HistoryLastResponse:
+    """Executions of a DAG run in the order they finished"""
+    stmt = (
+        select(HistoryModel)
+        .where(HistoryModel.dagid == dagid)
+        .where(HistoryModel.project_id == projectid)
+        .order_by(HistoryModel.created_at)
+    )
+    r = await session.execute(stmt)
+    rsp = [
+        HistoryResult(
+            wfid=m.wfid,
+            execid=m.execid,
+            status=m.status,
+            result=m.result,
+            created_at=m.created_at.isoformat(),
+            dagid=m.dagid,
+        )
+        for m in r.scalars()
+    ]
+    return HistoryLastResponse(rows=rsp)
+
+
 async def get_one(session, execid: str) -> Union[HistoryResult, None]:
     stmt = select(HistoryModel).where(HistoryModel.execid == execid).limit(1)
     r = await session.execute(stmt)
@@ -68,6 +98,7 @@ async def get_one(session, execid: str) -> Union[HistoryResult, None]:
             status=model.status,
             result=model.result,
             created_at=model.created_at.isoformat(),
+            dagid=model.dagid,
         )
     return hr
 
@@ -87,6 +118,91 @@ async def create(session, execution_result: ExecutionResult) -> HistoryModel:
         nb_name=execution_result.name,
         result=result_data,
         status=status,
+        dagid=execution_result.dagid,
     )
     session.add(row)
     return row
+
+
+async def set_resources(
+    session, projectid: str, execid: str, usage: ResourceUsage
+) -> bool:
+    """It adds the usage of the container to the result of an execution"""
+    stmt = (
+        select(HistoryModel)
+        .where(HistoryModel.execid == execid)
+        .where(HistoryModel.project_id == projectid)
+        .limit(1)
+    )
+    r = await session.execute(stmt)
+    model: Union[HistoryModel, None] = r.scalar_one_or_none()
+    if not model:
+        return False
+    # a new dict, changes inside a JSON column aren't tracked
+    model.result = {**model.result, "resources": usage.dict()}
+    return True
+
+
+def cell_stats(
+    wfid: str, results: List[ExecutionResult], top=10
+) -> CellProfileResponse:
+    """
+    Slowest cells of a workflow by their mean duration.
+
+    :param results: executions from the newest to the oldest, as
+    returned by `get_last`
+    """
+    results = [r for r in reversed(results) if r.cells]
+    by_ix: Dict[int, List[Any]] = {}
+    for r in results:
+        for cell in r.cells:
+            by_ix.setdefault(cell.ix, []).append(cell)
+    stats = []
+    for ix, cells in by_ix.items():
+        secs = [c.secs for c in cells]
+        peaks = [c.peak_mb for c in cells if c.peak_mb is not None]
+        stats.append(
+            CellStats(
+                ix=ix,
+                src=cells[-1].src,
+                runs=len(cells),
+                mean_secs=round(sum(secs) / len(secs), 3),
+                max_secs=max(secs),
+                last_secs=secs[-1],
+                secs=secs,
+                peak_mb=max(peaks) if peaks else None,
+            )
+        )
+    stats.sort(key=lambda s: s.mean_secs, reverse=True)
+    return CellProfileResponse(
+        wfid=wfid, execids=[r.execid for r in results], cells=stats[:top]
+    )
+
+
+def compare_cells(base: ExecutionResult, other: ExecutionResult) -> CellCompareResponse:
+    """Durations of the cells of two executions, by cell index"""
+    base_cells = {c.ix: c for c in base.cells or []}
+    other_cells = {c.ix: c for c in other.cells or []}
+    rows = []
+    for ix in sorted(set(base_cells) | set(other_cells)):
+        b, o = base_cells.get(ix), other_cells.get(ix)
+        row = CellCompare(
+            ix=ix,
+            src=(o or b).src,
+            base_secs=b.secs if b else None,
+            other_secs=o.secs if o else None,
+        )
+        if b and o:
+            row.delta_secs = round(o.secs - b.secs, 3)
+            row.ratio = round(o.secs / b.secs, 3) if b.secs else None
+        rows.append(row)
+    return CellCompareResponse(base=base.execid, other=other.execid, cells=rows)
+
+
+def timeline_samples(results: List[ExecutionResult]) -> Dict[str, List[float]]:
+    """Durations by phase of the executions with a timeline"""
+    samples: Dict[str, List[float]] = {p: [] for p in timeline.PHASE_NAMES}
+    for r in results:
+        for phase, secs in timeline.phases(r.timeline or {}).items():
+            samples[phase].append(secs)
+    return samples
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
 from sqlalchemy import delete, select, update
 from sqlalchemy.exc import IntegrityError
@@ -32,6 +32,7 @@ def model2data(wm: WorkflowModel) -> WorkflowDataWeb:
         enabled=wm.enabled,
         wfid=wm.wfid,
         schedule=ScheduleData(**wm.schedule),
+        depends_on=wm.depends_on or [],
     )
 
 
@@ -51,6 +52,7 @@ def _update(wfid: str, projectid: str, wfd: WorkflowDataWeb):
             schedule=schedule,
             alias=wfd.alias,
             enabled=wfd.enabled,
+            depends_on=wfd.depends_on,
             updated_at=datetime.utcnow(),
         )
     )
@@ -129,6 +131,38 @@ async def get_all(session, project_id=None) -> List[WorkflowData]:
     return wfs
 
 
+async def get_dag(session, projectid: str) -> Dict[str, WorkflowDataWeb]:
+    """Workflows of a project by alias, used to follow their dependencies"""
+    stmt = select(WorkflowModel).where(WorkflowModel.project_id == projectid)
+    result = await session.execute(stmt)
+    return {r.alias: model2data(r) for r in result.scalars()}
+
+
+async def iter_enabled(
+    session, page_size=500
+) -> AsyncIterator[List[Tuple[str, WorkflowDataWeb]]]:
+    """
+    Enabled workflows as pages of (projectid, workflow). Pages are
+    taken by primary key, so a page is never read twice even if
+    workflows are added meanwhile.
+    """
+    last = 0
+    while True:
+        stmt = (
+            select(WorkflowModel)
+            .where(WorkflowModel.enabled.is_(True))
+            .where(WorkflowModel.id > last)
+            .order_by(WorkflowModel.id)
+            .limit(page_size)
+        )
+        result = await session.execute(stmt)
+        rows = result.scalars().all()
+        if not rows:
+            return
+        yield [(r.project_id, model2data(r)) for r in rows]
+        last = rows[-1].id
+
+
 async def get_by_alias(session, alias) -> Union[WorkflowModel, None]:
     stmt = select_workflow().where(WorkflowModel.alias == alias).limit(1)
     result = await session.execute(stmt)
@@ -158,6 +192,7 @@ async def register(session, projectid: str, wfd: WorkflowDataWeb, update=False)
         schedule=schedule,
         project_id=projectid,
         enabled=wfd.enabled,
+        depends_on=wfd.depends_on,
     )
     session.add(obj)
     try:
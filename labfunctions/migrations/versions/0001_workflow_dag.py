@@ -0,0 +1,27 @@
+"""workflow dag
+
+Revision ID: 0001
+Revises: 0000
+Create Date: 2026-10-19 10:02:11.532014
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0001"
+down_revision = "0000"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("lf_workflow", sa.Column("depends_on", sa.JSON(), nullable=True))
+    op.add_column("lf_history", sa.Column("dagid", sa.String(length=24), nullable=True))
+    op.create_index(op.f("ix_lf_history_dagid"), "lf_history", ["dagid"], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_lf_history_dagid"), table_name="lf_history")
+    op.drop_column("lf_history", "dagid")
+    op.drop_column("lf_workflow", "depends_on")
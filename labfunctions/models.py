@@ -79,6 +79,8 @@ class HistoryModel(Base, SerializerMixin, ProjectRelationMixin):
     :param result: is the result of the task. TaskResult
     :param elapsed_secs: Time in seconds from the start of the task to the end.
     :param status: -1 fail, 0 ok.
+    :param dagid: run of workflows triggered by dependencies that the
+    execution belongs to.
     """
 
     __tablename__ = "lf_history"
@@ -91,6 +93,7 @@ class HistoryModel(Base, SerializerMixin, ProjectRelationMixin):
     result = Column(JSON, nullable=False)
     elapsed_secs = Column(Float(), nullable=False)
     status = Column(Integer, index=True)
+    dagid = Column(String(24), index=True, nullable=True)
 
     created_at = Column(
         DateTime(),
@@ -179,6 +182,7 @@ class WorkflowModel(Base, SerializerMixin, ProjectRelationMixin):
     :param nbtask: details to execute a notebook with specific parameters.
     :param schedule: when should be executed.
     :param enabled: if the task should run or not.
+    :param depends_on: aliases of the upstream workflows.
     """
 
     __tablename__ = "lf_workflow"
@@ -195,6 +199,7 @@ class WorkflowModel(Base, SerializerMixin, ProjectRelationMixin):
     nbtask = Column(JSON(), nullable=False)
     schedule = Column(JSON(), nullable=False)
     enabled = Column(Boolean, default=True, nullable=False)
+    depends_on = Column(JSON(), nullable=True)
 
     created_at = Column(DateTime(), server_default=functions.now(), nullable=False)
 
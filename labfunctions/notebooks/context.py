@@ -96,6 +96,10 @@ def create_notebook_ctx(
         created_at=_now,
         notifications_ok=task.notifications_ok,
         notifications_fail=task.notifications_fail,
+        mode=task.mode,
+        priority=task.priority,
+        cpus=task.cpus,
+        memory_mb=task.memory_mb,
     )
 
 
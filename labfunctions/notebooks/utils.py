@@ -1,5 +1,8 @@
+from typing import Optional
+
 import nbformat
 from nbconvert import NotebookExporter
+from nbconvert.filters.strings import ipython2python
 from traitlets.config import Config
 
 
@@ -27,3 +30,27 @@ def clean_output(path, version=4):
     exported, resources_dict = exporter.from_notebook_node(note)
 
     return exported, resources_dict
+
+
+def notebook_to_script(note, params_hook: Optional[str] = None) -> str:
+    """
+    Source of the code cells of a notebook as a python script. IPython
+    syntax is translated to calls to `get_ipython()`.
+
+    :param params_hook: statement added after the cell tagged as
+    `parameters`, or at the start if there isn't one, as papermill
+    injects the params.
+    """
+    cells = [c for c in note.cells if c.cell_type == "code"]
+    tagged = [
+        ix for ix, c in enumerate(cells) if "parameters" in c.metadata.get("tags", [])
+    ]
+    lines = []
+    if params_hook and not tagged:
+        lines.append(params_hook)
+    for ix, cell in enumerate(cells):
+        lines.append(f"# %% cell {ix}")
+        lines.append(ipython2python(cell.source).rstrip("\n"))
+        if params_hook and tagged and ix == tagged[0]:
+            lines.append(params_hook)
+    return "\n".join(lines) + "\n"
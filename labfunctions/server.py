@@ -10,6 +10,7 @@ from sanic_ext import Extend
 from labfunctions import defaults
 from labfunctions.cluster import ClusterControl
 from labfunctions.control import JobManager, SchedulerExec
+from labfunctions.control.reconcile import reconcile_on_start
 from labfunctions.db.nosync import AsyncSQL
 from labfunctions.events import EventManager
 from labfunctions.io.kvspec import AsyncKVSpec
@@ -115,7 +116,9 @@ def create_app(
         current_app.ctx.scheduler = SchedulerExec(
             _queue_pool, control_queue=settings.CONTROL_QUEUE
         )
-        current_app.ctx.job_manager = JobManager(conn=_queue_pool)
+        current_app.ctx.job_manager = JobManager(
+            conn=_queue_pool, shards=settings.SCHEDULER_SHARDS
+        )
         current_app.ctx.db = _db
 
         if settings.CLUSTER_FILEPATH:
@@ -126,6 +129,10 @@ def create_app(
                 conn=current_app.ctx.web_redis,
             )
         await current_app.ctx.db.init()
+        if settings.SCHEDULER_RECONCILE_ON_START:
+            current_app.add_task(
+                reconcile_on_start(current_app.ctx.db, current_app.ctx.job_manager)
+            )
 
     @app.middleware("request")
     async def inject_session(request):
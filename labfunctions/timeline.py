@@ -0,0 +1,74 @@
+"""
+Timeline of an execution: epoch timestamps (marks) taken along the path
+of a task, from its enqueue in the server to the registration of its
+result. The scheduler, the agent and the container each add their marks
+to `ExecutionNBTask.timeline`, which goes to the container with the rest
+of the context, and they end in `ExecutionResult.timeline`, kept with
+the history row.
+
+A phase is the time from the previous mark found to its mark. A missing
+mark folds into the next phase: scheduled runs aren't enqueued by the
+server, scripts don't start a kernel. Marks of the server and of the
+agent come from different clocks.
+"""
+import time
+from typing import Dict, List, Optional
+
+from labfunctions.types import PhaseLatency
+
+# mark -> phase which ends with it
+PHASES = {
+    "dequeued": "queue",
+    "creds": "creds",
+    "pulled": "pull",
+    "started": "container",
+    "kernel": "kernel",
+    "first_cell": "first_cell",
+    "last_cell": "cells",
+    "uploaded": "upload",
+    "registered": "register",
+}
+MARKS = ["enqueued", *PHASES]
+PHASE_NAMES = [*PHASES.values(), "total"]
+
+
+def mark(timeline: Dict[str, float], name: str, ts: Optional[float] = None):
+    timeline[name] = round(ts or time.time(), 3)
+
+
+def phases(timeline: Dict[str, float]) -> Dict[str, float]:
+    """Secs by phase, in the order of the path. `total` goes from the
+    first mark to the last one."""
+    durations = {}
+    found = [timeline[m] for m in MARKS if m in timeline]
+    prev = None
+    for name in MARKS:
+        ts = timeline.get(name)
+        if ts is None:
+            continue
+        if prev is not None:
+            durations[PHASES[name]] = round(max(ts - prev, 0.0), 3)
+        prev = ts
+    if len(found) > 1:
+        durations["total"] = round(max(found[-1] - found[0], 0.0), 3)
+    return durations
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest rank of sorted values"""
+    if not values:
+        return None
+    ix = min(int(round(q * (len(values) - 1))), len(values) - 1)
+    return round(values[ix], 3)
+
+
+def phase_latency(phase: str, values: List[float]) -> PhaseLatency:
+    values = sorted(values)
+    return PhaseLatency(
+        phase=phase,
+        count=len(values),
+        p50=percentile(values, 0.5),
+        p95=percentile(values, 0.95),
+        p99=percentile(values, 0.99),
+        max=round(values[-1], 3) if values else None,
+    )
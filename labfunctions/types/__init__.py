@@ -1,21 +1,43 @@
 from . import user
+from .agent import AgentResources
 from .client import WorkflowsFile
 from .config import ClientSettings, ServerSettings
 from .core import (
+    CellCompare,
+    CellCompareResponse,
+    CellProfile,
+    CellProfileResponse,
+    CellStats,
     ExecutionNBTask,
     ExecutionResult,
     HistoryLastResponse,
     HistoryRequest,
     HistoryResult,
     Labfile,
+    MapSpec,
+    MapTask,
     NBTask,
+    ResourceUsage,
     ScheduleData,
     SimpleExecCtx,
+    TaskBatchRequest,
+    TaskBatchResponse,
     TaskStatus,
+    TimelineResponse,
     WorkflowData,
     WorkflowDataWeb,
     WorkflowsList,
 )
+from .dag import DagNodeRef, DagRun, MapPartitionRef, MapRun
 from .projects import ProjectData, ProjectReq
+from .queues import (
+    CodecBenchResult,
+    DispatchBenchResult,
+    LaneStats,
+    PhaseLatency,
+    QueueLimits,
+    QueueStats,
+)
 from .runtimes import ProjectBundleFile, RuntimeData, RuntimeReq, RuntimeSpec
 from .security import TokenCreds
+from .workflows import ReconcileReport
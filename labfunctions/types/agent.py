@@ -1,10 +1,20 @@
 from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 
 from labfunctions import defaults
 
 
+class AgentResources(BaseModel):
+    """Capacity of an agent, advertised in its heartbeat"""
+
+    cpus: float
+    memory_mb: int
+    free_cpus: float
+    free_memory_mb: int
+    running: int = 0
+
+
 class AgentNode(BaseModel):
     """
     A self register entity for each machine created
@@ -18,6 +28,7 @@ class AgentNode(BaseModel):
     workers: List[str]
     birthday: int
     machine_id: Optional[str] = None
+    resources: Optional[AgentResources] = None
 
 
 class AgentConfig(BaseModel):
@@ -29,8 +40,22 @@ class AgentConfig(BaseModel):
     heartbeat_ttl: int
     heartbeat_check_every: int
     agent_name: Optional[str] = None
-    workers_n = 1
+    workers_n: int = 1
     max_jobs: int = 10
+    # capacity for the requests of the tasks, the machine's by default
+    cpus: Optional[float] = None
+    memory_mb: Optional[int] = None
+    # see control.batch
+    batch_size: int = 1
+    batch_wait: float = 2.0
+
+    @validator("batch_size")
+    def batch_fits_workers(cls, v, values):
+        # each job of a group holds a slot of the worker while it waits
+        workers = values.get("workers_n", 1)
+        if v > workers:
+            raise ValueError(f"batch_size {v} is greater than workers_n {workers}")
+        return v
 
 
 class AgentRequest(BaseModel):
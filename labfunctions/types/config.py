@@ -10,6 +10,8 @@ from labfunctions.defaults import (
     WFID_LEN,
 )
 
+from .queues import QueueLimits
+
 
 class ConfigCliType(BaseModel):
     """Config for default values for cli"""
@@ -51,10 +53,41 @@ class ServerSettings(BaseSettings):
     SQL: str
     ASQL: str
     AGENT_TOKEN_EXP: int = (60 * 60) * 12
+    # the agent keeps the private keys and tokens of the projects between
+    # tasks, a token is taken again `REFRESH_MARGIN` secs before it expires
+    AGENT_CREDS_CACHE: bool = True
+    AGENT_CREDS_KEY_TTL: int = 60 * 60
+    AGENT_CREDS_REFRESH_MARGIN: int = 60 * 10
+    # tasks with `batch` of the same project and runtime are run in one
+    # container, up to SIZE tasks waiting at most WAIT secs. 1 disables it,
+    # it can't be greater than the workers of the agent
+    AGENT_BATCH_SIZE: int = 1
+    AGENT_BATCH_WAIT: float = 2.0
 
     # Folders:
     BASE_PATH: str
     DOCKER_REGISTRY: Optional[str] = None
+    # warm containers by runtime in the agent, 0 disables the pool
+    DOCKER_POOL_SIZE: int = 0
+    DOCKER_POOL_MAX_TASKS: int = 50
+    DOCKER_POOL_MAX_MEM_MB: int = 2048
+    # runtime images started when the agent starts
+    DOCKER_POOL_PREWARM: List[str] = []
+    # notebooks of the warm containers run in a kept kernel
+    DOCKER_POOL_KERNELS: bool = False
+    DOCKER_POOL_KERNEL_PRELOAD: List[str] = []
+    DOCKER_POOL_KERNEL_MAX_RUNS: int = 20
+    DOCKER_POOL_KERNEL_MAX_MEM_MB: int = 1024
+    # secs while the digest of a runtime is trusted without asking the
+    # registry, mutable tags are always checked
+    DOCKER_PULL_TTL: int = 60 * 60
+    DOCKER_MUTABLE_TAGS: List[str] = ["latest", "current"]
+    # folder for the context files mounted in the containers, a tmpfs
+    # like /dev/shm by default
+    DOCKER_CTX_DIR: Optional[str] = None
+    # secs between the stats events of a running container, 0 disables
+    # the sampling
+    DOCKER_STATS_INTERVAL: float = 5.0
 
     SECURITY: Optional[SecuritySettings] = None
 
@@ -64,6 +97,24 @@ class ServerSettings(BaseSettings):
     QUEUE_DEFAULT_TIMEOUT: str = "30m"
     CONTROL_QUEUE: str = "default.control"
     BUILD_QUEUE: str = "default.build"
+    QUEUE_WAIT_TTL: str = "24h"
+    # fair share between projects, 0 means unlimited
+    QUEUE_PROJECT_WEIGHTS: Dict[str, float] = {}
+    QUEUE_PROJECT_MAX_RUNNING: Dict[str, int] = {}
+    QUEUE_MAX_RUNNING_DEFAULT: int = 0
+    # admission control by qname ({cluster}.{machine})
+    QUEUE_LIMITS: Dict[str, QueueLimits] = {}
+    QUEUE_LIMITS_DEFAULT: QueueLimits = QueueLimits()
+    # periodic workflows are split in shards between scheduler processes
+    SCHEDULER_SHARDS: int = 1
+    SCHEDULER_INTERVAL_SECS: int = 30
+    SCHEDULER_RECONCILE_ON_START: bool = False
+    # json, msgpack or msgpack+zstd, see control.codec
+    PAYLOAD_CODEC: str = "json"
+    # how long the state of a DAG run is kept waiting for its upstreams
+    DAG_STATE_TTL: str = "48h"
+    # how long a successful execution of a memoized task is reused
+    MEMO_TTL: str = "24h"
 
     # ids generations
     EXECID_LEN: int = EXECID_LEN
@@ -90,6 +141,7 @@ class ServerSettings(BaseSettings):
     AGENT_HEARTBEAT_TTL: int = 80 * 3
     AGENT_DOCKER_UID: int = 1089
     AGENT_DOCKER_GID: int = 997
+    AUTOSCALE_EVERY_SECS: int = 30
 
     # Logs:
     LOGLEVEL: str = "INFO"
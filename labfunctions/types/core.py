@@ -7,15 +7,43 @@ from labfunctions import defaults
 
 from .docker import DockerfileImage
 from .projects import ProjectData
+from .queues import PhaseLatency
 
 
 class ScheduleData(BaseModel):
-    """Used as generic structure when querying database"""
+    """Used as generic structure when querying database
+
+    :param overlap: policy when a run is triggered and the previous one
+    is still running: allow, skip, coalesce into a single pending run
+    or cancel the previous run. See `defaults.OVERLAP_POLICIES`
+    """
 
     start_in_min: int = 0
     repeat: Optional[int] = None
     cron: Optional[str] = None
     interval: Optional[str] = None
+    overlap: str = defaults.OVERLAP_DEFAULT
+
+
+class MapSpec(BaseModel):
+    """
+    Fan-out of a task over partitions, see `control.fanout`.
+
+    :param partitions: a child execution is run for each one, it gets the
+    partition as the `param` param of the notebook.
+    :param concurrency: children running at the same time, 0 runs all of
+    them at once.
+    :param retries: times a failed partition is run again before the map
+    fails.
+    :param reduce: notebook run when all the partitions finished ok, it
+    gets the results of the children as the `MAP_RESULTS` param.
+    """
+
+    partitions: List[Any] = Field(..., min_items=1)
+    param: str = "PARTITION"
+    concurrency: int = Field(0, ge=0)
+    retries: int = Field(1, ge=0)
+    reduce: Optional[str] = None
 
 
 class NBTask(BaseModel):
@@ -38,6 +66,22 @@ class NBTask(BaseModel):
     :param notifications_ok: If ok send a notification to discord or slack.
     :param notifications_fail: If not ok, send notification to discord or slack.
     but internally the task also send a notification if the user wants.
+    :param priority: lane where the task waits to be dispatched,
+    one of `defaults.PRIORITY_LANES`.
+    :param cpus: cpus requested, the agent runs the task when they are
+    free and limits the container to them.
+    :param memory_mb: memory requested in MB, it is also the memory limit
+    of the container.
+    :param mode: one of `defaults.EXEC_MODES`. In "script" mode the notebook
+    runs as a python module, without kernel, only its stdout and errors
+    are kept.
+    :param memoize: the notebook is deterministic, a successful execution
+    with the same runtime and params is reused instead of running it again
+    (see `control.memo`). Only tasks with a registered runtime are memoized.
+    :param map: the task runs once by partition instead of once.
+    :param batch: the task is short, an agent can run it in the same
+    container with other tasks of the project and runtime (see
+    `control.batch`).
     """
 
     nb_name: str
@@ -53,9 +97,32 @@ class NBTask(BaseModel):
     timeout: int = 10800  # secs 3h default
     notifications_ok: Optional[List[str]] = None
     notifications_fail: Optional[List[str]] = None
+    priority: str = defaults.PRIORITY_DEFAULT
+    cpus: Optional[float] = None
+    memory_mb: Optional[int] = None
+    memoize: bool = False
+    mode: str = "notebook"
+    map: Optional[MapSpec] = None
+    batch: bool = False
     # schedule: Optional[ScheduleData] = None
 
 
+class MapTask(BaseModel):
+    """
+    What is needed to enqueue the children of a map after it started.
+
+    :param mapid: execid of the map
+    :param task: task of the children without the partition
+    """
+
+    mapid: str
+    projectid: str
+    task: NBTask
+    map: MapSpec
+    wfid: Optional[str] = None
+    dagid: Optional[str] = None
+
+
 class ExecutionNBTask(BaseModel):
     """It will be send to task_handler, and it has the
     configuration needed for papermill to run a specific notebook.
@@ -85,11 +152,66 @@ class ExecutionNBTask(BaseModel):
     remote_output: Optional[str]
     notifications_ok: Optional[List[str]] = None
     notifications_fail: Optional[List[str]] = None
+    priority: str = defaults.PRIORITY_DEFAULT
+    dagid: Optional[str] = None
+    cpus: Optional[float] = None
+    memory_mb: Optional[int] = None
+    memo_key: Optional[str] = None
+    mode: str = "notebook"
+    # marks of the path of the task, see labfunctions.timeline
+    timeline: Dict[str, float] = {}
+
+
+class CellProfile(BaseModel):
+    """
+    Timing of a cell of an execution, kept short on purpose.
+
+    :param ix: index of the cell in the output notebook
+    :param secs: duration
+    :param peak_mb: peak memory of the kernel while the cell ran
+    :param src: first line of the source of the cell
+    """
+
+    ix: int
+    secs: float
+    peak_mb: Optional[float] = None
+    src: str = ""
+
+
+class ResourceUsage(BaseModel):
+    """
+    Usage of the container of an execution, from `docker stats`.
+
+    :param samples: number of samples taken
+    :param cpu_avg: average of cpu used, 100 is a full core
+    :param mem_avg_mb: average memory used, without the page cache
+    :param io_read_mb: bytes read from block devices during the execution
+    :param net_rx_mb: bytes received by the container network
+    """
+
+    samples: int = 0
+    cpu_avg: float = 0.0
+    cpu_peak: float = 0.0
+    mem_avg_mb: float = 0.0
+    mem_peak_mb: float = 0.0
+    mem_limit_mb: Optional[float] = None
+    io_read_mb: float = 0.0
+    io_write_mb: float = 0.0
+    net_rx_mb: float = 0.0
+    net_tx_mb: float = 0.0
 
 
 class ExecutionResult(BaseModel):
     """
     Is the result of a ExecutionTask execution.
+
+    :param memo_key: fingerprint of a memoized execution
+    :param memo_of: execid of the execution reused, its output is the
+    output of this one.
+    :param stdout: last part of the stdout of a script run
+    :param cells: timing of each code cell
+    :param resources: usage of the container while the task ran
+    :param timeline: marks of the path of the task, see `labfunctions.timeline`
     """
 
     projectid: str
@@ -110,6 +232,13 @@ class ExecutionResult(BaseModel):
     output_dir: Optional[str] = None
     error_dir: Optional[str] = None
     error_msg: Optional[str] = None
+    dagid: Optional[str] = None
+    memo_key: Optional[str] = None
+    memo_of: Optional[str] = None
+    stdout: Optional[str] = None
+    cells: Optional[List[CellProfile]] = None
+    resources: Optional[ResourceUsage] = None
+    timeline: Optional[Dict[str, float]] = None
 
 
 @dataclass
@@ -127,6 +256,7 @@ class HistoryResult(BaseModel):
     result: Optional[ExecutionResult] = None
     execid: Optional[str] = None
     created_at: Optional[str] = None
+    dagid: Optional[str] = None
 
 
 class HistoryRequest(BaseModel):
@@ -138,20 +268,75 @@ class HistoryLastResponse(BaseModel):
     rows: List[HistoryResult]
 
 
+class CellStats(BaseModel):
+    """
+    Durations of a cell in the last runs of a workflow.
+
+    :param secs: duration in each run, from the oldest to the newest
+    """
+
+    ix: int
+    src: str
+    runs: int
+    mean_secs: float
+    max_secs: float
+    last_secs: float
+    secs: List[float]
+    peak_mb: Optional[float] = None
+
+
+class CellProfileResponse(BaseModel):
+    wfid: str
+    execids: List[str]
+    cells: List[CellStats]
+
+
+class CellCompare(BaseModel):
+    ix: int
+    src: str
+    base_secs: Optional[float] = None
+    other_secs: Optional[float] = None
+    delta_secs: Optional[float] = None
+    ratio: Optional[float] = None
+
+
+class CellCompareResponse(BaseModel):
+    base: str
+    other: str
+    cells: List[CellCompare]
+
+
+class TimelineResponse(BaseModel):
+    """Percentiles by phase of the timelines of the last executions"""
+
+    projectid: str
+    wfid: Optional[str] = None
+    execids: List[str]
+    phases: List[PhaseLatency]
+
+
 class WorkflowData(BaseModel):
     wfid: str
     alias: str
     nbtask: Dict[str, Any]
     enabled: bool = True
     schedule: Optional[ScheduleData] = None
+    depends_on: Optional[List[str]] = None
 
 
 class WorkflowDataWeb(BaseModel):
+    """
+    :param depends_on: aliases of the workflows of the same project which
+    must succeed before this one runs. A workflow with dependencies is
+    triggered by its upstreams instead of by its schedule.
+    """
+
     alias: str
     nbtask: NBTask
     enabled: bool = True
     wfid: Optional[str] = None
     schedule: Optional[ScheduleData] = None
+    depends_on: List[str] = []
 
 
 @dataclass
@@ -175,3 +360,21 @@ class TaskStatus(BaseModel):
     started_ts: Optional[float] = None
     elapsed_secs: Optional[float] = None
     result: Optional[Dict[str, Any]] = None
+
+
+class TaskBatchRequest(BaseModel):
+    """
+    :param execids: tasks to look up
+    :param statuses: last status known by execid, if timeout is given
+    the request waits until some status changes.
+    :param timeout: secs to wait for changes, 0 returns immediately
+    """
+
+    execids: List[str]
+    statuses: Dict[str, str] = {}
+    timeout: int = 0
+
+
+class TaskBatchResponse(BaseModel):
+    tasks: Dict[str, Optional[TaskStatus]]
+    changed: List[str] = []
@@ -0,0 +1,61 @@
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+class DagNodeRef(BaseModel):
+    """
+    Result of a workflow inside of a DAG run. It is small on purpose,
+    downstreams receive it as the `UPSTREAM` param of the notebook
+    to find the outputs of their upstreams.
+    """
+
+    alias: str
+    wfid: str
+    execid: str
+    error: bool = False
+    output_dir: Optional[str] = None
+    output_name: Optional[str] = None
+
+
+class DagRun(BaseModel):
+    """
+    :param dagid: execid of the workflow which started the run
+    :param nodes: workflows finished by alias
+    :param triggered: aliases of the downstreams already enqueued
+    """
+
+    dagid: str
+    nodes: Dict[str, DagNodeRef] = {}
+    triggered: List[str] = []
+
+
+class MapPartitionRef(BaseModel):
+    """
+    Result of a partition of a map, the reduce notebook receives them as
+    the `MAP_RESULTS` param.
+    """
+
+    index: int
+    partition: Any
+    execid: str
+    output_dir: Optional[str] = None
+    output_name: Optional[str] = None
+
+
+class MapRun(BaseModel):
+    """
+    :param mapid: execid of the map
+    :param size: number of partitions
+    :param pending: partitions not started yet
+    :param results: partitions finished ok by index
+    :param tries: failures by index
+    :param failed: partitions without retries left
+    """
+
+    mapid: str
+    size: int
+    pending: List[int] = []
+    results: Dict[int, MapPartitionRef] = {}
+    tries: Dict[int, int] = {}
+    failed: List[int] = []
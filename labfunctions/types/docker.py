@@ -23,6 +23,7 @@ class DockerBuildLog(BaseModel):
 class DockerResources(BaseModel):
     mem_limit: Optional[int] = None
     mem_reservation: Optional[int] = None
+    nano_cpus: Optional[int] = None
 
 
 class DockerVolume(BaseModel):
@@ -0,0 +1,111 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class LaneStats(BaseModel):
+    """
+    Queue wait of the jobs dispatched from a priority lane.
+    Waits are in secs and percentiles are computed over the last
+    samples kept in redis.
+
+    :param priority: name of the lane
+    :param pending: jobs waiting in the lane
+    :param projects: projects with jobs waiting in the lane
+    :param dispatched: total of jobs dispatched from the lane
+    """
+
+    priority: str
+    pending: int = 0
+    projects: int = 0
+    dispatched: int = 0
+    wait_avg: Optional[float] = None
+    wait_p50: Optional[float] = None
+    wait_p95: Optional[float] = None
+    wait_max: Optional[float] = None
+
+
+class QueueStats(BaseModel):
+    """
+    :param depth: jobs waiting in the queue
+    :param oldest_age: secs waiting of the oldest job
+    :param workers: workers listening to the queue
+    """
+
+    qname: str
+    lanes: List[LaneStats] = []
+    depth: int = 0
+    oldest_age: Optional[float] = None
+    workers: int = 0
+
+
+class QueueLimits(BaseModel):
+    """
+    Admission limits of a queue, enqueues over them are rejected.
+    0 means unlimited.
+
+    :param max_depth: max jobs waiting
+    :param max_age: max secs waiting of the oldest job
+    :param require_workers: reject if nobody is listening to the queue,
+    keep it disabled if machines are created on demand.
+    :param retry_after: secs suggested to the client before retrying
+    """
+
+    max_depth: int = 0
+    max_age: int = 0
+    require_workers: bool = False
+    retry_after: int = 30
+
+
+class PhaseLatency(BaseModel):
+    """
+    Latency of one phase of the dispatch path or of the timeline of the
+    executions (see `labfunctions.timeline`), in secs.
+
+    :param phase: enqueue, queue_wait, dequeue_to_start, registration or
+    total for the dispatch path
+    :param count: samples measured
+    """
+
+    phase: str
+    count: int = 0
+    p50: Optional[float] = None
+    p95: Optional[float] = None
+    p99: Optional[float] = None
+    max: Optional[float] = None
+
+
+class DispatchBenchResult(BaseModel):
+    """
+    :param submissions: notebooks enqueued
+    :param concurrency: submissions in flight at the same time
+    :param completed: executions finished ok before the timeout
+    :param elapsed: secs from the first submission to the last result
+    """
+
+    qname: str
+    submissions: int
+    concurrency: int
+    completed: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+    phases: List[PhaseLatency] = []
+
+
+class CodecBenchResult(BaseModel):
+    """
+    Cost of a payload codec for the context of notebook jobs.
+
+    :param payload_bytes: mean size of the job payload stored in redis
+    :param encode_us: mean microsecs to pack a context
+    :param decode_us: mean microsecs to unpack and validate a context
+    :param depth: jobs written to redis to measure its memory
+    :param redis_bytes: memory used by redis for `depth` jobs
+    """
+
+    codec: str
+    payload_bytes: int
+    encode_us: float
+    decode_us: float
+    depth: int = 0
+    redis_bytes: Optional[int] = None
@@ -13,3 +13,26 @@ class WFCreateRsp(BaseModel):
 class WFPushRsp(BaseModel):
     created: Optional[List[WFCreateRsp]] = []
     errors: Optional[List[WFCreateRsp]] = []
+
+
+class ReconcileReport(BaseModel):
+    """
+    Drift found between the workflows in the database and the periodic
+    jobs registered in the scheduler.
+
+    :param scanned: enabled workflows read from the database
+    :param created: workflows without job
+    :param updated: workflows whose job was outdated
+    :param rescheduled: jobs which weren't in their scheduler partition
+    :param removed: jobs of workflows deleted, disabled or not periodic
+    :param dry_run: if true the drift was only reported
+    """
+
+    scanned: int = 0
+    unchanged: int = 0
+    created: List[str] = []
+    updated: List[str] = []
+    rescheduled: List[str] = []
+    removed: List[str] = []
+    dry_run: bool = False
+    elapsed: float = 0.0
@@ -28,6 +28,17 @@ async def cluster_get_spec(request):
     return json(clusters)
 
 
+@clusters_bp.get("/_queues")
+@openapi.response(200, {"application/json": List[types.QueueStats]}, "Queues")
+@protected(scopes=["agent:rw", "admin:r:w"], require_all=False)
+async def cluster_queues_list(request):
+    """Depth and oldest job age of each {cluster}.{machine} queue"""
+    scheduler = get_scheduler2(request)
+    qnames = await scheduler.list_queues()
+    stats = [(await scheduler.queue_stats(q)).dict() for q in qnames]
+    return json(stats)
+
+
 @clusters_bp.post("/")
 @openapi.body({"application/json": cluster.CreateRequest})
 @protected(scopes=["agent:rw", "admin:r:w"], require_all=False)
@@ -79,3 +90,15 @@ async def cluster_instances_list(request, cluster_name):
     cc = get_cluster(request)
     instances = await cc.list_instances(cluster_name)
     return json(instances)
+
+
+@clusters_bp.get("/<cluster_name>/<machine>/_queue")
+@openapi.parameter("cluster_name", str, "path")
+@openapi.parameter("machine", str, "path")
+@openapi.response(200, {"application/json": types.QueueStats}, "Queue stats")
+@protected(scopes=["agent:rw", "admin:r:w"], require_all=False)
+async def cluster_queue_stats(request, cluster_name, machine):
+    """Jobs waiting and queue wait by priority lane"""
+    scheduler = get_scheduler2(request)
+    stats = await scheduler.queue_stats(f"{cluster_name}.{machine}")
+    return json(stats.dict())
@@ -5,21 +5,54 @@ from dataclasses import asdict
 
 import httpx
 from sanic import Blueprint
-from sanic.response import json
+from sanic.response import empty, json
 from sanic_ext import openapi
 
-from labfunctions import defaults
+from labfunctions import defaults, timeline
 from labfunctions.conf.server_settings import settings
+from labfunctions.control.scheduler import changed_tasks
 from labfunctions.defaults import API_VERSION
+from labfunctions.events import EventManager
+from labfunctions.io.streams import (
+    ENCODINGS,
+    StreamDecodeError,
+    StreamTooLarge,
+    decode_stream,
+)
 from labfunctions.managers import history_mg
 from labfunctions.managers.users_mg import inject_user
 from labfunctions.security.web import protected
-from labfunctions.types import ExecutionResult, HistoryRequest, NBTask
+from labfunctions.types import (
+    CellCompareResponse,
+    CellProfileResponse,
+    ExecutionResult,
+    HistoryRequest,
+    NBTask,
+    ResourceUsage,
+    TaskBatchRequest,
+    TaskBatchResponse,
+    TimelineResponse,
+)
+from labfunctions.types.events import EventSSE
 from labfunctions.utils import today_string
-from labfunctions.web.utils import get_kvstore, get_query_param2, get_scheduler2
+from labfunctions.web.utils import (
+    get_kvstore,
+    get_query_param2,
+    get_scheduler2,
+    stream_reader,
+)
 
 history_bp = Blueprint("history", url_prefix="history", version=API_VERSION)
 
+
+async def _discard(kv_store, key: str):
+    """It removes what was written of a failed upload, if anything"""
+    try:
+        await kv_store.delete(key)
+    except Exception:  # pylint: disable=broad-except
+        pass
+
+
 # async def validate_project(request):
 #     request.ctx.user = await extract_user_from_request(request)
 
@@ -33,10 +66,24 @@ async def history_create(request):
     # pylint: disable=unused-argument
     dict_ = request.json
     exec_result = ExecutionResult(**dict_)
+    if exec_result.timeline is not None:
+        timeline.mark(exec_result.timeline, "registered")
 
     session = request.ctx.session
+    scheduler = get_scheduler2(request)
     async with session.begin():
         hm = await history_mg.create(session, exec_result)
+        await scheduler.on_workflow_result(session, exec_result)
+    await scheduler.memo.put(exec_result)
+    if exec_result.timeline:
+        evt = EventSSE(
+            data=std_json.dumps(timeline.phases(exec_result.timeline)),
+            event="timeline",
+        )
+        channel = EventManager.generate_channel(
+            exec_result.projectid, exec_result.execid
+        )
+        await request.ctx.events.publish(channel, evt)
 
     return json(dict(msg="created"), 201)
 
@@ -78,6 +125,123 @@ async def history_detail_job(request, projectid: str, execid: str):
         return json(dict(msg="not found"), 404)
 
 
+@history_bp.get("/<projectid>/dag/<dagid>")
+@openapi.parameter("projectid", str, "path")
+@openapi.parameter("dagid", str, "path")
+@openapi.response(200, "Found")
+@openapi.response(404, dict(msg=str), "Not Found")
+@protected()
+async def history_dag_run(request, projectid: str, dagid: str):
+    """Executions of the workflows of a DAG run"""
+    # pylint: disable=unused-argument
+    session = request.ctx.session
+    async with session.begin():
+        h = await history_mg.get_by_dagid(session, projectid, dagid)
+    if h.rows:
+        return json(h.dict(), 200)
+    return json(dict(msg="not found"), 404)
+
+
+@history_bp.get("/<projectid>/_profile/<wfid>")
+@openapi.parameter("projectid", str, "path")
+@openapi.parameter("wfid", str, "path")
+@openapi.parameter("lt", int, "lt")
+@openapi.parameter("top", int, "top")
+@openapi.response(200, CellProfileResponse, "Found")
+@openapi.response(400, dict(msg=str), "Wrong params")
+@openapi.response(404, dict(msg=str), "Not Found")
+@protected()
+async def history_profile(request, projectid: str, wfid: str):
+    """Slowest cells of the last runs of a workflow"""
+    # pylint: disable=unused-argument
+    try:
+        lt = int(get_query_param2(request, "lt", 10))
+        top = int(get_query_param2(request, "top", 10))
+    except ValueError:
+        return json(dict(msg="lt and top should be integers"), 400)
+    session = request.ctx.session
+    async with session.begin():
+        h = await history_mg.get_last(session, projectid, wfid, limit=lt)
+    profile = history_mg.cell_stats(wfid, [r.result for r in h.rows], top=top)
+    if not profile.cells:
+        return json(dict(msg="not found"), 404)
+    return json(profile.dict(), 200)
+
+
+@history_bp.get("/<projectid>/_compare/<execid>/<other>")
+@openapi.parameter("projectid", str, "path")
+@openapi.parameter("execid", str, "path")
+@openapi.parameter("other", str, "path")
+@openapi.response(200, CellCompareResponse, "Found")
+@openapi.response(404, dict(msg=str), "Not Found")
+@protected()
+async def history_compare(request, projectid: str, execid: str, other: str):
+    """Durations of the cells of two executions"""
+    # pylint: disable=unused-argument
+    session = request.ctx.session
+    async with session.begin():
+        base_h = await history_mg.get_one(session, execid)
+        other_h = await history_mg.get_one(session, other)
+    found = [
+        h.result
+        for h in (base_h, other_h)
+        if h and h.result and h.result.projectid == projectid
+    ]
+    if len(found) != 2:
+        return json(dict(msg="not found"), 404)
+    return json(history_mg.compare_cells(*found).dict(), 200)
+
+
+@history_bp.get("/<projectid>/_timeline")
+@openapi.parameter("projectid", str, "path")
+@openapi.parameter("wfid", str, "query")
+@openapi.parameter("lt", int, "lt")
+@openapi.response(200, TimelineResponse, "Found")
+@openapi.response(400, dict(msg=str), "Wrong params")
+@openapi.response(404, dict(msg=str), "Not Found")
+@protected()
+async def history_timeline(request, projectid: str):
+    """Percentiles by phase of the timelines of the last executions"""
+    # pylint: disable=unused-argument
+    try:
+        lt = int(get_query_param2(request, "lt", 100))
+    except ValueError:
+        return json(dict(msg="lt should be an integer"), 400)
+    wfid = get_query_param2(request, "wfid", None)
+    session = request.ctx.session
+    async with session.begin():
+        h = await history_mg.get_last(session, projectid, wfid, limit=lt)
+    results = [r.result for r in h.rows if r.result and r.result.timeline]
+    if not results:
+        return json(dict(msg="not found"), 404)
+    samples = history_mg.timeline_samples(results)
+    rsp = TimelineResponse(
+        projectid=projectid,
+        wfid=wfid,
+        execids=[r.execid for r in results],
+        phases=[timeline.phase_latency(p, samples[p]) for p in timeline.PHASE_NAMES],
+    )
+    return json(rsp.dict(), 200)
+
+
+@history_bp.post("/<projectid>/_resources/<execid>")
+@openapi.parameter("projectid", str, "path")
+@openapi.parameter("execid", str, "path")
+@openapi.body({"application/json": ResourceUsage})
+@openapi.response(204, "Updated")
+@openapi.response(404, dict(msg=str), "Not Found")
+@protected()
+async def history_resources(request, projectid: str, execid: str):
+    """Usage of the container of an execution already registered"""
+    usage = ResourceUsage(**request.json)
+    session = request.ctx.session
+    async with session.begin():
+        found = await history_mg.set_resources(session, projectid, execid, usage)
+    if not found:
+        return json(dict(msg="not found"), 404)
+    return empty()
+
+
 @history_bp.get("/<projectid>/<wfid>")
 @openapi.parameter("projectid", str, "path")
 @openapi.parameter("wfid", str, "path")
@@ -146,6 +310,64 @@ async def history_output_fail(request, projectid):
     return json(dict(msg="OK"), 201)
 
 
+@history_bp.post("/<projectid>/_put_output", stream=True)
+@openapi.parameter("projectid", str, "path")
+@openapi.parameter("output_name", str, "query")
+@openapi.parameter("status", str, "query")
+@openapi.response(201, "Created")
+@openapi.response(400, "Invalid output name or status, or undecodable body")
+@openapi.response(413, "Output too large")
+@openapi.response(415, "Encoding not supported")
+@protected()
+async def history_put_output(request, projectid):
+    """
+    Upload an output notebook as a stream, it can be compressed with
+    any of `io.streams.ENCODINGS` as its Content-Encoding. It is stored
+    decompressed, by chunks, so the notebook is never fully in memory.
+    If the upload fails, what was written is removed.
+    """
+    # pylint: disable=unused-argument
+    output_name = get_query_param2(request, "output_name", None)
+    status = get_query_param2(request, "status", "ok")
+    if not output_name or "/" in output_name or status not in ("ok", "errors"):
+        return json(dict(msg="invalid output name or status"), 400)
+    encoding = request.headers.get("content-encoding", "identity")
+    if encoding not in ENCODINGS:
+        return json(dict(msg=f"encoding {encoding} not supported"), 415)
+
+    today = today_string(format_="day")
+    fp = pathlib.Path(projectid) / defaults.NB_OUTPUTS / status / today / output_name
+    kv_store = get_kvstore(request)
+    failed = []
+
+    async def stream():
+        # stores wrap the errors of the stream or don't raise them
+        try:
+            async for chunk in decode_stream(
+                stream_reader(request), encoding, max_size=settings.REQUEST_MAX_SIZE
+            ):
+                yield chunk
+        except (StreamTooLarge, StreamDecodeError) as e:
+            failed.append(e)
+            raise
+
+    error = None
+    try:
+        await kv_store.put_stream(str(fp), stream())
+    except Exception as e:  # pylint: disable=broad-except
+        error = e
+    if error or failed:
+        await _discard(kv_store, str(fp))
+    if failed and isinstance(failed[0], StreamTooLarge):
+        return json(dict(msg=str(failed[0])), 413)
+    if failed:
+        return json(dict(msg=f"invalid {encoding} data: {failed[0]}"), 400)
+    if error:
+        raise error
+
+    return json(dict(msg="OK"), 201)
+
+
 @history_bp.get("/<projectid>/_get_output")
 @openapi.parameter("projectid", str, "path")
 @openapi.parameter("file", str, "query")
@@ -179,3 +401,30 @@ async def history_get_task(request, execid):
         return json({"msg": "not found"}, 404)
 
     return json(task.dict(), 200)
+
+
+@history_bp.post("/task/_batch")
+@openapi.body({"application/json": TaskBatchRequest})
+@openapi.response(200, {"application/json": TaskBatchResponse}, "Tasks")
+@openapi.response(400, dict(msg=str), "Too many tasks")
+@protected()
+async def history_get_tasks(request):
+    """
+    Status of many tasks in one request. If a timeout is given, it waits
+    until the status of some task differs from `statuses`.
+    """
+    # pylint: disable=unused-argument
+    req = TaskBatchRequest(**request.json)
+    if len(req.execids) > defaults.TASK_BATCH_MAX:
+        return json({"msg": f"Max {defaults.TASK_BATCH_MAX} tasks by request"}, 400)
+
+    scheduler = get_scheduler2(request)
+    timeout = min(req.timeout, defaults.TASK_BATCH_MAX_WAIT)
+    if timeout > 0:
+        tasks = await scheduler.wait_tasks(
+            req.execids, statuses=req.statuses, timeout=timeout
+        )
+    else:
+        tasks = await scheduler.get_tasks(req.execids)
+    rsp = TaskBatchResponse(tasks=tasks, changed=changed_tasks(tasks, req.statuses))
+    return json(rsp.dict(), 200)
@@ -1,6 +1,7 @@
 from sanic import Blueprint, Request, Sanic
+from sanic.response import HTTPResponse, json
 
-from labfunctions import defaults
+from labfunctions import defaults, errors
 from labfunctions.cluster import ClusterControl
 from labfunctions.conf.server_settings import settings
 from labfunctions.control import JobManager, SchedulerExec
@@ -42,6 +43,15 @@ def get_kvstore(request: Request) -> AsyncKVSpec:
     return Sanic.get_app(request.app.name).ctx.kv_store
 
 
+def queue_full_response(e: errors.QueueFull) -> HTTPResponse:
+    """429 response with the time suggested to retry the enqueue"""
+    return json(
+        dict(msg=str(e), reason=e.reason, retry_after=e.retry_after),
+        429,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
 async def stream_reader(request: Request):
     """
     It's a wrapper to be used to yield response from a stream
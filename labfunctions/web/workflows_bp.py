@@ -8,8 +8,9 @@ from sanic import Blueprint, Sanic
 from sanic.response import json
 from sanic_ext import openapi
 
-from labfunctions import types
+from labfunctions import errors, types
 from labfunctions.conf.server_settings import settings
+from labfunctions.control.dag import validate_dag
 from labfunctions.defaults import API_VERSION
 from labfunctions.errors.generics import WorkflowRegisterError
 from labfunctions.managers import projects_mg, runtimes_mg, workflows_mg
@@ -21,7 +22,7 @@ from labfunctions.utils import (
     secure_filename,
 )
 
-from .utils import get_job_manager, get_scheduler2
+from .utils import get_job_manager, get_scheduler2, queue_full_response
 
 workflows_bp = Blueprint("workflows", url_prefix="workflows", version=API_VERSION)
 
@@ -46,6 +47,7 @@ def notebooks_list(request, projectid):
 @openapi.parameter("projectid", str, "path")
 @openapi.body({"application/json": types.NBTask})
 @openapi.response(202, types.ExecutionNBTask, "Notebook execution task")
+@openapi.response(429, {"msg": str, "retry_after": int}, "Queue full")
 @protected()
 async def notebooks_run(request, projectid):
     """
@@ -60,7 +62,14 @@ async def notebooks_run(request, projectid):
         return json(dict(msg="wrong params"), 400)
 
     scheduler = get_scheduler2(request)
-    nb_ctx = await scheduler.enqueue_notebook(session, projectid=projectid, task=task)
+    try:
+        # a memoized task can register its result
+        async with session.begin():
+            nb_ctx = await scheduler.enqueue_notebook(
+                session, projectid=projectid, task=task
+            )
+    except errors.QueueFull as e:
+        return queue_full_response(e)
     return json(nb_ctx.dict(), 202)
 
 
@@ -101,6 +110,8 @@ async def workflow_create(request, projectid):
 
     async with session.begin():
         try:
+            workflows = await workflows_mg.get_dag(session, projectid)
+            validate_dag(workflows, wfd)
             wfid = await workflows_mg.register(session, projectid, wfd)
             wfd.wfid = wfid
             if wfd.schedule:
@@ -112,6 +123,8 @@ async def workflow_create(request, projectid):
             #    await scheduler.schedule(projectid, wfid, wfd)
         except WorkflowRegisterError as e:
             return json(dict(msg="workflow already exist"), status=200)
+        except errors.WorkflowDagError as e:
+            return json(dict(msg=str(e)), status=400)
 
         return json(dict(wfid=wfid), status=201)
 
@@ -140,6 +153,8 @@ async def workflow_update(request, projectid):
 
     async with session.begin():
         try:
+            workflows = await workflows_mg.get_dag(session, projectid)
+            validate_dag(workflows, wfd)
             wfid = await workflows_mg.register(session, projectid, wfd, update=True)
             if wfd.schedule:
                 job_manager = get_job_manager(request)
@@ -150,6 +165,8 @@ async def workflow_update(request, projectid):
             #    await scheduler.schedule(projectid, wfid, wfd)
         except WorkflowRegisterError as e:
             return json(dict(msg=str(e)), status=503)
+        except errors.WorkflowDagError as e:
+            return json(dict(msg=str(e)), status=400)
 
         return json(dict(wfid=wfid), status=201)
 
@@ -196,19 +213,56 @@ async def workflow_get(request, projectid, wfid):
 @openapi.parameter("wfid", str, "path")
 @openapi.response(202, types.ExecutionNBTask)
 @openapi.response(404, {"msg": str})
+@openapi.response(429, {"msg": str, "retry_after": int}, "Queue full")
 @protected()
 async def workflow_enqueue(request, projectid, wfid):
     """Enqueue a worflow"""
     scheduler = get_scheduler2(request)
     session = request.ctx.session
     async with session.begin():
-        ctx = await scheduler.enqueue_workflow(session, projectid=projectid, wfid=wfid)
+        try:
+            ctx = await scheduler.enqueue_workflow(
+                session, projectid=projectid, wfid=wfid
+            )
+        except errors.QueueFull as e:
+            return queue_full_response(e)
         if ctx:
             return json(ctx.dict(), 202)
 
     return json(dict(msg=f"{wfid} not found for pid {projectid}"), 404)
 
 
+@workflows_bp.get("/<projectid>/_dag/<dagid>")
+@openapi.parameter("projectid", str, "path")
+@openapi.parameter("dagid", str, "path")
+@openapi.response(200, types.DagRun)
+@openapi.response(404, {"msg": str})
+@protected()
+async def workflow_dag_run(request, projectid, dagid):
+    """State of a run of workflows triggered by dependencies"""
+    scheduler = get_scheduler2(request)
+    run = await scheduler.dag_state(dagid).get()
+    if not run.nodes:
+        return json(dict(msg=f"{dagid} not found"), 404)
+    return json(run.dict(), 200)
+
+
+@workflows_bp.get("/<projectid>/_map/<mapid>")
+@openapi.parameter("projectid", str, "path")
+@openapi.parameter("mapid", str, "path")
+@openapi.response(200, types.MapRun)
+@openapi.response(404, {"msg": str})
+@protected()
+async def workflow_map_run(request, projectid, mapid):
+    """State of the partitions of a map"""
+    state = get_scheduler2(request).map_state(mapid)
+    mt = await state.spec()
+    if not mt or mt.projectid != projectid:
+        return json(dict(msg=f"{mapid} not found"), 404)
+    run = await state.get()
+    return json(run.dict(), 200)
+
+
 # @workflows_bp.post("/<projectid>/_ctx/<wfid>")
 # @openapi.parameter("projectid", str, "path")
 # @openapi.parameter("wfid", str, "path")
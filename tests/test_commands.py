@@ -0,0 +1,54 @@
+from pytest_mock import MockerFixture
+
+import docker
+from labfunctions.commands import RUNNING_STATUS, DockerCommand
+
+
+def test_commands_docker_run_cleanup(mocker: MockerFixture):
+    client = mocker.MagicMock()
+    stale = mocker.MagicMock(status="exited")
+    client.containers.get.return_value = stale
+    container = client.containers.run.return_value
+    container.wait.side_effect = Exception("timeout")
+    container.kill.side_effect = docker.errors.APIError("is not running")
+    container.logs.return_value = b"partial"
+    sampler = mocker.MagicMock()
+
+    result = DockerCommand(client).run(
+        "lab exec local", "lab:0.1", timeout=1, name="execid", sampler=sampler
+    )
+
+    assert result.status == -1
+    assert result.msg == "partial"
+    stale.remove.assert_called_once_with(force=True)
+    container.remove.assert_called_once_with(force=True)
+    sampler.stop.assert_called_once()
+
+
+def test_commands_docker_run_error(mocker: MockerFixture):
+    client = mocker.MagicMock()
+    client.containers.get.side_effect = docker.errors.NotFound("no such container")
+    container = client.containers.run.return_value
+    container.wait.return_value = {"StatusCode": 0}
+    container.logs.side_effect = docker.errors.APIError("logs failed")
+    sampler = mocker.MagicMock()
+
+    result = DockerCommand(client).run(
+        "lab exec local", "lab:0.1", name="execid", sampler=sampler
+    )
+
+    assert result.status == -3
+    container.remove.assert_called_once_with(force=True)
+    sampler.stop.assert_called_once()
+
+
+def test_commands_docker_run_running(mocker: MockerFixture):
+    client = mocker.MagicMock()
+    live = mocker.MagicMock(status="running")
+    client.containers.get.return_value = live
+
+    result = DockerCommand(client).run("lab exec local", "lab:0.1", name="execid")
+
+    assert result.status == RUNNING_STATUS
+    live.remove.assert_not_called()
+    client.containers.run.assert_not_called()
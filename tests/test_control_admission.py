@@ -0,0 +1,38 @@
+import pytest
+
+from labfunctions import errors, types
+from labfunctions.control.admission import check_admission
+
+
+def test_control_admission_ok():
+    stats = types.QueueStats(qname="default.cpu", depth=10, oldest_age=5, workers=1)
+    limits = types.QueueLimits(max_depth=100, max_age=60, require_workers=True)
+
+    check_admission(stats, limits)
+    check_admission(stats, types.QueueLimits())
+
+
+def test_control_admission_depth():
+    stats = types.QueueStats(qname="default.cpu", depth=100)
+    limits = types.QueueLimits(max_depth=100, retry_after=10)
+
+    with pytest.raises(errors.QueueFull) as e:
+        check_admission(stats, limits)
+    assert e.value.retry_after == 10
+
+
+def test_control_admission_age():
+    stats = types.QueueStats(qname="default.cpu", depth=1, oldest_age=300)
+    limits = types.QueueLimits(max_age=60, retry_after=10)
+
+    with pytest.raises(errors.QueueFull) as e:
+        check_admission(stats, limits)
+    assert e.value.retry_after == 240
+
+
+def test_control_admission_workers():
+    stats = types.QueueStats(qname="default.cpu", workers=0)
+    limits = types.QueueLimits(require_workers=True)
+
+    with pytest.raises(errors.QueueFull):
+        check_admission(stats, limits)
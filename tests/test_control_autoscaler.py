@@ -0,0 +1,138 @@
+from pathlib import Path
+
+import pytest
+from libq.types import Prefixes, WorkerInfo
+from libq.utils import now_iso
+
+from labfunctions.cluster import ClusterControl
+from labfunctions.cluster.types import ScalePolicy
+from labfunctions.conf.server_settings import settings
+from labfunctions.control import SchedulerExec
+from labfunctions.control.autoscaler import Autoscaler, scale_decision
+
+FUNC = "labfunctions.control.tasks.notebook_dispatcher"
+
+
+def test_control_autoscaler_decision_depth():
+    policy = ScalePolicy(min_nodes=0, max_nodes=3, items_per_node=5)
+    up = scale_decision(
+        "test", policy, nodes=1, inflight=0, depth=12, oldest_age=1, idle=[]
+    )
+    inflight = scale_decision(
+        "test", policy, nodes=1, inflight=2, depth=12, oldest_age=1, idle=[]
+    )
+    maxed = scale_decision(
+        "test", policy, nodes=1, inflight=0, depth=100, oldest_age=1, idle=[]
+    )
+
+    assert up.create == 2
+    assert up.reason == "depth"
+    assert inflight.create == 0
+    assert maxed.create == 2
+
+
+def test_control_autoscaler_decision_idle():
+    policy = ScalePolicy(min_nodes=1, max_nodes=3, cooldown_secs=60)
+    down = scale_decision(
+        "test",
+        policy,
+        nodes=3,
+        inflight=0,
+        depth=0,
+        oldest_age=None,
+        idle=["m1", "m2", "m3"],
+    )
+    cooldown = scale_decision(
+        "test",
+        policy,
+        nodes=3,
+        inflight=0,
+        depth=0,
+        oldest_age=None,
+        idle=["m1"],
+        since_last=10,
+    )
+    minimum = scale_decision(
+        "test",
+        policy,
+        nodes=0,
+        inflight=0,
+        depth=0,
+        oldest_age=None,
+        idle=[],
+        since_last=10,
+    )
+
+    assert down.destroy == ["m1", "m2"]
+    assert cooldown.destroy == []
+    assert minimum.create == 1
+
+
+def test_control_autoscaler_decision_wait():
+    policy = ScalePolicy(max_nodes=2, items_per_node=10, max_wait=60)
+    late = scale_decision(
+        "test", policy, nodes=1, inflight=0, depth=2, oldest_age=120, idle=[]
+    )
+
+    assert late.create == 1
+    assert late.reason == "max_wait"
+
+
+async def _register_worker(conn, wid, machine_id, tasks):
+    info = WorkerInfo(
+        id=wid,
+        birthday=now_iso(),
+        last_job=now_iso(),
+        queues=["local.cpu"],
+        completed=0,
+        failed=0,
+        running=len(tasks),
+        tasks_names=["heartbeat", "commands"] + tasks,
+        metadata={"machine_id": machine_id},
+    )
+    await conn.set(f"{Prefixes.worker.value}{wid}", info.json())
+    await conn.sadd(f"{Prefixes.queue_workers.value}local.cpu", wid)
+
+
+@pytest.mark.asyncio
+async def test_control_autoscaler_local(async_redis_web, tempdir, monkeypatch):
+    monkeypatch.setenv("LF_LCL_WORKING_DIR", tempdir)
+    conn = async_redis_web
+    cc = ClusterControl(
+        "tests/clusters_local_test.yaml",
+        ssh_user="op",
+        ssh_key_public_path="tests/dummy_rsa.pub",
+        conn=conn,
+    )
+    scheduler = SchedulerExec(conn, settings=settings)
+    scaler = Autoscaler(cc, scheduler)
+    Q = scheduler.fair_queue("local.cpu")
+    for x in range(3):
+        await Q.enqueue(FUNC, projectid="test", execid=f"ex{x}", timeout=10)
+
+    up = await scaler.run_once()
+    creations = await conn.smembers("lf.as::inflight:local")
+    # what the control queue worker does for each creation
+    machines = []
+    for execid in creations:
+        instance = cc.create_instance("local")
+        await cc.register_instance(instance, "local")
+        await conn.delete(f"{Prefixes.job.value}{execid}")
+        machines.append(instance)
+    for _ in range(3):
+        await Q.pop()
+    idle, busy = sorted(machines, key=lambda m: m.machine_name)
+    await _register_worker(conn, "w-idle", idle.machine_id, [])
+    await _register_worker(conn, "w-busy", busy.machine_id, ["ex2"])
+
+    down = await scaler.run_once()
+    cc.destroy_instance(down[0].destroy[0], cluster_name="local")
+
+    assert len(up) == 1
+    assert up[0].cluster_name == "local"
+    assert up[0].create == 2
+    assert len(creations) == 2
+    assert down[0].create == 0
+    assert down[0].destroy == [idle.machine_name]
+    assert not (Path(tempdir) / idle.machine_name).exists()
+    assert (Path(tempdir) / busy.machine_name).exists()
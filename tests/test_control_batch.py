@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+import pytest
+from libq.types import JobPayload
+from libq.utils import get_function
+from pydantic import ValidationError
+
+from labfunctions.control.agent import create_batcher
+from labfunctions.control.batch import Batcher, batch_meta
+from labfunctions.control.capacity import Capacity, requests_meta
+from labfunctions.types.agent import AgentConfig
+
+FUNC = "labfunctions.control.tasks.notebook_dispatcher"
+
+
+def double(items):
+    return [{"value": data * 2, "size": len(items)} for data in items]
+
+
+def _payload(data, meta=None, func_name=FUNC):
+    return JobPayload(
+        func_name=func_name,
+        timeout=10,
+        params={"data": data},
+        status=0,
+        queue="default.cpu",
+        created_ts=int(time.time()),
+        meta=meta,
+    )
+
+
+def test_control_batch_accepts():
+    batcher = Batcher(FUNC, "tests.test_control_batch.double", max_size=2)
+    meta = batch_meta("test", "lab:0.1")
+
+    assert batcher.accepts(_payload(1, meta))
+    assert not batcher.accepts(_payload(1, {"cpus": 1}))
+    assert not batcher.accepts(_payload(1, meta, func_name="other"))
+    assert not Batcher(FUNC, "double", max_size=1).accepts(_payload(1, meta))
+
+
+@pytest.mark.asyncio
+async def test_control_batch_submit():
+    batcher = Batcher(FUNC, "tests.test_control_batch.double", max_size=2, max_wait=0.2)
+    meta = batch_meta("test", "lab:0.1")
+    other = batch_meta("test", "lab:0.2")
+
+    started = time.time()
+    results = await asyncio.gather(
+        batcher.submit(_payload(1, meta)),
+        batcher.submit(_payload(2, other)),
+        batcher.submit(_payload(3, meta)),
+    )
+
+    assert [r.func_result["value"] for r in results] == [2, 4, 6]
+    # full group and group of one flushed after max_wait
+    assert [r.func_result["size"] for r in results] == [2, 1, 2]
+    assert time.time() - started >= 0.2
+    assert not batcher._pending and not batcher._timers
+
+
+@pytest.mark.asyncio
+async def test_control_batch_pool():
+    batcher = Batcher(FUNC, "tests.test_control_batch.double", max_size=2, max_wait=0.1)
+    meta = batch_meta("test", "lab:0.1")
+
+    first = await batcher.submit(_payload(1, meta))
+    pool = batcher._pool
+    second = await batcher.submit(_payload(2, meta))
+    reused = batcher._pool is pool
+    batcher.shutdown()
+
+    assert [first.func_result["value"], second.func_result["value"]] == [2, 4]
+    assert reused
+    assert batcher._pool is None
+
+
+@pytest.mark.asyncio
+async def test_control_batch_error():
+    batcher = Batcher(FUNC, "tests.test_control_batch.missing", max_size=2)
+    meta = batch_meta("test", "lab:0.1")
+
+    results = await asyncio.gather(
+        batcher.submit(_payload(1, meta)), batcher.submit(_payload(2, meta))
+    )
+
+    assert all(r.error for r in results)
+
+
+@pytest.mark.asyncio
+async def test_control_batch_capacity():
+    capacity = Capacity(4, 4096)
+    reserve = []
+
+    async def _reserve(key, cpus, memory_mb):
+        reserve.append((cpus, memory_mb))
+
+    capacity.reserve = _reserve
+    batcher = Batcher(
+        FUNC, "tests.test_control_batch.double", max_size=2, capacity=capacity
+    )
+    meta = batch_meta("test", "lab:0.1")
+
+    await asyncio.gather(
+        batcher.submit(_payload(1, {**meta, **requests_meta(1, 512)})),
+        batcher.submit(_payload(2, {**meta, **requests_meta(2, 256)})),
+    )
+
+    # once by group, with the largest requests
+    assert reserve == [(2.0, 512)]
+
+
+def _conf(**kwargs) -> AgentConfig:
+    return AgentConfig(
+        redis_dsn="redis://localhost:6379/0",
+        cluster="default",
+        qnames=["cpu"],
+        ip_address="127.0.0.1",
+        machine_id="gce://default/test",
+        heartbeat_ttl=60,
+        heartbeat_check_every=30,
+        **kwargs,
+    )
+
+
+def test_control_batch_agent():
+    batcher = create_batcher(_conf(workers_n=4, batch_size=2))
+
+    assert create_batcher(_conf()) is None
+    assert batcher.max_size == 2
+    assert get_function(batcher.func_name)
+    assert get_function(batcher.batch_func)
+    with pytest.raises(ValidationError):
+        _conf(workers_n=1, batch_size=2)
@@ -0,0 +1,27 @@
+import pytest
+
+from labfunctions.conf.server_settings import settings
+from labfunctions.control.bench import DispatchBench
+from labfunctions.hashes import generate_random
+
+
+@pytest.mark.asyncio
+async def test_control_bench_dispatch(sanic_app, access_token):
+    bench = DispatchBench(
+        sanic_app,
+        settings.QUEUE_REDIS,
+        settings=settings,
+        token=access_token,
+        projectid="test",
+        qname=f"bench{generate_random(size=5)}.cpu",
+        max_jobs=2,
+    )
+    result = await bench.run(4, concurrency=2, timeout=30)
+    phases = {p.phase: p for p in result.phases}
+
+    assert result.completed == 4
+    assert result.failed == 0
+    assert phases["enqueue"].count == 4
+    assert phases["dequeue_to_start"].count == 4
+    assert phases["registration"].count == 4
+    assert phases["total"].p99 >= phases["queue_wait"].p99
@@ -0,0 +1,89 @@
+import asyncio
+
+import orjson
+import pytest
+from libq.types import Prefixes
+
+from labfunctions.control.capacity import Capacity, job_requests, requests_meta
+from labfunctions.control.worker import FairWorker
+from labfunctions.executors.nbtask_base import task_resources
+from labfunctions.hashes import generate_random
+
+from .factories import ExecutionNBTaskFactory
+
+
+def test_control_capacity_requests():
+    ctx = ExecutionNBTaskFactory(runtime="lab:0.1", cpus=1.5, memory_mb=512)
+    resources = task_resources(ctx)
+
+    assert requests_meta(None, None) == {}
+    assert job_requests(requests_meta(2, 1024)) == (2.0, 1024)
+    assert job_requests(None) == (0.0, 0)
+    assert resources.nano_cpus == 1_500_000_000
+    assert resources.mem_limit == 512 * 2**20
+
+
+@pytest.mark.asyncio
+async def test_control_capacity_reserve():
+    capacity = Capacity(4, 4096)
+    await capacity.reserve("big", 3, 1024)
+    waiting = asyncio.create_task(capacity.reserve("second", 2, 1024))
+    await asyncio.sleep(0.05)
+    blocked = not waiting.done()
+    stats = capacity.stats()
+    capacity.release("big")
+    await asyncio.wait_for(waiting, 1)
+
+    assert blocked
+    assert stats.free_cpus == 1
+    assert stats.free_memory_mb == 3072
+    assert capacity.stats().running == 1
+    # a task larger than the agent runs alone
+    capacity.release("second")
+    await asyncio.wait_for(capacity.reserve("huge", 8, 1024), 1)
+
+
+@pytest.mark.asyncio
+async def test_control_capacity_worker(async_redis_web):
+    conn = async_redis_web
+    qname = f"{generate_random(6)}.cpu"
+    worker = FairWorker(
+        qname,
+        conn=conn,
+        id=generate_random(6),
+        max_jobs=5,
+        handle_signals=False,
+        capacity=Capacity(4, 4096),
+    )
+
+    async def run_job(execid, qname):
+        await done[execid].wait()
+        await worker.unlock_job(execid)
+
+    worker.run_job = run_job
+    jobs = {"j1": 3, "j2": 2, "j3": 1}
+    ids = {name: generate_random(10) for name in jobs}
+    done = {execid: asyncio.Event() for execid in ids.values()}
+    for name, cpus in jobs.items():
+        data = {"meta": requests_meta(cpus, 256)}
+        await conn.set(f"{Prefixes.job.value}{ids[name]}", orjson.dumps(data))
+
+    await worker.start_job(ids["j1"], qname)
+    second = asyncio.create_task(worker.start_job(ids["j2"], qname))
+    await asyncio.sleep(0.05)
+    running = set(worker.tasks)
+    await worker.register()
+    info = await worker.info()
+
+    done[ids["j1"]].set()
+    await asyncio.wait_for(second, 1)
+    await worker.start_job(ids["j3"], qname)
+    for name in ["j2", "j3"]:
+        done[ids[name]].set()
+    await asyncio.gather(*worker.tasks.values())
+    await worker.unregister()
+
+    assert running == {ids["j1"]}
+    assert info.metadata["resources"]["free_cpus"] == 1
+    assert set(worker.tasks) == set(ids.values())
+    assert worker.capacity.reserved == {}
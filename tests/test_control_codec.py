@@ -0,0 +1,88 @@
+import pytest
+from libq import serializers
+from libq.types import Prefixes
+
+from labfunctions.conf.server_settings import settings
+from labfunctions.control import SchedulerExec
+from labfunctions.control.bench import CodecBench
+from labfunctions.control.codec import (
+    expand_ctx,
+    get_codec,
+    pack_ctx,
+    slim_ctx,
+    unpack_ctx,
+)
+from labfunctions.notebooks import create_notebook_ctx
+
+from .factories import ExecutionNBTaskFactory, NBTaskFactory
+
+
+def _ctx():
+    task = NBTaskFactory(params={"ALPHA": 0.5, "UPSTREAM": {"a": {"error": False}}})
+    return create_notebook_ctx("test", task, wfid="wfid-test")
+
+
+def test_control_codec_slim():
+    ctx = _ctx()
+    moved = ctx.copy(update={"pm_output": "elsewhere.ipynb"})
+    moved.params["NOW"] = "user value"
+    other = ExecutionNBTaskFactory(runtime="docker")
+
+    slim = slim_ctx(ctx)
+    slim_moved = slim_ctx(moved)
+
+    assert "pm_output" not in slim
+    assert "output_dir" not in slim
+    assert "EXECID" not in slim["params"]
+    assert slim_moved["pm_output"] == "elsewhere.ipynb"
+    assert slim_moved["params"]["NOW"] == "user value"
+    assert expand_ctx(slim) == ctx
+    assert expand_ctx(slim_moved) == moved
+    assert expand_ctx(slim_ctx(other)) == other
+
+
+@pytest.mark.parametrize("codec", ["json", "msgpack", "msgpack+zstd"])
+def test_control_codec_roundtrip(codec):
+    if codec != "json":
+        pytest.importorskip("msgpack")
+    if codec.endswith("zstd"):
+        pytest.importorskip("zstandard")
+    ctx = _ctx()
+
+    data = pack_ctx(ctx, codec)
+
+    assert unpack_ctx(data) == ctx
+    assert get_codec(codec).name == codec
+    if codec != "json":
+        assert set(data) == {"codec", "blob"}
+        assert '"' not in data["blob"]
+
+
+def test_control_codec_not_found():
+    with pytest.raises(KeyError):
+        get_codec("pickle")
+
+
+@pytest.mark.asyncio
+async def test_control_codec_enqueue(async_redis_web):
+    pytest.importorskip("msgpack")
+    conf = settings.copy(update={"PAYLOAD_CODEC": "msgpack"})
+    scheduler = SchedulerExec(async_redis_web, settings=conf)
+    task = NBTaskFactory(machine="cpu", cluster="local")
+
+    ctx = await scheduler.enqueue_notebook(None, projectid="test", task=task)
+    raw = await async_redis_web.get(f"{Prefixes.job.value}{ctx.execid}")
+    payload = serializers.job_deserializer(raw)
+
+    assert payload.params["data"]["codec"] == "msgpack"
+    assert unpack_ctx(payload.params["data"]) == ctx
+
+
+@pytest.mark.asyncio
+async def test_control_codec_bench():
+    bench = CodecBench(settings.QUEUE_REDIS, depth=50, samples=10, codecs=["json"])
+    results = await bench.run()
+
+    assert results[0].codec == "json"
+    assert results[0].payload_bytes > 0
+    assert results[0].redis_bytes is not None
@@ -0,0 +1,89 @@
+import pytest
+
+from labfunctions import errors
+from labfunctions.conf.server_settings import settings
+from labfunctions.control import SchedulerExec
+from labfunctions.control.dag import find_cycle, validate_dag
+from labfunctions.hashes import generate_random
+from labfunctions.managers import workflows_mg
+
+from .factories import ExecutionResultFactory, WorkflowDataWebFactory
+
+
+def _dag(**deps):
+    return {
+        alias: WorkflowDataWebFactory(alias=alias, depends_on=ups)
+        for alias, ups in deps.items()
+    }
+
+
+def test_control_dag_find_cycle():
+    ok = _dag(a=[], b=["a"], c=["a"], d=["b", "c"])
+    cycle = _dag(a=["c"], b=["a"], c=["b"])
+
+    assert find_cycle(ok) is None
+    assert find_cycle(cycle) == ["a", "c", "b", "a"]
+
+
+def test_control_dag_validate():
+    workflows = _dag(a=[], b=["a"])
+    new = WorkflowDataWebFactory(alias="c", depends_on=["b"])
+    missing = WorkflowDataWebFactory(alias="c", depends_on=["x"])
+    loop = WorkflowDataWebFactory(wfid=workflows["a"].wfid, alias="a", depends_on=["b"])
+
+    validate_dag(workflows, new)
+    with pytest.raises(errors.WorkflowDagError):
+        validate_dag(workflows, missing)
+    with pytest.raises(errors.WorkflowDagError):
+        validate_dag(workflows, loop)
+
+
+@pytest.mark.asyncio
+async def test_control_dag_trigger(async_session, async_redis_web):
+    projectid = generate_random(10)
+    scheduler = SchedulerExec(async_redis_web, settings=settings)
+    wfids = {}
+    for alias, ups in dict(a=[], b=["a"], c=["a"], d=["b", "c"]).items():
+        wfd = WorkflowDataWebFactory(alias=alias, depends_on=ups)
+        wfids[alias] = await workflows_mg.register(async_session, projectid, wfd)
+
+    def _result(alias, **kwargs):
+        return ExecutionResultFactory(
+            projectid=projectid, wfid=wfids[alias], dagid="dag0", **kwargs
+        )
+
+    after_a = await scheduler.on_workflow_result(async_session, _result("a"))
+    after_b = await scheduler.on_workflow_result(async_session, _result("b"))
+    after_c = await scheduler.on_workflow_result(async_session, _result("c"))
+    again_c = await scheduler.on_workflow_result(async_session, _result("c"))
+    run = await scheduler.dag_state("dag0").get()
+
+    assert sorted(ctx.wfid for ctx in after_a) == sorted([wfids["b"], wfids["c"]])
+    assert all(ctx.dagid == "dag0" for ctx in after_a)
+    assert after_b == []
+    assert len(after_c) == 1
+    assert after_c[0].wfid == wfids["d"]
+    assert set(after_c[0].params["UPSTREAM"]) == {"b", "c"}
+    assert again_c == []
+    assert run.triggered == ["b", "c", "d"]
+
+
+@pytest.mark.asyncio
+async def test_control_dag_upstream_failed(async_session, async_redis_web):
+    projectid = generate_random(10)
+    scheduler = SchedulerExec(async_redis_web, settings=settings)
+    a = await workflows_mg.register(
+        async_session, projectid, WorkflowDataWebFactory(alias="a")
+    )
+    await workflows_mg.register(
+        async_session, projectid, WorkflowDataWebFactory(alias="b", depends_on=["a"])
+    )
+    result = ExecutionResultFactory(
+        projectid=projectid, wfid=a, dagid="dag1", error=True
+    )
+
+    enqueued = await scheduler.on_workflow_result(async_session, result)
+    run = await scheduler.dag_state("dag1").get()
+
+    assert enqueued == []
+    assert run.nodes["a"].error
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from labfunctions.control.capacity import requests_meta
+from labfunctions.control.fairq import FairQueue, lane_for
+from labfunctions.control.worker import FairWorker
+
+FUNC = "labfunctions.control.tasks.notebook_dispatcher"
+
+
+def test_control_fairq_lane_for():
+    assert lane_for("high") == "high"
+    assert lane_for("urgent") == "normal"
+    assert lane_for(None) == "normal"
+
+
+@pytest.mark.asyncio
+async def test_control_fairq_share(async_redis_web):
+    fq = FairQueue("test.cpu", conn=async_redis_web)
+    for x in range(6):
+        await fq.enqueue(FUNC, projectid="backfill", execid=f"bf{x}", timeout=10)
+    await fq.enqueue(FUNC, projectid="hourly", execid="hr0", timeout=10)
+
+    popped = [await fq.pop() for _ in range(3)]
+    projects = [p[2] for p in popped]
+    pending = await fq.pending()
+
+    assert "hourly" in projects[:2]
+    assert pending == 4
+
+
+@pytest.mark.asyncio
+async def test_control_fairq_priority(async_redis_web):
+    fq = FairQueue("test.cpu", conn=async_redis_web)
+    await fq.enqueue(FUNC, projectid="test", execid="low0", priority="low", timeout=10)
+    await fq.enqueue(
+        FUNC, projectid="test", execid="high0", priority="high", timeout=10
+    )
+
+    execid, priority, _ = await fq.pop()
+    stats = await fq.stats()
+    lanes = {lane.priority: lane for lane in stats.lanes}
+
+    assert execid == "high0"
+    assert priority == "high"
+    assert lanes["high"].dispatched == 1
+    assert lanes["high"].wait_p50 is not None
+    assert lanes["low"].pending == 1
+
+
+@pytest.mark.asyncio
+async def test_control_fairq_max_running(async_redis_web):
+    fq = FairQueue("test.cpu", conn=async_redis_web, max_running={"test": 1})
+    await fq.enqueue(FUNC, projectid="test", execid="ex0", timeout=10)
+    await fq.enqueue(FUNC, projectid="test", execid="ex1", timeout=10)
+
+    first = await fq.pop()
+    blocked = await fq.pop()
+    released = await fq.release("ex0")
+    second = await fq.pop()
+
+    assert first[0] == "ex0"
+    assert blocked is None
+    assert released
+    assert not await fq.release("ex0")
+    assert second[0] == "ex1"
+    assert await fq.running("test") == 1
+
+
+@pytest.mark.asyncio
+async def test_control_fairq_lease(async_redis_web):
+    fq = FairQueue(
+        "test.cpu", conn=async_redis_web, max_running={"test": 1}, lease_grace=0
+    )
+    await fq.enqueue(FUNC, projectid="test", execid="ex0", timeout=1)
+    await fq.enqueue(FUNC, projectid="test", execid="ex1", timeout=1)
+
+    await fq.pop()
+    # the agent of ex0 died, its slot is reaped after the lease
+    blocked = await fq.pop()
+    await asyncio.sleep(1.1)
+    second = await fq.pop()
+
+    assert blocked is None
+    assert second[0] == "ex1"
+    assert not await fq.release("ex0")
+    assert await fq.running("test") == 1
+
+
+@pytest.mark.asyncio
+async def test_control_fairq_depth(async_redis_web):
+    fq = FairQueue("test.cpu", conn=async_redis_web)
+    empty_age = await fq.oldest_age()
+    await fq.enqueue(FUNC, projectid="test", execid="ex0", timeout=10)
+    await fq.enqueue(FUNC, projectid="test", execid="ex1", timeout=10)
+    await fq.pop()
+
+    stats = await fq.stats()
+
+    assert empty_age is None
+    assert stats.depth == 1
+    assert stats.oldest_age >= 0
+    assert stats.workers == 0
+
+
+@pytest.mark.asyncio
+async def test_control_fairq_fits(async_redis_web):
+    fq = FairQueue("test.cpu", conn=async_redis_web)
+    big = requests_meta(cpus=4, memory_mb=1024)
+    await fq.enqueue(FUNC, projectid="large", execid="big0", timeout=10, meta=big)
+    await fq.enqueue(FUNC, projectid="small", execid="sm0", timeout=10)
+
+    # the big job doesn't fit, it stays first in its lane
+    first = await fq.pop((2, 4096))
+    blocked = await fq.pop((2, 4096))
+    second = await fq.pop()
+
+    assert first[0] == "sm0"
+    assert blocked is None
+    assert second[0] == "big0"
+
+
+@pytest.mark.asyncio
+async def test_control_fairq_retry(async_redis_web):
+    fq = FairQueue("test.cpu", conn=async_redis_web, max_running={"test": 1})
+    worker = FairWorker("test.cpu", conn=async_redis_web, handle_signals=False)
+    await fq.enqueue(FUNC, projectid="test", execid="ex0", timeout=10, priority="high")
+    await fq.enqueue(FUNC, projectid="test", execid="ex1", timeout=10, priority="high")
+
+    await fq.pop()
+    await worker._set_retry_job("ex0", qname="test.cpu")
+    # back to its lane, behind ex1 and still under the cap of the project
+    order = [(await fq.pop())[0], await fq.pop()]
+
+    assert order == ["ex1", None]
+    assert await async_redis_web.llen(fq.jobs_key) == 0
+    assert await fq.pending("high") == 1
+    assert not await fq.requeue("ex0")
@@ -0,0 +1,132 @@
+import pytest
+
+from labfunctions.conf.server_settings import settings
+from labfunctions.control import SchedulerExec
+from labfunctions.hashes import generate_random
+from labfunctions.managers import history_mg, workflows_mg
+from labfunctions.types import MapSpec
+
+from .factories import ExecutionResultFactory, NBTaskFactory, WorkflowDataWebFactory
+
+
+def _scheduler(mocker, async_redis_web):
+    """A scheduler which keeps the children enqueued"""
+    scheduler = SchedulerExec(async_redis_web, settings=settings)
+    children = []
+    original = scheduler.enqueue_partition
+
+    async def enqueue_partition(session, mt, index):
+        ctx = await original(session, mt, index)
+        children.append(ctx)
+        return ctx
+
+    mocker.patch.object(scheduler, "enqueue_partition", new=enqueue_partition)
+    return scheduler, children
+
+
+def _result(ctx, error=False):
+    return ExecutionResultFactory(
+        projectid=ctx.projectid,
+        execid=ctx.execid,
+        wfid=ctx.wfid,
+        dagid=ctx.dagid,
+        params=ctx.params,
+        error=error,
+        output_name=ctx.output_name,
+    )
+
+
+@pytest.mark.asyncio
+async def test_control_fanout_reduce(mocker, async_session, async_redis_web):
+    scheduler, children = _scheduler(mocker, async_redis_web)
+    task = NBTaskFactory(
+        params={"A": 1},
+        map=MapSpec(partitions=["d1", "d2", "d3"], concurrency=2, reduce="sum"),
+    )
+
+    map_ctx = await scheduler.enqueue_notebook(
+        async_session, projectid=generate_random(10), task=task
+    )
+    started = await scheduler.map_state(map_ctx.execid).get()
+    after_0 = await scheduler.on_workflow_result(async_session, _result(children[0]))
+    after_1 = await scheduler.on_workflow_result(async_session, _result(children[1]))
+    after_2 = await scheduler.on_workflow_result(async_session, _result(children[2]))
+    again_2 = await scheduler.on_workflow_result(async_session, _result(children[2]))
+    run = await scheduler.map_state(map_ctx.execid).get()
+
+    assert map_ctx.execid.startswith("map")
+    assert started.pending == [2]
+    assert [c.params["PARTITION"] for c in children] == ["d1", "d2", "d3"]
+    assert all(c.params["MAPID"] == map_ctx.execid for c in children)
+    assert after_0 == [children[2]]
+    assert after_1 == []
+    assert len(after_2) == 1
+    reduce = after_2[0]
+    assert reduce.nb_name == "sum"
+    assert reduce.params["A"] == 1
+    assert "MAP_INDEX" not in reduce.params
+    assert [r["execid"] for r in reduce.params["MAP_RESULTS"]] == [
+        c.execid for c in children
+    ]
+    assert again_2 == []
+    assert sorted(run.results) == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_control_fanout_retries(mocker, async_session, async_redis_web):
+    scheduler, children = _scheduler(mocker, async_redis_web)
+    task = NBTaskFactory(
+        params={}, map=MapSpec(partitions=[1, 2, 3], concurrency=1, retries=1)
+    )
+
+    map_ctx = await scheduler.enqueue_notebook(
+        async_session, projectid=generate_random(10), task=task
+    )
+    retry = await scheduler.on_workflow_result(
+        async_session, _result(children[0], error=True)
+    )
+    failed = await scheduler.on_workflow_result(
+        async_session, _result(children[1], error=True)
+    )
+    run = await scheduler.map_state(map_ctx.execid).get()
+    h = await history_mg.get_one(async_session, map_ctx.execid)
+
+    assert len(children) == 2
+    assert retry == [children[1]]
+    assert children[1].params["MAP_INDEX"] == 0
+    assert children[1].execid != children[0].execid
+    assert failed == []
+    assert run.failed == [0]
+    assert run.pending == []
+    assert run.tries == {0: 2}
+    assert h.result.error
+
+
+@pytest.mark.asyncio
+async def test_control_fanout_dag(mocker, async_session, async_redis_web):
+    projectid = generate_random(10)
+    scheduler, children = _scheduler(mocker, async_redis_web)
+    task = NBTaskFactory(params={}, map=MapSpec(partitions=["x", "y"]))
+    mapped = WorkflowDataWebFactory(alias="mapped", nbtask=task.dict())
+    wfid = await workflows_mg.register(async_session, projectid, mapped)
+    down = await workflows_mg.register(
+        async_session,
+        projectid,
+        WorkflowDataWebFactory(alias="down", depends_on=["mapped"]),
+    )
+
+    map_ctx = await scheduler.enqueue_notebook(
+        async_session, projectid=projectid, task=task, wfid=wfid
+    )
+    after_x = await scheduler.on_workflow_result(async_session, _result(children[0]))
+    after_y = await scheduler.on_workflow_result(async_session, _result(children[1]))
+    dag = await scheduler.dag_state(map_ctx.dagid).get()
+    h = await history_mg.get_one(async_session, map_ctx.execid)
+
+    assert len(children) == 2
+    assert all(c.dagid == map_ctx.execid for c in children)
+    assert after_x == []
+    assert [ctx.wfid for ctx in after_y] == [down]
+    assert after_y[0].params["UPSTREAM"]["mapped"]["execid"] == map_ctx.execid
+    assert list(dag.nodes) == ["mapped"]
+    assert not h.result.error
@@ -0,0 +1,82 @@
+import pytest
+
+from labfunctions.conf.server_settings import settings
+from labfunctions.control import SchedulerExec
+from labfunctions.control.memo import MemoStore, memo_key
+from labfunctions.hashes import generate_random
+from labfunctions.managers import history_mg
+
+from .factories import (
+    ExecutionNBTaskFactory,
+    ExecutionResultFactory,
+    NBTaskFactory,
+    RuntimeDataFactory,
+)
+
+
+def test_control_memo_key():
+    runtime = RuntimeDataFactory()
+    ctx = ExecutionNBTaskFactory(runtime="lab:0.1", params={"A": 1, "NOW": "x"})
+    other_run = ExecutionNBTaskFactory(**{**ctx.dict(), "params": {"A": 1}})
+    other_params = ExecutionNBTaskFactory(**{**ctx.dict(), "params": {"A": 2}})
+    rebuilt = RuntimeDataFactory(**{**runtime.dict(), "created_at": "2022-01-01"})
+    mutable = RuntimeDataFactory(version="latest")
+
+    key = memo_key(ctx, runtime)
+
+    assert key == memo_key(other_run, runtime)
+    assert key != memo_key(other_params, runtime)
+    assert key != memo_key(ctx, rebuilt)
+    assert memo_key(ctx, None) is None
+    assert memo_key(ctx, mutable, ["latest"]) is None
+
+
+@pytest.mark.asyncio
+async def test_control_memo_store_ttl(async_redis_web):
+    store = MemoStore(async_redis_web, ttl="60s")
+    result = ExecutionResultFactory(memo_key=generate_random(8))
+    reused = ExecutionResultFactory(memo_key=result.memo_key, memo_of="nb0")
+
+    kept = await store.put(result)
+    ttl = await async_redis_web.ttl(store.key(result.projectid, result.memo_key))
+
+    assert kept
+    assert not await store.put(reused)
+    assert 0 < ttl <= 60
+    assert (await store.get(result.projectid, result.memo_key)).execid == result.execid
+
+
+@pytest.mark.asyncio
+async def test_control_memo_reuse(mocker, async_session, async_redis_web):
+    projectid = generate_random(10)
+    runtime = RuntimeDataFactory()
+    mocker.patch("labfunctions.control.scheduler.task_runtime", return_value=runtime)
+    scheduler = SchedulerExec(async_redis_web, settings=settings)
+    enqueue = mocker.spy(scheduler.fair_queue("default.cpu").__class__, "enqueue")
+    task = NBTaskFactory(memoize=True, params={"A": generate_random(6)})
+
+    first = await scheduler.enqueue_notebook(
+        async_session, projectid=projectid, task=task
+    )
+    done = ExecutionResultFactory(
+        projectid=projectid,
+        execid=first.execid,
+        memo_key=first.memo_key,
+        output_dir="outputs/ok/2022",
+        output_name="first.ipynb",
+    )
+    failed = ExecutionResultFactory(**{**done.dict(), "error": True})
+    kept_failed = await scheduler.memo.put(failed)
+    await scheduler.memo.put(done)
+    second = await scheduler.enqueue_notebook(
+        async_session, projectid=projectid, task=task
+    )
+    row = await history_mg.get_one(async_session, second.execid)
+
+    assert first.memo_key
+    assert not kept_failed
+    assert enqueue.call_count == 1
+    assert second.memo_key == first.memo_key
+    assert second.output_name == "first.ipynb"
+    assert row.result.memo_of == first.execid
+    assert row.result.output_dir == "outputs/ok/2022"
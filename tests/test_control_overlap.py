@@ -0,0 +1,48 @@
+from labfunctions.control.overlap import WorkflowLock
+from labfunctions.hashes import generate_random
+
+
+def test_control_overlap_skip(redis):
+    lock = WorkflowLock(redis, generate_random(), ttl=60)
+    first = lock.acquire(f"{lock.wfid}.ex1", "skip")
+    second = lock.acquire(f"{lock.wfid}.ex2", "skip")
+    lock.release(f"{lock.wfid}.ex1")
+    third = lock.acquire(f"{lock.wfid}.ex3", "skip")
+    lock.release(f"{lock.wfid}.ex3")
+
+    assert first.should_run
+    assert not second.should_run
+    assert second.previous == f"{lock.wfid}.ex1"
+    assert third.should_run
+    assert lock.running() is None
+
+
+def test_control_overlap_coalesce(redis):
+    lock = WorkflowLock(redis, generate_random(), ttl=60)
+    lock.acquire(f"{lock.wfid}.ex1", "coalesce")
+    second = lock.acquire(f"{lock.wfid}.ex2", "coalesce")
+    third = lock.acquire(f"{lock.wfid}.ex3", "coalesce")
+
+    nxt = lock.release(f"{lock.wfid}.ex1")
+    running = lock.running()
+    last = lock.release(nxt)
+
+    assert second.action == "coalesce"
+    assert third.action == "coalesce"
+    assert nxt == f"{lock.wfid}.ex3"
+    assert running == f"{lock.wfid}.ex3"
+    assert last is None
+
+
+def test_control_overlap_cancel(redis):
+    lock = WorkflowLock(redis, generate_random(), ttl=60)
+    lock.acquire(f"{lock.wfid}.ex1", "cancel")
+    second = lock.acquire(f"{lock.wfid}.ex2", "cancel")
+    old = lock.release(f"{lock.wfid}.ex1")
+
+    assert second.action == "cancel"
+    assert second.previous == f"{lock.wfid}.ex1"
+    assert lock.is_canceled(f"{lock.wfid}.ex1")
+    assert not lock.is_canceled(f"{lock.wfid}.ex2")
+    assert old is None
+    assert lock.running() == f"{lock.wfid}.ex2"
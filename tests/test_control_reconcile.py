@@ -0,0 +1,79 @@
+import pytest
+from libq.types import JobSchedule
+
+from labfunctions.control import JobManager
+from labfunctions.control.reconcile import Reconciler, next_run
+from labfunctions.hashes import generate_random
+from labfunctions.managers import workflows_mg
+
+from .factories import WorkflowDataWebFactory
+
+
+def _wfd(**kwargs):
+    wfd = WorkflowDataWebFactory(**kwargs)
+    wfd.schedule.interval = "10m"
+    wfd.schedule.cron = None
+    return wfd
+
+
+def test_control_reconcile_next_run():
+    interval = next_run(JobSchedule(interval=60))
+    cron = next_run(JobSchedule(cron="*/5 * * * *"))
+
+    assert interval > 0
+    assert cron > 0
+    assert next_run(JobSchedule()) is None
+    assert next_run(None) is None
+
+
+@pytest.mark.asyncio
+async def test_control_reconcile(async_session, async_redis_web):
+    conn = async_redis_web
+    projectid = generate_random(10)
+    jm = JobManager(conn, shards=4)
+    wfs = {
+        "ok": _wfd(alias="ok"),
+        "outdated": _wfd(alias="outdated"),
+        "missing": _wfd(alias="missing"),
+        "disabled": _wfd(alias="disabled", enabled=False),
+        "dependent": _wfd(alias="dependent", depends_on=["ok"]),
+    }
+    for wfd in wfs.values():
+        wfd.wfid = await workflows_mg.register(async_session, projectid, wfd)
+    for alias in ["ok", "outdated"]:
+        await jm.register_workflow(async_session, projectid=projectid, wd=wfs[alias])
+    # jobs which shouldn't exist: workflows deleted, disabled or with upstreams
+    for alias in ["disabled", "dependent"]:
+        wd = wfs[alias].copy(update={"enabled": True, "depends_on": []})
+        await jm.register_workflow(async_session, projectid=projectid, wd=wd)
+    deleted = _wfd(alias="deleted", wfid=generate_random(24))
+    await jm.register_workflow(async_session, projectid=projectid, wd=deleted)
+    # schedule lost for one of them and one changed in the db
+    await conn.zrem(jm.scheduler_for(wfs["ok"].wfid).jobs_key, wfs["ok"].wfid)
+    wfs["outdated"].schedule.interval = "1h"
+    await workflows_mg.register(async_session, projectid, wfs["outdated"], update=True)
+
+    ours = {wd.wfid for wd in wfs.values()} | {deleted.wfid}
+    dry = await Reconciler(jm, page_size=2, dry_run=True).run(async_session)
+    report = await Reconciler(jm, page_size=2).run(async_session)
+    again = await Reconciler(jm, page_size=2).run(async_session)
+    outdated = await jm.store.get(wfs["outdated"].wfid)
+    scheduled = [
+        await conn.zscore(jm.scheduler_for(wd.wfid).jobs_key, wd.wfid)
+        for wd in wfs.values()
+    ]
+
+    def _ours(wfids):
+        return sorted(ours & set(wfids))
+
+    assert dry.dry_run
+    assert _ours(dry.created) == _ours(report.created) == [wfs["missing"].wfid]
+    assert _ours(report.updated) == [wfs["outdated"].wfid]
+    assert _ours(report.rescheduled) == [wfs["ok"].wfid]
+    assert _ours(report.removed) == sorted(
+        [wfs["disabled"].wfid, wfs["dependent"].wfid, deleted.wfid]
+    )
+    assert outdated.schedule.interval == 3600
+    assert not again.created and not again.updated and not again.removed
+    assert not again.rescheduled
+    assert [s is not None for s in scheduled] == [True, True, True, False, False]
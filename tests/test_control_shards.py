@@ -0,0 +1,97 @@
+import pytest
+from libq.types import Prefixes
+from libq.utils import now_secs
+
+from labfunctions.control import JobManager
+from labfunctions.control.shards import (
+    HashRing,
+    ShardedScheduler,
+    partition_for,
+    partitions,
+)
+
+from .factories import WorkflowDataWebFactory
+
+
+def test_control_shards_partition_for():
+    one = partition_for("wfid", 1)
+    many = {partition_for(f"wf{x}", 8) for x in range(200)}
+
+    assert one == partitions(1)[0]
+    assert partition_for("wfid", 8) == partition_for("wfid", 8)
+    assert many == set(partitions(8))
+
+
+def test_control_shards_ring():
+    keys = [f"all.{x}" for x in range(64)]
+    ring3 = HashRing(["s1", "s2", "s3"])
+    ring2 = HashRing(["s1", "s2"])
+    before = {k: ring3.owner(k) for k in keys}
+    after = {k: ring2.owner(k) for k in keys}
+
+    moved = [k for k in keys if before[k] != after[k]]
+
+    assert set(before.values()) == {"s1", "s2", "s3"}
+    assert all(before[k] == "s3" for k in moved)
+    assert HashRing([]).owner("all.1") is None
+
+
+@pytest.mark.asyncio
+async def test_control_shards_rebalance(async_redis_web):
+    conn = async_redis_web
+    s1 = ShardedScheduler(conn, shards=8, member_id="s1", interval=10)
+    s2 = ShardedScheduler(conn, shards=8, member_id="s2", interval=10)
+    await s1.heartbeat()
+    await s2.heartbeat()
+
+    led1 = await s1.run_once()
+    led2 = await s2.run_once()
+    # s2 dies: its heartbeat gets old and its leases expire
+    await conn.zadd(s1.members_key, {"s2": now_secs() - 60})
+    for p in led2:
+        await conn.delete(s2.lease_key(p))
+    after = await s1.run_once()
+
+    assert led1 and led2
+    assert not set(led1) & set(led2)
+    assert set(led1) | set(led2) == set(partitions(8))
+    assert sorted(after) == sorted(partitions(8))
+
+
+@pytest.mark.asyncio
+async def test_control_shards_lease(async_redis_web):
+    s1 = ShardedScheduler(async_redis_web, shards=2, member_id="s1")
+    s2 = ShardedScheduler(async_redis_web, shards=2, member_id="s2")
+
+    taken = await s1.acquire("all.0")
+    renewed = await s1.acquire("all.0")
+    other = await s2.acquire("all.0")
+    await s2.release("all.0")
+    still = await async_redis_web.get(s1.lease_key("all.0"))
+
+    assert taken and renewed
+    assert not other
+    assert still == "s1"
+
+
+@pytest.mark.asyncio
+async def test_control_shards_tick(async_redis_web, async_session):
+    conn = async_redis_web
+    jm = JobManager(conn, shards=4)
+    wfd = WorkflowDataWebFactory()
+    wfd.schedule.interval = "10m"
+    await jm.register_workflow(async_session, projectid="test", wd=wfd)
+    partition = partition_for(wfd.wfid, 4)
+    sched = jm.scheduler_for(wfd.wfid)
+    qkey = f"{Prefixes.queue_jobs.value}{wfd.nbtask.cluster}.{wfd.nbtask.machine}"
+    first = await conn.llen(qkey)
+
+    s1 = ShardedScheduler(conn, shards=4, member_id="s1")
+    not_due = await s1.tick(partition)
+    await conn.zadd(sched.jobs_key, {wfd.wfid: now_secs() - 1})
+    due = await s1.tick(partition)
+
+    assert first == 1
+    assert not_due == 0
+    assert due == 1
+    assert await conn.llen(qkey) == 2
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from libq.jobs import Job
+
+from labfunctions.conf.server_settings import settings
+from labfunctions.control import SchedulerExec
+from labfunctions.control.scheduler import changed_tasks
+
+FUNC = "labfunctions.control.tasks.notebook_dispatcher"
+
+
+@pytest.mark.asyncio
+async def test_control_tasks_batch(async_redis_web):
+    scheduler = SchedulerExec(async_redis_web, settings=settings)
+    Q = scheduler.fair_queue("test.cpu")
+    await Q.enqueue(FUNC, projectid="test", execid="ex0", timeout=10)
+    await Q.enqueue(FUNC, projectid="test", execid="ex1", timeout=10)
+
+    tasks = await scheduler.get_tasks(["ex0", "ex1", "nope"])
+    changed = changed_tasks(tasks, {"ex0": "queued", "ex1": "running"})
+
+    assert tasks["ex0"].execid == "ex0"
+    assert tasks["ex0"].status == "queued"
+    assert tasks["nope"] is None
+    assert changed == ["ex1", "nope"]
+
+
+@pytest.mark.asyncio
+async def test_control_tasks_wait(async_redis_web):
+    scheduler = SchedulerExec(async_redis_web, settings=settings)
+    Q = scheduler.fair_queue("test.cpu")
+    await Q.enqueue(FUNC, projectid="test", execid="ex0", timeout=10)
+    statuses = {"ex0": "queued"}
+
+    async def run_later():
+        await asyncio.sleep(0.2)
+        job = Job("ex0", conn=async_redis_web)
+        await job.fetch()
+        await job.mark_running()
+
+    same = await scheduler.wait_tasks(
+        ["ex0"], statuses=statuses, timeout=0.3, poll_delay=0.1
+    )
+    _, tasks = await asyncio.gather(
+        run_later(),
+        scheduler.wait_tasks(["ex0"], statuses=statuses, timeout=5, poll_delay=0.1),
+    )
+
+    assert same["ex0"].status == "queued"
+    assert tasks["ex0"].status == "running"
@@ -0,0 +1,74 @@
+import json
+import os
+import tempfile
+
+from pytest_mock import MockerFixture
+
+from labfunctions import defaults
+from labfunctions.executors.batch import batch_handoff, parse_batch_logs, run_batch
+from labfunctions.executors.handoff import task_context, write_handoff
+from labfunctions.executors.nbtask_base import NBTaskDocker
+from labfunctions.types.docker import DockerRunResult
+
+from .factories import ExecutionNBTaskFactory
+
+
+def _task() -> int:
+    ctx = task_context()
+    assert defaults.EXECUTIONTASK_VAR not in os.environ
+    print(f"running {ctx['execid']} in {tempfile.gettempdir()}")
+    assert tempfile.gettempdir() == os.environ["TMPDIR"]
+    assert os.environ["SHARED"] == "yes"
+    return 0 if ctx["params"].get("ok") else 255
+
+
+def test_executors_batch_run(tempdir, capsys):
+    ctxs = [{"execid": "a", "params": {"ok": True}}, {"execid": "b", "params": {}}]
+    path = write_handoff(batch_handoff({"SHARED": "yes"}, ctxs), tempdir)
+
+    failed = run_batch(path, func=_task)
+    results = parse_batch_logs(f"noise\n{capsys.readouterr().out}")
+
+    assert failed == 1
+    assert results["a"]["status"] == 0
+    assert results["b"]["status"] == 255
+    assert "running a in" in results["a"]["logs"]
+    scratch = results["a"]["logs"].split(" in ")[1].strip()
+    assert not os.path.exists(scratch)
+
+
+def test_executors_batch_docker(mocker: MockerFixture, tempdir):
+    client = mocker.MagicMock()
+    client._addr = "http://localhost:8000"
+    client.projects_private_key.return_value = "priv"
+    creds = client.projects_agent_token.return_value.creds
+    creds.access_token, creds.refresh_token = "access", "refresh"
+    ctxs = [
+        ExecutionNBTaskFactory(runtime="lab:0.1", timeout=10, memory_mb=mb)
+        for mb in [128, 512, 256]
+    ]
+    logs = "\n".join(
+        f"lf-batch:{json.dumps(dict(execid=c.execid, status=s, elapsed=1.5, logs='x'))}"
+        for c, s in zip(ctxs[:2], [0, 255])
+    )
+    mocker.patch("labfunctions.executors.nbtask_base.DockerCommand.pull_image")
+    mocker.patch(
+        "labfunctions.executors.nbtask_base.DockerCommand.__init__", return_value=None
+    )
+    run = mocker.patch(
+        "labfunctions.executors.nbtask_base.DockerCommand.run",
+        return_value=DockerRunResult(msg=logs, status=-1),
+    )
+
+    results = NBTaskDocker(client, ctx_dir=tempdir).run_batch(ctxs)
+
+    assert [r.execid for r in results] == [c.execid for c in ctxs]
+    assert [r.error for r in results] == [False, True, True]
+    assert results[0].elapsed_secs == 1.5
+    assert "Batch ended" in results[2].error_msg
+    kwargs = run.call_args[1]
+    assert run.call_args[0][0] == "lab exec batch"
+    assert kwargs["timeout"] == 30
+    assert kwargs["resources"].mem_limit == 512 * 2**20
+    # the handoff file is removed
+    assert os.listdir(f"{tempdir}/lf-ctx") == []
@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+
+import nbformat
+import papermill as pm
+from pytest_mock import MockerFixture
+
+from labfunctions import defaults
+from labfunctions.executors.cell_cache import (
+    ENGINE_NAME,
+    cell_fingerprints,
+    checkpoints,
+    restore_namespace,
+    save_namespace,
+)
+from labfunctions.hashes import generate_random
+
+
+def _notebook(path: str, last="print(len(data), value)"):
+    nb = nbformat.v4.new_notebook()
+    nb.metadata["kernelspec"] = {
+        "name": "python3",
+        "language": "python",
+        "display_name": "Python 3",
+    }
+    nb.cells = [
+        nbformat.v4.new_code_cell("value = None", metadata={"tags": ["parameters"]}),
+        nbformat.v4.new_markdown_cell("# Load"),
+        nbformat.v4.new_code_cell(
+            "import pathlib\n"
+            "pathlib.Path(COUNTER).open('a').write('x')\n"
+            "data = [value] * 3",
+            metadata={"tags": [defaults.CELL_CHECKPOINT_TAG]},
+        ),
+        nbformat.v4.new_code_cell(last),
+    ]
+    nbformat.write(nb, path)
+    return nb
+
+
+def test_executors_cell_cache_fingerprints(tempdir):
+    nb = _notebook(f"{tempdir}/in.ipynb")
+    changed = _notebook(f"{tempdir}/in.ipynb", last="print(value)")
+    fps = cell_fingerprints(nb, "in")
+    nb.cells[0].source = "value = 2"
+
+    assert checkpoints(nb) == [2]
+    assert fps[0] == fps[1]
+    assert cell_fingerprints(changed, "in")[:3] == fps[:3]
+    assert cell_fingerprints(changed, "in")[3] != fps[3]
+    assert cell_fingerprints(nb, "in")[2] != fps[2]
+    assert cell_fingerprints(nb, "other")[0] != fps[0]
+
+
+def test_executors_cell_cache_namespace(mocker: MockerFixture, tempdir):
+    mocker.patch.dict(os.environ, {defaults.CACHE_DIR_VAR: tempdir})
+    name = generate_random(12)
+    ns = {"data": [1, 2], "_hidden": 1, "In": []}
+
+    skipped = save_namespace(ns, name)
+    not_kept = save_namespace({"lock": threading.Lock(), "data": 1}, f"{name}-lock")
+    restored = {}
+    found = restore_namespace(restored, name)
+
+    assert skipped == []
+    assert not_kept == ["lock"]
+    assert found
+    assert restored == {"data": [1, 2]}
+    assert not restore_namespace({}, f"{name}-lock")
+    assert not restore_namespace({}, name, valid_for_min=-1)
+
+
+def test_executors_cell_cache_resume(mocker: MockerFixture, tempdir):
+    conf = json.dumps(dict(strategy="local", valid_for_min=60))
+    cache_dir = f"{tempdir}/cache"
+    os.mkdir(cache_dir)
+    mocker.patch.dict(
+        os.environ, {defaults.CELL_CACHE_VAR: conf, defaults.CACHE_DIR_VAR: cache_dir}
+    )
+    counter = f"{tempdir}/counter"
+
+    def _run(value, now, **kwargs):
+        pm.execute_notebook(
+            f"{tempdir}/in.ipynb",
+            f"{tempdir}/out.ipynb",
+            parameters={"value": value, "COUNTER": counter, "NOW": now},
+            engine_name=ENGINE_NAME,
+        )
+        out = nbformat.read(f"{tempdir}/out.ipynb", as_version=4)
+        with open(counter) as f:
+            loads = len(f.read())
+        return loads, out.cells[-1].outputs[0]["text"].strip(), out
+
+    _notebook(f"{tempdir}/in.ipynb")
+    first = _run("a", "t1")
+    second = _run("a", "t2")
+    _notebook(f"{tempdir}/in.ipynb", last="print(value, NOW)")
+    edited = _run("a", "t3")
+    other = _run("b", "t4")
+
+    assert first[:2] == (1, "3 a")
+    assert second[:2] == (1, "3 a")
+    assert second[2].cells[4].metadata.get("lf_cached") is None
+    assert second[2].cells[3].metadata["lf_cached"]
+    assert edited[:2] == (1, "a t3")
+    assert other[:2] == (2, "b t4")
+    assert os.listdir(cache_dir)
@@ -0,0 +1,102 @@
+import os
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+from pytest_mock import MockerFixture
+
+from labfunctions.executors.creds import CredsCache, auth_failed, token_exp
+from labfunctions.executors.nbtask_base import NBTaskDocker
+from labfunctions.types.docker import DockerRunResult
+from labfunctions.types.user import AgentJWTResponse, JWTResponse
+
+from .factories import ExecutionNBTaskFactory
+
+
+def _token_rsp(exp: float) -> AgentJWTResponse:
+    access = jwt.encode({"usr": "agent", "exp": int(exp)}, "secret")
+    return AgentJWTResponse(
+        agent_name="agent",
+        creds=JWTResponse(access_token=access, refresh_token="refresh"),
+    )
+
+
+def test_executors_creds_private_key(mocker: MockerFixture, tempdir):
+    client = mocker.MagicMock()
+    client.projects_private_key.return_value = "priv"
+    other = mocker.MagicMock()
+
+    keys = [CredsCache(client, path=tempdir).private_key("p1") for _ in range(3)]
+    # shared with other processes by the folder
+    shared = CredsCache(other, path=tempdir).private_key("p1")
+    CredsCache(client, path=tempdir, key_ttl=0).private_key("p1")
+    folder = f"{tempdir}/lf-creds"
+
+    assert keys == ["priv"] * 3
+    assert shared == "priv"
+    assert not other.projects_private_key.called
+    assert client.projects_private_key.call_count == 2
+    assert stat.S_IMODE(os.stat(folder).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(f"{folder}/p1.json").st_mode) == 0o600
+
+
+def test_executors_creds_agent_token(mocker: MockerFixture, tempdir):
+    client = mocker.MagicMock()
+    client.projects_agent_token.return_value = _token_rsp(time.time() + 3600)
+    cache = CredsCache(client, path=tempdir, refresh_margin=600)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        tokens = list(pool.map(cache.agent_token, ["p1"] * 8))
+    calls_fresh = client.projects_agent_token.call_count
+
+    # near expiration it is taken again
+    client.projects_agent_token.return_value = _token_rsp(time.time() + 300)
+    cache.invalidate("p1")
+    cache.agent_token("p1")
+    client.projects_agent_token.return_value = _token_rsp(time.time() + 3600)
+    refreshed = cache.agent_token("p1")
+
+    assert calls_fresh == 1
+    assert all(t.creds.refresh_token == "refresh" for t in tokens)
+    assert client.projects_agent_token.call_count == 3
+    assert token_exp(refreshed.creds.access_token) > time.time() + 3000
+
+
+def test_executors_creds_agent_token_timeout(mocker: MockerFixture, tempdir):
+    client = mocker.MagicMock()
+    client.projects_agent_token.return_value = _token_rsp(time.time() + 4 * 3600)
+    cache = CredsCache(client, path=tempdir, refresh_margin=600)
+
+    cache.agent_token("p1", timeout=3600)
+    cache.agent_token("p1", timeout=3600)
+    short_calls = client.projects_agent_token.call_count
+    # the cached token doesn't last a task of 4h
+    cache.agent_token("p1", timeout=4 * 3600)
+
+    assert short_calls == 1
+    assert client.projects_agent_token.call_count == 2
+
+
+def test_executors_creds_invalidate_refused(mocker: MockerFixture, tempdir):
+    client = mocker.MagicMock()
+    client._addr = "http://localhost:8000"
+    client.projects_private_key.return_value = "priv"
+    client.projects_agent_token.return_value = _token_rsp(time.time() + 3600)
+    cache = CredsCache(client, path=tempdir)
+    invalidate = mocker.spy(cache, "invalidate")
+    mocker.patch("labfunctions.executors.nbtask_base.DockerCommand.pull_image")
+    mocker.patch(
+        "labfunctions.executors.nbtask_base.DockerCommand.__init__", return_value=None
+    )
+    run = mocker.patch("labfunctions.executors.nbtask_base.DockerCommand.run")
+    task = NBTaskDocker(client, ctx_dir=tempdir, creds=cache)
+
+    run.return_value = DockerRunResult(msg="Error: 500", status=1)
+    task.run(ExecutionNBTaskFactory(projectid="p1", runtime="lab:0.1", timeout=60))
+    run.return_value = DockerRunResult(msg="AuthValidationFailed", status=1)
+    task.run(ExecutionNBTaskFactory(projectid="p1", runtime="lab:0.1", timeout=60))
+
+    assert auth_failed("Client error '401 Unauthorized' for url")
+    assert not auth_failed(None)
+    invalidate.assert_called_once_with("p1")
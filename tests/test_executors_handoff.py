@@ -0,0 +1,76 @@
+import json
+import os
+import stat
+
+from pytest_mock import MockerFixture
+
+from labfunctions import defaults
+from labfunctions.commands import DockerRunResult
+from labfunctions.executors.handoff import (
+    child_handoff,
+    load_handoff,
+    task_context,
+    write_handoff,
+)
+from labfunctions.executors.nbtask_base import NBTaskDocker
+
+from .factories import ExecutionNBTaskFactory
+
+
+def test_executors_handoff_write_load(mocker: MockerFixture, tempdir):
+    params = {
+        "partitions": [
+            f"2022-01-{d:02}/part-{n}" for d in range(1, 31) for n in range(500)
+        ]
+    }
+    env = {defaults.EXECUTIONTASK_VAR: json.dumps(params), "LF_TEST_KEY": "key"}
+    mocker.patch.dict(os.environ, {"LF_TEST_KEY": "defined"})
+
+    path = write_handoff(env, tempdir)
+    loaded = load_handoff(path)
+    child = child_handoff({**env, "LF_TEST_OTHER": "other"}, tempdir)
+
+    assert loaded
+    assert not load_handoff()
+    assert stat.S_IMODE(os.stat(f"{tempdir}/lf-ctx").st_mode) == 0o700
+    # the context is read from the file, never from the env
+    assert defaults.EXECUTIONTASK_VAR not in os.environ
+    assert task_context(path) == params
+    assert os.environ["LF_TEST_KEY"] == "defined"
+    assert defaults.EXECUTIONTASK_VAR not in child
+    assert child["LF_TEST_OTHER"] == "other"
+    assert task_context(child[defaults.CTX_FILE_VAR]) == params
+
+
+def test_executors_handoff_docker(mocker: MockerFixture, tempdir):
+    client = mocker.MagicMock()
+    client._addr = "http://localhost:8000"
+    client.projects_private_key.return_value = "priv"
+    creds = client.projects_agent_token.return_value.creds
+    creds.access_token, creds.refresh_token = "access", "refresh"
+    run = mocker.patch("labfunctions.executors.nbtask_base.DockerCommand.run")
+    mocker.patch("labfunctions.executors.nbtask_base.DockerCommand.pull_image")
+    mocker.patch(
+        "labfunctions.executors.nbtask_base.DockerCommand.__init__", return_value=None
+    )
+    ctx = ExecutionNBTaskFactory(runtime="nuxion/lab:0.1")
+    seen = {}
+
+    def _run(cmd, image, **kwargs):
+        volume = kwargs["volumes"][0]
+        with open(volume.orig_mount) as f:
+            seen.update(json.load(f))
+        seen["mount"] = volume.dst_mount
+        seen["env"] = kwargs["env_data"]
+        return DockerRunResult(msg="ok", status=0)
+
+    run.side_effect = _run
+    result = NBTaskDocker(client, ctx_dir=tempdir).run(ctx)
+
+    assert not result.error
+    assert seen["env"] == {defaults.CTX_FILE_VAR: defaults.CTX_FILE_MOUNT}
+    assert seen["mount"] == defaults.CTX_FILE_MOUNT
+    assert seen[defaults.PRIVKEY_VAR_NAME] == "priv"
+    assert seen["LF_AGENT_TOKEN"] == "access"
+    assert json.loads(seen[defaults.EXECUTIONTASK_VAR])["execid"] == ctx.execid
+    assert os.listdir(f"{tempdir}/lf-ctx") == []
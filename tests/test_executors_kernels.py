@@ -0,0 +1,88 @@
+import os
+
+import nbformat
+import papermill as pm
+import pytest
+
+from labfunctions import defaults
+from labfunctions.executors.kernels import ENGINE_NAME, KernelPool
+from labfunctions.executors.warm import run_forked
+
+
+def _notebook(path: str):
+    nb = nbformat.v4.new_notebook()
+    nb.metadata["kernelspec"] = {
+        "name": "python3",
+        "language": "python",
+        "display_name": "Python 3",
+    }
+    nb.cells = [
+        nbformat.v4.new_code_cell("value = None", metadata={"tags": ["parameters"]}),
+        nbformat.v4.new_code_cell(
+            "import os, sys\n"
+            "leaked = 'previous' in globals()\n"
+            "previous = value\n"
+            "print(os.getpid(), os.environ['LF_TEST_VAR'], leaked, 'json' in sys.modules)"
+        ),
+    ]
+    nbformat.write(nb, path)
+
+
+@pytest.fixture
+def kernels():
+    pool = KernelPool(preload=["json"], max_runs=2)
+    yield pool
+    pool.shutdown()
+
+
+def test_executors_kernels_warm_run(kernels, tempdir):
+    _notebook(f"{tempdir}/in.ipynb")
+
+    def _run() -> int:
+        pm.execute_notebook(
+            f"{tempdir}/in.ipynb",
+            f"{tempdir}/out.ipynb",
+            parameters={"value": os.environ["LF_TEST_VAR"]},
+            engine_name=ENGINE_NAME,
+        )
+        out = nbformat.read(f"{tempdir}/out.ipynb", as_version=4)
+        print(out.cells[-1].outputs[0]["text"])
+        return 0
+
+    outputs = []
+    pids = []
+    for n in range(3):
+        wk = kernels.acquire()
+        pids.append(wk.pid)
+        env = {"LF_TEST_VAR": f"run{n}", defaults.WARM_KERNEL_VAR: wk.info()}
+        status, logs = run_forked(env, _run)
+        kernels.release(wk)
+        assert status == 0, logs
+        outputs.append(logs.strip().splitlines()[-1].split())
+
+    # the kernel is kept between runs and recycled after max_runs
+    assert pids[0] == pids[1] != pids[2]
+    assert [o[0] for o in outputs] == [str(p) for p in pids]
+    assert [o[1] for o in outputs] == ["run0", "run1", "run2"]
+    # namespace reset between runs, preloaded modules kept
+    assert [o[2] for o in outputs] == ["False"] * 3
+    assert [o[3] for o in outputs] == ["True"] * 3
+    assert "LF_TEST_VAR" not in os.environ
+
+
+def test_executors_kernels_fallback(tempdir):
+    """Without a warm kernel, the engine starts its own kernel"""
+    _notebook(f"{tempdir}/in.ipynb")
+    os.environ["LF_TEST_VAR"] = "cold"
+    try:
+        pm.execute_notebook(
+            f"{tempdir}/in.ipynb",
+            f"{tempdir}/out.ipynb",
+            parameters={"value": 1},
+            engine_name=ENGINE_NAME,
+        )
+    finally:
+        del os.environ["LF_TEST_VAR"]
+    out = nbformat.read(f"{tempdir}/out.ipynb", as_version=4)
+
+    assert "cold False" in out.cells[-1].outputs[0]["text"]
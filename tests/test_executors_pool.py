@@ -0,0 +1,144 @@
+import os
+import threading
+
+import pytest
+from pytest_mock import MockerFixture
+
+from labfunctions import defaults
+from labfunctions.executors.handoff import task_context
+from labfunctions.executors.nbtask_base import NBTaskDocker
+from labfunctions.executors.pool import POOL_TOKEN_LABEL, ContainerPool, PooledContainer
+from labfunctions.executors.warm import WarmServer, run_forked
+from labfunctions.types.docker import DockerRunResult
+
+from .factories import ExecutionNBTaskFactory
+
+
+def _task() -> int:
+    ctx = task_context() or {}
+    in_env = defaults.EXECUTIONTASK_VAR in os.environ
+    print(f"running {os.environ['LF_TEST_VAR']} {ctx.get('execid')} {in_env}")
+    return 3
+
+
+@pytest.fixture
+def warm_server():
+    server = WarmServer("127.0.0.1", 0, token="secret", func=_task)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _container(mocker: MockerFixture, cid: str, addr="127.0.0.1"):
+    c = mocker.MagicMock()
+    c.id = cid
+    c.name = cid
+    c.labels = {POOL_TOKEN_LABEL: "secret"}
+    c.attrs = {"NetworkSettings": {"IPAddress": addr}}
+    return c
+
+
+def test_executors_pool_run_forked():
+    status, logs = run_forked({"LF_TEST_VAR": "forked"}, _task)
+
+    assert status == 3
+    assert "running forked" in logs
+    assert "LF_TEST_VAR" not in os.environ
+
+
+def test_executors_pool_warm_run(mocker: MockerFixture, tempdir, warm_server):
+    port = warm_server.server_address[1]
+    pool = ContainerPool(mocker.MagicMock(), port=port, lock_dir=tempdir)
+    lock = open(f"{tempdir}/test.lock", "a")
+    pc = PooledContainer(_container(mocker, "c1"), "127.0.0.1", "secret", lock)
+    wrong = PooledContainer(_container(mocker, "c2"), "127.0.0.1", "bad", lock)
+
+    env = {"LF_TEST_VAR": "warm", defaults.EXECUTIONTASK_VAR: '{"execid": "ex1"}'}
+    result = pool.run(pc, env, timeout=10)
+    denied = pool.run(wrong, env, timeout=10)
+
+    assert result.status == 3
+    # the context is read from a file, it isn't in the env of the task
+    assert "running warm ex1 False" in result.msg
+    assert pc.tasks == 1
+    assert denied.status == -4
+
+
+def test_executors_pool_acquire(mocker: MockerFixture, tempdir):
+    client = mocker.MagicMock()
+    c1 = _container(mocker, "c1")
+    client.containers.list.return_value = [c1]
+    pool = ContainerPool(client, size=1, max_tasks=2, lock_dir=tempdir)
+
+    first = pool.acquire("lab:0.1")
+    busy = pool.acquire("lab:0.1")
+    first.tasks = 1
+    pool.release(first)
+    again = pool.acquire("lab:0.1")
+    again.tasks = 2
+    pool.release(again)
+
+    assert first.container is c1
+    assert first.token == "secret"
+    assert busy is None
+    assert again.container is c1
+    assert c1.remove.call_count == 1
+    assert not client.containers.run.called
+
+
+def test_executors_pool_recycle_memory(mocker: MockerFixture, tempdir):
+    pool = ContainerPool(mocker.MagicMock(), max_mem_mb=100, lock_dir=tempdir)
+    lock = open(f"{tempdir}/test.lock", "a")
+    pc = PooledContainer(_container(mocker, "c1"), "127.0.0.1", "secret", lock)
+
+    pc.memory = 50 * 2**20
+    keep = pool.should_recycle(pc)
+    pc.memory = 200 * 2**20
+    grown = pool.should_recycle(pc)
+
+    assert not keep
+    assert grown
+
+
+def test_executors_pool_warm_cmd(mocker: MockerFixture, tempdir):
+    cold = ContainerPool(mocker.MagicMock(), port=9000, lock_dir=tempdir)
+    pool = ContainerPool(
+        mocker.MagicMock(),
+        port=9000,
+        lock_dir=tempdir,
+        kernels=True,
+        kernel_preload=["pandas", "sklearn"],
+    )
+
+    assert cold.warm_cmd() == "lab exec warm --port 9000"
+    assert "--kernels" in pool.warm_cmd()
+    assert pool.warm_cmd().endswith("--preload pandas,sklearn")
+
+
+def test_executors_pool_task_requests(mocker: MockerFixture, tempdir):
+    client = mocker.MagicMock()
+    client._addr = "http://localhost:8000"
+    client.projects_private_key.return_value = "priv"
+    creds = client.projects_agent_token.return_value.creds
+    creds.access_token, creds.refresh_token = "access", "refresh"
+    pool = mocker.MagicMock()
+    pool.run.return_value = DockerRunResult(msg="ok", status=0)
+    mocker.patch("labfunctions.executors.nbtask_base.DockerCommand.pull_image")
+    mocker.patch(
+        "labfunctions.executors.nbtask_base.DockerCommand.__init__", return_value=None
+    )
+    run = mocker.patch(
+        "labfunctions.executors.nbtask_base.DockerCommand.run",
+        return_value=DockerRunResult(msg="ok", status=0),
+    )
+    task = NBTaskDocker(client, pool=pool, ctx_dir=tempdir)
+
+    task.run(ExecutionNBTaskFactory(runtime="lab:0.1", cpus=None, memory_mb=None))
+    # a task with requests runs limited in its own container
+    task.run(ExecutionNBTaskFactory(runtime="lab:0.1", cpus=None, memory_mb=256))
+
+    assert pool.acquire.call_count == 1
+    assert pool.run.call_count == 1
+    assert run.call_args[1]["resources"].mem_limit == 256 * 2**20
@@ -0,0 +1,50 @@
+import nbformat
+import papermill as pm
+
+from labfunctions.executors.profile import CellMemory, cell_marks, notebook_profile
+
+
+def _notebook(path: str):
+    nb = nbformat.v4.new_notebook()
+    nb.metadata["kernelspec"] = {
+        "name": "python3",
+        "language": "python",
+        "display_name": "Python 3",
+    }
+    nb.cells = [
+        nbformat.v4.new_code_cell("import time"),
+        nbformat.v4.new_markdown_cell("# Load"),
+        nbformat.v4.new_code_cell("# sleeps\ntime.sleep(0.3)"),
+        nbformat.v4.new_code_cell(
+            "data = bytearray(80 * 2**20)\n"
+            "data[::4096] = b'x' * len(data[::4096])\n"
+            "del data"
+        ),
+        nbformat.v4.new_code_cell("x = 1"),
+    ]
+    nbformat.write(nb, path)
+
+
+def test_executors_profile_notebook(tempdir):
+    _notebook(f"{tempdir}/in.ipynb")
+    memory = CellMemory()
+
+    nb = pm.execute_notebook(
+        f"{tempdir}/in.ipynb",
+        f"{tempdir}/out.ipynb",
+        on_cell_executed=memory,
+        kernel_manager_class=memory.manager_class(),
+    )
+    cells = notebook_profile(nb, memory.peaks)
+    by_ix = {c.ix: c for c in cells}
+
+    assert [c.ix for c in cells] == [0, 2, 3, 4]
+    assert by_ix[2].secs >= 0.3
+    assert by_ix[2].src == "# sleeps"
+    assert memory.pid == memory.km.provisioner.pid
+    assert by_ix[3].peak_mb - by_ix[0].peak_mb > 60
+    # the buffer was freed in cell 3, the peak is reset after it
+    assert by_ix[3].peak_mb - by_ix[4].peak_mb > 60
+    marks = cell_marks(nb)
+    assert marks["kernel"] < marks["first_cell"] < marks["last_cell"]
+    assert marks["last_cell"] - marks["first_cell"] >= 0.3
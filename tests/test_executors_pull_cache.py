@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+from libq.types import JobPayload, JobStatus
+from pytest_mock import MockerFixture
+
+import docker
+from labfunctions.control import JobManager
+from labfunctions.executors.pull_cache import PullCache, split_image
+from labfunctions.hashes import generate_random
+
+
+def _client(mocker: MockerFixture, local="sha256:aaa", remote="sha256:aaa"):
+    client = mocker.MagicMock()
+    state = {"local": local}
+
+    def get(image):
+        if not state["local"]:
+            raise docker.errors.ImageNotFound("not found")
+        img = mocker.MagicMock()
+        img.id = "sha256:imageid"
+        img.attrs = {"RepoDigests": [f"{split_image(image)[0]}@{state['local']}"]}
+        return img
+
+    def pull(repo, tag=None):
+        state["local"] = client.images.get_registry_data.return_value.id
+
+    client.images.get.side_effect = get
+    client.images.pull.side_effect = pull
+    client.images.get_registry_data.return_value.id = remote
+    return client, state
+
+
+def test_executors_pull_cache_split_image():
+    assert split_image("nuxion/lab:0.1") == ("nuxion/lab", "0.1")
+    assert split_image("localhost:5000/lab:0.1") == ("localhost:5000/lab", "0.1")
+    assert split_image("localhost:5000/lab") == ("localhost:5000/lab", "latest")
+    assert split_image("lab") == ("lab", "latest")
+
+
+def test_executors_pull_cache_missing(mocker: MockerFixture, tempdir):
+    client, _ = _client(mocker, local=None)
+    cache = PullCache(client, path=f"{tempdir}/pulls.json")
+
+    pulled = cache.ensure("nuxion/lab:0.1")
+    again = cache.ensure("nuxion/lab:0.1")
+
+    assert pulled
+    assert not again
+    assert client.images.pull.call_count == 1
+    # the second check is inside the ttl, the registry isn't asked
+    assert client.images.get_registry_data.call_count == 0
+
+
+def test_executors_pull_cache_ttl(mocker: MockerFixture, tempdir):
+    client, state = _client(mocker)
+    cache = PullCache(client, path=f"{tempdir}/pulls.json", ttl=0)
+
+    first = cache.ensure("nuxion/lab:0.1")
+    client.images.get_registry_data.return_value.id = "sha256:bbb"
+    second = cache.ensure("nuxion/lab:0.1")
+
+    assert not first
+    assert second
+    assert state["local"] == "sha256:bbb"
+    assert client.images.get_registry_data.call_count == 2
+    assert client.images.pull.call_count == 1
+
+
+def test_executors_pull_cache_mutable(mocker: MockerFixture, tempdir):
+    client, _ = _client(mocker)
+    path = f"{tempdir}/pulls.json"
+    PullCache(client, path=path).prepull(["nuxion/lab:0.1", "nuxion/lab:latest"])
+
+    # a new process reads the digests checked by the previous one
+    cache = PullCache(client, path=path)
+    client.images.get_registry_data.reset_mock()
+    cache.ensure("nuxion/lab:0.1")
+    cache.ensure("nuxion/lab:latest")
+
+    assert client.images.get_registry_data.call_count == 1
+    assert not client.images.pull.called
+
+
+def test_executors_pull_cache_lock_by_image(mocker: MockerFixture, tempdir):
+    client, _ = _client(mocker)
+    cache = PullCache(client, path=f"{tempdir}/pulls.json")
+    checking, done = threading.Event(), threading.Event()
+    registry = client.images.get_registry_data.return_value
+
+    def slow_registry(image):
+        if image == "nuxion/big:0.1":
+            checking.set()
+            done.wait(5)
+        return registry
+
+    client.images.get_registry_data.side_effect = slow_registry
+    big = threading.Thread(target=cache.ensure, args=("nuxion/big:0.1",))
+    big.start()
+    checking.wait(5)
+    # another image doesn't wait for the registry check of big
+    pulled = cache.ensure("nuxion/lab:0.1")
+    waiting = big.is_alive()
+    done.set()
+    big.join()
+
+    assert not pulled
+    assert waiting
+    assert set(cache._read()) == {"nuxion/big:0.1", "nuxion/lab:0.1"}
+
+
+@pytest.mark.asyncio
+async def test_executors_pull_cache_runtimes_for(async_redis_web):
+    jm = JobManager(async_redis_web)
+    cluster = generate_random(6)
+    jobs = {
+        "gpu": ("nuxion/gpu:0.1", f"{cluster}.gpu"),
+        "cpu": ("nuxion/cpu:0.1", f"{cluster}.cpu"),
+        "other": ("nuxion/other:0.1", "other.cpu"),
+    }
+    for name, (runtime, queue) in jobs.items():
+        payload = JobPayload(
+            func_name=jm.tasks["workflow"],
+            jobid=f"{cluster}{name}",
+            timeout=60,
+            params={"data": {"runtime": runtime}},
+            queue=queue,
+            status=JobStatus.created.value,
+            created_ts=0,
+        )
+        await jm.store.put(payload.jobid, payload)
+
+    runtimes = await jm.runtimes_for([f"{cluster}.gpu", f"{cluster}.cpu"])
+
+    assert runtimes == {"nuxion/gpu:0.1", "nuxion/cpu:0.1"}
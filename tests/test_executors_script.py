@@ -0,0 +1,96 @@
+import nbformat
+from pytest_mock import MockerFixture
+
+from labfunctions.executors.nbtask_base import NBTaskLocal
+from labfunctions.executors.script import PARAMS_HOOK, ScriptCache, run_script
+from labfunctions.notebooks.utils import notebook_to_script
+
+from .factories import ExecutionNBTaskFactory
+
+
+def _notebook(path: str, last="print(value * 2)"):
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_code_cell("import math"),
+        nbformat.v4.new_code_cell("value = 1", metadata={"tags": ["parameters"]}),
+        nbformat.v4.new_markdown_cell("# Run"),
+        nbformat.v4.new_code_cell(last),
+    ]
+    nbformat.write(nb, path)
+    return nb
+
+
+def test_executors_script_source(tempdir):
+    nb = _notebook(f"{tempdir}/in.ipynb", last="%time x = 1")
+    source = notebook_to_script(nb, PARAMS_HOOK)
+    lines = source.splitlines()
+
+    assert lines.index(PARAMS_HOOK) == lines.index("value = 1") + 1
+    assert "get_ipython().run_line_magic('time', 'x = 1')" in lines
+    assert "# Run" not in source
+
+
+def test_executors_script_cache(mocker: MockerFixture, tempdir):
+    _notebook(f"{tempdir}/in.ipynb")
+    convert = mocker.spy(ScriptCache, "load")
+    to_script = mocker.patch(
+        "labfunctions.executors.script.notebook_to_script",
+        wraps=notebook_to_script,
+    )
+    cache = ScriptCache(f"{tempdir}/scripts")
+
+    code = cache.load(f"{tempdir}/in.ipynb")
+    again = ScriptCache(f"{tempdir}/scripts").load(f"{tempdir}/in.ipynb")
+    ScriptCache.compiled.clear()
+    from_file = ScriptCache(f"{tempdir}/scripts").load(f"{tempdir}/in.ipynb")
+    _notebook(f"{tempdir}/in.ipynb", last="print(value)")
+    changed = cache.load(f"{tempdir}/in.ipynb")
+
+    assert convert.call_count == 4
+    assert again is code
+    assert from_file is not code
+    assert to_script.call_count == 2
+    assert changed is not code
+
+
+def test_executors_script_run(tempdir):
+    _notebook(f"{tempdir}/in.ipynb")
+    code = ScriptCache(f"{tempdir}/scripts").load(f"{tempdir}/in.ipynb")
+    _notebook(f"{tempdir}/fail.ipynb", last="raise ValueError('bad value')")
+    failed = ScriptCache(f"{tempdir}/scripts").load(f"{tempdir}/fail.ipynb")
+
+    ok = run_script(code, {"value": 21})
+    default = run_script(code, {})
+    error = run_script(failed, {})
+    tail = run_script(code, {"value": "x" * 100}, max_stdout=10)
+
+    assert not ok.error
+    assert ok.stdout == "42\n"
+    assert default.stdout == "2\n"
+    assert error.error
+    assert "ValueError: bad value" in error.error_msg
+    assert tail.stdout == "x" * 9 + "\n"
+
+
+def test_executors_script_local(mocker: MockerFixture, tempdir):
+    _notebook(f"{tempdir}/in.ipynb")
+    mocker.patch(
+        "labfunctions.executors.script.tempfile.gettempdir", return_value=tempdir
+    )
+    ctx = ExecutionNBTaskFactory(
+        runtime="lab:0.1",
+        mode="script",
+        pm_input=f"{tempdir}/in.ipynb",
+        params={"value": 5},
+    )
+    client = mocker.MagicMock()
+    runner = NBTaskLocal(client)
+
+    result = runner.run(ctx)
+    runner.register(result)
+
+    assert not result.error
+    assert result.stdout == "10\n"
+    assert result.output_name is None
+    assert client.history_register.called
+    assert not client.history_nb_output.called
@@ -0,0 +1,127 @@
+from pytest_mock import MockerFixture
+
+from labfunctions.executors.nbtask_base import NBTaskDocker
+from labfunctions.executors.stats import StatsSampler, cpu_percent, io_bytes, mem_usage
+from labfunctions.types.docker import DockerRunResult
+
+from .factories import ExecutionNBTaskFactory
+
+MB = 2**20
+
+
+def _sample(cpu, system, pre_cpu, pre_system, mem_mb, read_mb=0, rx_mb=0):
+    return {
+        "read": "2022-05-01T10:00:01Z",
+        "cpu_stats": {
+            "cpu_usage": {"total_usage": cpu},
+            "system_cpu_usage": system,
+            "online_cpus": 2,
+        },
+        "precpu_stats": {
+            "cpu_usage": {"total_usage": pre_cpu},
+            "system_cpu_usage": pre_system,
+        },
+        "memory_stats": {
+            "usage": (mem_mb + 10) * MB,
+            "limit": 1024 * MB,
+            "stats": {"inactive_file": 10 * MB},
+        },
+        "blkio_stats": {
+            "io_service_bytes_recursive": [
+                {"op": "Read", "value": read_mb * MB},
+                {"op": "Write", "value": 0},
+            ]
+        },
+        "networks": {"eth0": {"rx_bytes": rx_mb * MB, "tx_bytes": 0}},
+    }
+
+
+SAMPLES = [
+    # first sample of the stream, without a previous one
+    _sample(100, 1000, 0, 0, mem_mb=100, read_mb=5, rx_mb=1),
+    _sample(200, 2000, 100, 1000, mem_mb=300, read_mb=25, rx_mb=2),
+    _sample(400, 3000, 200, 2000, mem_mb=200, read_mb=45, rx_mb=4),
+    # a stopped container
+    {"read": "0001-01-01T00:00:00Z", "memory_stats": {}},
+]
+
+
+def test_executors_stats_sample():
+    assert cpu_percent(SAMPLES[0]) is None
+    assert cpu_percent(SAMPLES[1]) == 20.0
+    assert mem_usage(SAMPLES[1]) == (300 * MB, 1024 * MB)
+    assert io_bytes(SAMPLES[2]) == (45 * MB, 0)
+    assert mem_usage(SAMPLES[3]) == (None, None)
+
+
+def test_executors_stats_sampler(mocker: MockerFixture):
+    container = mocker.MagicMock()
+    container.stats.return_value = iter(SAMPLES)
+    published = []
+    sampler = StatsSampler(interval=0, publish=published.append)
+
+    sampler.start(container)
+    sampler._thread.join(2)
+    usage = sampler.stop()
+
+    assert len(published) == 3
+    assert published[1]["mem"]["mem_usage"] == 300 * MB
+    assert published[2]["io"]["read"] == 40 * MB
+    assert usage.samples == 3
+    assert usage.cpu_avg == 30.0
+    assert usage.cpu_peak == 40.0
+    assert usage.mem_peak_mb == 300.0
+    assert usage.mem_avg_mb == 200.0
+    assert usage.mem_limit_mb == 1024.0
+    assert usage.io_read_mb == 40.0
+    assert usage.net_rx_mb == 3.0
+    assert StatsSampler().stop() is None
+
+
+def test_executors_stats_sampler_publish_errors(mocker: MockerFixture):
+    container = mocker.MagicMock()
+    container.stats.return_value = iter(SAMPLES)
+    publish = mocker.MagicMock(side_effect=ConnectionError("down"))
+    sampler = StatsSampler(interval=60, publish=publish)
+
+    sampler.start(container)
+    sampler._thread.join(2)
+    usage = sampler.stop()
+
+    assert publish.call_count == 1
+    assert usage.samples == 3
+
+
+def test_executors_stats_docker(mocker: MockerFixture, tempdir):
+    client = mocker.MagicMock()
+    client._addr = "http://localhost:8000"
+    client.projects_private_key.return_value = "priv"
+    creds = client.projects_agent_token.return_value.creds
+    creds.access_token, creds.refresh_token = "access", "refresh"
+    container = mocker.MagicMock()
+    container.stats.return_value = iter(SAMPLES)
+
+    def run(*args, sampler=None, **kwargs):
+        if sampler:
+            sampler.start(container)
+            sampler._thread.join(2)
+            sampler.stop()
+        return DockerRunResult(msg="ok", status=0)
+
+    mocker.patch("labfunctions.executors.nbtask_base.DockerCommand.pull_image")
+    mocker.patch(
+        "labfunctions.executors.nbtask_base.DockerCommand.__init__", return_value=None
+    )
+    mocker.patch(
+        "labfunctions.executors.nbtask_base.DockerCommand.run", side_effect=run
+    )
+    ctx = ExecutionNBTaskFactory(runtime="lab:0.1")
+
+    result = NBTaskDocker(client, ctx_dir=tempdir, stats_interval=0.01).run(ctx)
+    without = NBTaskDocker(client, ctx_dir=tempdir).run(ctx)
+
+    assert result.resources.mem_peak_mb == 300.0
+    assert without.resources is None
+    evt = client.events_publish.call_args
+    assert evt[0][0] == ctx.execid
+    assert evt[1] == {"event": "stats", "projectid": ctx.projectid}
@@ -1,11 +1,17 @@
+import json
+import os
+
 import pytest
 from pytest_mock import MockerFixture
 
 from labfunctions.defaults import API_VERSION
+from labfunctions.io.kv_local import AsyncKVLocal
+from labfunctions.io.streams import encode_file
 from labfunctions.managers import history_mg
 from labfunctions.managers.history_mg import HistoryLastResponse
 from labfunctions.models import HistoryModel
-from labfunctions.types import HistoryLastResponse
+from labfunctions.types import CellProfile, HistoryLastResponse, ResourceUsage
+from labfunctions.utils import today_string
 
 from .factories import (
     ExecutionResultFactory,
@@ -114,3 +120,255 @@ async def test_history_mg_create(async_session):
     assert isinstance(model_ok, HistoryModel)
     assert model_err.status == -1
     assert model_ok.status == 0
+
+
+@pytest.mark.asyncio
+async def test_history_mg_set_resources(async_session):
+    exec_ok = ExecutionResultFactory(projectid="test", error=False)
+    await history_mg.create(async_session, exec_ok)
+    usage = ResourceUsage(samples=3, mem_peak_mb=512.0, cpu_peak=180.0)
+
+    found = await history_mg.set_resources(async_session, "test", exec_ok.execid, usage)
+    other = await history_mg.set_resources(
+        async_session, "other", exec_ok.execid, usage
+    )
+    h = await history_mg.get_one(async_session, exec_ok.execid)
+
+    assert found
+    assert not other
+    assert h.result.resources == usage
+    assert h.result.execid == exec_ok.execid
+
+
+def _profiled(*secs, **kwargs):
+    cells = [CellProfile(ix=ix, secs=s, src=f"cell {ix}") for ix, s in enumerate(secs)]
+    return ExecutionResultFactory(cells=cells, **kwargs)
+
+
+def test_history_mg_cell_stats():
+    # newest first, as get_last returns them
+    results = [_profiled(1.0, 4.0), ExecutionResultFactory(), _profiled(1.0, 2.0, 0.5)]
+
+    profile = history_mg.cell_stats("wf", results, top=2)
+
+    assert profile.execids == [results[2].execid, results[0].execid]
+    assert [c.ix for c in profile.cells] == [1, 0]
+    assert profile.cells[0].secs == [2.0, 4.0]
+    assert profile.cells[0].mean_secs == 3.0
+    assert profile.cells[0].last_secs == 4.0
+
+
+def test_history_mg_timeline_samples():
+    results = [
+        ExecutionResultFactory(timeline={"enqueued": 10.0, "dequeued": 12.5}),
+        ExecutionResultFactory(),
+        ExecutionResultFactory(timeline={"enqueued": 10.0, "dequeued": 11.0}),
+    ]
+
+    samples = history_mg.timeline_samples(results)
+
+    assert samples["queue"] == [2.5, 1.0]
+    assert samples["total"] == [2.5, 1.0]
+    assert samples["pull"] == []
+
+
+def test_history_mg_compare_cells():
+    base = _profiled(1.0, 2.0)
+    other = _profiled(1.5, 2.0, 3.0)
+
+    cmp = history_mg.compare_cells(base, other)
+
+    assert cmp.base == base.execid
+    assert cmp.cells[0].delta_secs == 0.5
+    assert cmp.cells[0].ratio == 1.5
+    assert cmp.cells[2].base_secs is None
+    assert cmp.cells[2].other_secs == 3.0
+
+
+@pytest.mark.asyncio
+async def test_history_bp_profile(sanic_app, access_token, mocker: MockerFixture):
+    rows = HistoryLastResponse(
+        rows=[HistoryResultFactory(result=_profiled(1.0, 2.0)) for _ in range(2)]
+    )
+    mocker.patch("labfunctions.web.history_bp.history_mg.get_last", return_value=rows)
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    req, res = await sanic_app.asgi_client.get(
+        f"{version}/history/test/_profile/wf?lt=2&top=1", headers=headers
+    )
+
+    assert res.status_code == 200
+    assert res.json["cells"][0]["ix"] == 1
+    assert res.json["cells"][0]["runs"] == 2
+
+
+@pytest.mark.asyncio
+async def test_history_bp_timeline(sanic_app, access_token, mocker: MockerFixture):
+    rows = HistoryLastResponse(
+        rows=[
+            HistoryResultFactory(
+                result=ExecutionResultFactory(
+                    timeline={"enqueued": 1.0, "dequeued": 1.0 + ix}
+                )
+            )
+            for ix in range(3)
+        ]
+    )
+    mocker.patch("labfunctions.web.history_bp.history_mg.get_last", return_value=rows)
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    req, res = await sanic_app.asgi_client.get(
+        f"{version}/history/test/_timeline?lt=3", headers=headers
+    )
+
+    phases = {p["phase"]: p for p in res.json["phases"]}
+    assert res.status_code == 200
+    assert phases["queue"]["count"] == 3
+    assert phases["queue"]["p50"] == 1.0
+    assert phases["pull"]["count"] == 0
+
+
+@pytest.mark.asyncio
+async def test_history_bp_compare(sanic_app, access_token, mocker: MockerFixture):
+    base = HistoryResultFactory(result=_profiled(1.0, projectid="test"))
+    other = HistoryResultFactory(result=_profiled(2.0, projectid="test"))
+    mocker.patch(
+        "labfunctions.web.history_bp.history_mg.get_one", side_effect=[base, other]
+    )
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    req, res = await sanic_app.asgi_client.get(
+        f"{version}/history/test/_compare/{base.execid}/{other.execid}",
+        headers=headers,
+    )
+
+    assert res.status_code == 200
+    assert res.json["cells"][0]["ratio"] == 2.0
+
+
+@pytest.mark.asyncio
+async def test_history_bp_resources(sanic_app, access_token, mocker: MockerFixture):
+    set_resources = mocker.patch(
+        "labfunctions.web.history_bp.history_mg.set_resources",
+        side_effect=[True, False],
+    )
+    headers = {"Authorization": f"Bearer {access_token}"}
+    usage = ResourceUsage(samples=2, mem_peak_mb=100.0)
+
+    req, res = await sanic_app.asgi_client.post(
+        f"{version}/history/test/_resources/exec1", headers=headers, json=usage.dict()
+    )
+    req, res404 = await sanic_app.asgi_client.post(
+        f"{version}/history/test/_resources/exec2", headers=headers, json=usage.dict()
+    )
+
+    assert res.status_code == 204
+    assert res404.status_code == 404
+    assert set_resources.call_args_list[0][0][1:] == ("test", "exec1", usage)
+
+
+@pytest.mark.asyncio
+async def test_history_bp_task_batch(
+    sanic_app, async_redis_web, access_token, mocker: MockerFixture
+):
+    mocker.patch("labfunctions.web.history_bp.defaults.TASK_BATCH_MAX", 2)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    req, res = await sanic_app.asgi_client.post(
+        f"{version}/history/task/_batch",
+        json={"execids": ["nf0", "nf1"], "statuses": {"nf0": "not_found"}},
+        headers=headers,
+    )
+    req, res_400 = await sanic_app.asgi_client.post(
+        f"{version}/history/task/_batch",
+        json={"execids": ["nf0", "nf1", "nf2"]},
+        headers=headers,
+    )
+
+    assert res.status_code == 200
+    assert res.json["tasks"] == {"nf0": None, "nf1": None}
+    assert res.json["changed"] == ["nf1"]
+    assert res_400.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("encoding", ["identity", "gzip", "zstd"])
+async def test_history_bp_put_output(
+    sanic_app, access_token, tempdir, encoding, mocker: MockerFixture
+):
+    nb = {"cells": [{"outputs": [{"data": "x" * 100_000}]}]}
+    nb_file = f"{tempdir}/out.ipynb"
+    with open(nb_file, "w") as f:
+        json.dump(nb, f)
+    kv = AsyncKVLocal(f"{tempdir}/store")
+    mocker.patch("labfunctions.web.history_bp.get_kvstore", return_value=kv)
+    body = b"".join(encode_file(nb_file, encoding, chunk_size=4096))
+
+    req, res = await sanic_app.asgi_client.post(
+        f"{version}/history/test/_put_output",
+        params={"output_name": "wfid.nb.execid.ipynb", "status": "errors"},
+        headers={
+            "Authorization": f"Bearer {access_token}",
+            "Content-Encoding": encoding,
+        },
+        content=body,
+    )
+    stored = await kv.get(
+        f"test/outputs/errors/{today_string(format_='day')}/wfid.nb.execid.ipynb"
+    )
+
+    assert res.status_code == 201
+    assert json.loads(stored) == nb
+    if encoding != "identity":
+        assert len(body) < 1000
+
+
+@pytest.mark.asyncio
+async def test_history_bp_put_output_invalid(sanic_app, access_token):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    req, res = await sanic_app.asgi_client.post(
+        f"{version}/history/test/_put_output",
+        params={"output_name": "../../other.ipynb"},
+        headers=headers,
+        content=b"{}",
+    )
+    req, res2 = await sanic_app.asgi_client.post(
+        f"{version}/history/test/_put_output",
+        params={"output_name": "nb.ipynb"},
+        headers={**headers, "Content-Encoding": "br"},
+        content=b"{}",
+    )
+
+    assert res.status_code == 400
+    assert res2.status_code == 415
+
+
+@pytest.mark.asyncio
+async def test_history_bp_put_output_rejected(
+    sanic_app, access_token, tempdir, mocker: MockerFixture
+):
+    nb_file = f"{tempdir}/out.ipynb"
+    with open(nb_file, "wb") as f:
+        f.write(b"a" * 2_000_000)
+    kv = AsyncKVLocal(f"{tempdir}/store")
+    mocker.patch("labfunctions.web.history_bp.get_kvstore", return_value=kv)
+    mocker.patch("labfunctions.web.history_bp.settings.REQUEST_MAX_SIZE", 100_000)
+    headers = {"Authorization": f"Bearer {access_token}", "Content-Encoding": "gzip"}
+    params = {"output_name": "wfid.nb.execid.ipynb", "status": "ok"}
+    stored = f"{tempdir}/store/test/outputs/ok/{today_string(format_='day')}"
+
+    req, big = await sanic_app.asgi_client.post(
+        f"{version}/history/test/_put_output",
+        params=params,
+        headers=headers,
+        content=b"".join(encode_file(nb_file, "gzip")),
+    )
+    req, corrupt = await sanic_app.asgi_client.post(
+        f"{version}/history/test/_put_output",
+        params=params,
+        headers=headers,
+        content=b"not gzip data",
+    )
+
+    assert big.status_code == 413
+    assert corrupt.status_code == 400
+    assert not os.path.exists(f"{stored}/wfid.nb.execid.ipynb")
@@ -0,0 +1,27 @@
+import os
+
+from pytest_mock import MockerFixture
+
+from labfunctions import defaults
+from labfunctions.hashes import generate_random
+from labfunctions.io.cache import get_map_results, put_map_result
+
+
+def test_io_cache_map_results(mocker: MockerFixture, tempdir):
+    mocker.patch.dict(os.environ, {defaults.CACHE_DIR_VAR: tempdir})
+    mapid = f"map{generate_random(8)}"
+    for index, partition in enumerate(["d1", "d2"]):
+        put_map_result(
+            {"rows": partition * 2},
+            {"MAPID": mapid, "MAP_INDEX": index},
+            strategy="local",
+        )
+    reduce_globals = {
+        "MAPID": mapid,
+        "MAP_RESULTS": [{"index": 1}, {"index": 0}, {"index": 2}],
+    }
+
+    results = get_map_results(reduce_globals, strategy="local")
+
+    assert results == [{"rows": "d2d2"}, {"rows": "d1d1"}, None]
+    assert len(os.listdir(tempdir)) == 4
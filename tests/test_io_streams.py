@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from labfunctions.io.streams import (
+    INFLATE_CHUNK,
+    StreamDecodeError,
+    StreamTooLarge,
+    _ZstdInflater,
+    decode_stream,
+    encode_file,
+)
+
+
+async def _agen(chunks):
+    for c in chunks:
+        yield c
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("encoding", ["identity", "gzip", "zstd"])
+async def test_io_streams_roundtrip(tempdir, encoding):
+    data = os.urandom(50_000) + b"a" * 200_000
+    with open(f"{tempdir}/nb.ipynb", "wb") as f:
+        f.write(data)
+
+    chunks = list(encode_file(f"{tempdir}/nb.ipynb", encoding, chunk_size=4096))
+    decoded = [c async for c in decode_stream(_agen(chunks), encoding)]
+
+    assert b"".join(decoded) == data
+    if encoding != "identity":
+        assert sum(len(c) for c in chunks) < 100_000
+
+
+@pytest.mark.asyncio
+async def test_io_streams_max_size(tempdir):
+    with open(f"{tempdir}/nb.ipynb", "wb") as f:
+        f.write(b"a" * 1_000_000)
+    chunks = list(encode_file(f"{tempdir}/nb.ipynb", "gzip"))
+
+    with pytest.raises(StreamTooLarge):
+        async for _ in decode_stream(_agen(chunks), "gzip", max_size=1000):
+            pass
+    with pytest.raises(KeyError):
+        list(encode_file(f"{tempdir}/nb.ipynb", "br"))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+async def test_io_streams_bomb(tempdir, encoding):
+    with open(f"{tempdir}/nb.ipynb", "wb") as f:
+        f.write(b"a" * 20_000_000)
+    # one small chunk which inflates to 20MB
+    body = b"".join(encode_file(f"{tempdir}/nb.ipynb", encoding))
+    sizes = []
+
+    with pytest.raises(StreamTooLarge):
+        async for chunk in decode_stream(_agen([body]), encoding, max_size=100_000):
+            sizes.append(len(chunk))
+
+    assert len(body) < 100_000
+    assert max(sizes, default=0) <= INFLATE_CHUNK
+    if encoding == "zstd":
+        # zstd is stopped while it inflates the chunk
+        inflater = _ZstdInflater(limit=100_000)
+        with pytest.raises(StreamTooLarge):
+            inflater.decompress(body)
+        assert inflater.total <= 100_000 + INFLATE_CHUNK
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+async def test_io_streams_corrupt(tempdir, encoding):
+    with open(f"{tempdir}/nb.ipynb", "wb") as f:
+        f.write(os.urandom(10_000))
+    body = b"".join(encode_file(f"{tempdir}/nb.ipynb", encoding))
+
+    with pytest.raises(StreamDecodeError):
+        async for _ in decode_stream(_agen([b"not compressed"]), encoding):
+            pass
+    if encoding == "gzip":
+        with pytest.raises(StreamDecodeError):
+            async for _ in decode_stream(_agen([body[:-100]]), encoding):
+                pass
+
+
+@pytest.mark.asyncio
+async def test_io_streams_zstd_truncated(tempdir):
+    with open(f"{tempdir}/nb.ipynb", "wb") as f:
+        f.write(os.urandom(10_000) + b"a" * 200_000)
+    body = b"".join(encode_file(f"{tempdir}/nb.ipynb", "zstd"))
+    # headers split between chunks
+    chunks = [body[ix : ix + 7] for ix in range(0, len(body), 7)]
+
+    decoded = [c async for c in decode_stream(_agen(chunks), "zstd")]
+    assert len(b"".join(decoded)) == 210_000
+    for cut in [len(body) // 2, len(body) - 1, 3]:
+        with pytest.raises(StreamDecodeError):
+            async for _ in decode_stream(_agen([body[:cut]]), "zstd"):
+                pass
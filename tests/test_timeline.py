@@ -0,0 +1,50 @@
+from labfunctions import timeline
+
+
+def test_timeline_phases():
+    marks = {
+        "enqueued": 100.0,
+        "dequeued": 101.5,
+        "creds": 101.6,
+        "pulled": 103.6,
+        "started": 105.0,
+        "last_cell": 110.0,
+        "registered": 110.5,
+    }
+
+    phases = timeline.phases(marks)
+
+    assert list(phases) == [
+        "queue",
+        "creds",
+        "pull",
+        "container",
+        "cells",
+        "register",
+        "total",
+    ]
+    assert phases["queue"] == 1.5
+    # missing marks fold into the next phase
+    assert phases["cells"] == 5.0
+    assert phases["total"] == 10.5
+    assert timeline.phases({"dequeued": 1.0}) == {}
+
+
+def test_timeline_mark():
+    marks = {}
+    timeline.mark(marks, "enqueued", 10.12345)
+    timeline.mark(marks, "dequeued")
+
+    assert marks["enqueued"] == 10.123
+    assert marks["dequeued"] > marks["enqueued"]
+
+
+def test_timeline_phase_latency():
+    p = timeline.phase_latency("enqueue", [float(x) for x in range(100, 0, -1)])
+    empty = timeline.phase_latency("total", [])
+
+    assert p.count == 100
+    assert p.p50 == 51.0
+    assert p.p99 == 99.0
+    assert p.max == 100.0
+    assert empty.p95 is None